@@ -0,0 +1,203 @@
+"""alert_stream.py
+Monitor de alertas dentro de la API: una sola conexión al stream de todas las
+alertas de la cuenta, repartida por alerta entre los suscriptores (SSE):
+AlertHub, Subscriber, get_hub, close_hubs
+"""
+from __future__ import annotations
+import asyncio
+import os
+import random
+import time
+from collections import Counter, deque
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List
+
+from shodan_limiter import key_id
+from stream_stats import ProcesadorEventos
+
+#eventos pendientes por suscriptor; si no lee a tiempo se descartan los más antiguos
+SUBSCRIBER_QUEUE = int(os.getenv("ALERT_SUBSCRIBER_QUEUE", "500"))
+STREAM_BACKOFF_MAX = 60.0
+
+
+def alert_id_de(banner: Dict[str, Any]) -> str | None:
+    #el stream de alertas marca cada banner con la alerta que lo disparó
+    alerta = (banner.get("_shodan") or {}).get("alert") or banner.get("alert") or {}
+    return alerta.get("id") if isinstance(alerta, dict) else None
+
+
+def normalizar(banner: Dict[str, Any]) -> Dict[str, Any]:
+    alerta = (banner.get("_shodan") or {}).get("alert") or banner.get("alert") or {}
+    return {
+        "alert_id": alert_id_de(banner),
+        "alert_name": alerta.get("name") if isinstance(alerta, dict) else None,
+        "timestamp": banner.get("timestamp"),
+        "ip_str": banner.get("ip_str"),
+        "port": banner.get("port"),
+        "transport": banner.get("transport"),
+        "module": (banner.get("_shodan") or {}).get("module"),
+        "product": banner.get("product"),
+        "data": (banner.get("data") or "")[:2000],
+    }
+
+
+class Subscriber:
+    """cola acotada de un cliente: push nunca bloquea al hub (drop-oldest)."""
+
+    def __init__(self, alert_ids: Iterable[str] | None = None, maxsize: int = SUBSCRIBER_QUEUE):
+        self.alert_ids = set(alert_ids or ()) or None
+        self.queue: deque = deque(maxlen=max(1, maxsize))
+        self.delivered = 0
+        self.dropped = 0
+        self.created_at = time.time()
+        self._ready = asyncio.Event()
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        return self.alert_ids is None or event.get("alert_id") in self.alert_ids
+
+    def push(self, event: Dict[str, Any]) -> None:
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(event)
+        self._ready.set()
+
+    async def get(self, timeout: float | None = None) -> Dict[str, Any] | None:
+        """siguiente evento; None si pasa timeout sin ninguno (latido del SSE)."""
+        while not self.queue:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self.delivered += 1
+        return self.queue.popleft()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"alerts": sorted(self.alert_ids) if self.alert_ids else None, "pending": len(self.queue),
+                "delivered": self.delivered, "dropped": self.dropped, "since": self.created_at}
+
+
+class AlertHub:
+    """
+    consume el stream de todas las alertas de una clave mientras haya
+    suscriptores y reparte cada evento entre los que siguen esa alerta.
+    Los repetidos de la ventana de deduplicación no se reparten y cada alerta
+    acumula agregados por minuto (ProcesadorEventos) para los dashboards.
+    La conexión se reabre con backoff exponencial si se corta.
+    """
+
+    def __init__(self, api_key: str, stream_factory: Callable[[], AsyncIterator[Dict[str, Any]]] | None = None):
+        self.api_key = api_key
+        self._stream_factory = stream_factory or self._stream_shodan
+        self.subscribers: List[Subscriber] = []
+        self.events = 0
+        self.por_alerta: Counter = Counter()
+        self.procesadores: Dict[str | None, ProcesadorEventos] = {}
+        self.reconnects = 0
+        self.connected = False
+        self.last_error: str | None = None
+        self.last_event_at: float | None = None
+        self._task: asyncio.Task | None = None
+
+    def _stream_shodan(self) -> AsyncIterator[Dict[str, Any]]:
+        from shodan_async import AsyncShodan
+        return AsyncShodan(self.api_key).stream_alert()
+
+    def subscribe(self, alert_ids: Iterable[str] | None = None, maxsize: int = SUBSCRIBER_QUEUE) -> Subscriber:
+        sub = Subscriber(alert_ids, maxsize)
+        self.subscribers.append(sub)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return sub
+
+    async def unsubscribe(self, sub: Subscriber) -> None:
+        if sub in self.subscribers:
+            self.subscribers.remove(sub)
+        #sin nadie escuchando no se mantiene la conexión con Shodan
+        if not self.subscribers:
+            await self.stop()
+
+    def publish(self, banner: Dict[str, Any]) -> None:
+        event = normalizar(banner)
+        self.events += 1
+        self.por_alerta[event["alert_id"]] += 1
+        self.last_event_at = time.time()
+        if not self.procesador(event["alert_id"]).add(event, self.last_event_at):
+            return
+        for sub in self.subscribers:
+            if sub.wants(event):
+                sub.push(event)
+
+    def procesador(self, alert_id: str | None) -> ProcesadorEventos:
+        proc = self.procesadores.get(alert_id)
+        if proc is None:
+            proc = self.procesadores[alert_id] = ProcesadorEventos()
+        return proc
+
+    def aggregates(self, alert_id: str | None = None, minutes: int | None = None) -> Dict[str, Any]:
+        ids = [alert_id] if alert_id else list(self.procesadores)
+        return {aid: self.procesadores[aid].aggregates(minutes) for aid in ids if aid in self.procesadores}
+
+    async def _run(self) -> None:
+        fallos = 0
+        while self.subscribers:
+            recibidos = 0
+            try:
+                self.connected = True
+                async for banner in self._stream_factory():
+                    fallos = 0
+                    recibidos += 1
+                    self.publish(banner)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                fallos += 1
+                self.last_error = str(e)
+            finally:
+                self.connected = False
+            if not self.subscribers:
+                break
+            self.reconnects += 1
+            if fallos:
+                await asyncio.sleep(min(STREAM_BACKOFF_MAX, 2 ** fallos) * (0.5 + random.random() / 2))
+            elif not recibidos:
+                #stream cerrado sin datos ni error: no reabrir en bucle
+                await asyncio.sleep(1)
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "key": key_id(self.api_key),
+            "connected": self.connected,
+            "events": self.events,
+            "events_by_alert": dict(self.por_alerta),
+            "duplicates": sum(p.duplicates for p in self.procesadores.values()),
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "last_event_at": self.last_event_at,
+            "subscribers": [s.stats() for s in self.subscribers],
+        }
+
+
+#un hub por clave de Shodan, compartido por todos los clientes de la API
+HUBS: Dict[str, AlertHub] = {}
+
+
+def get_hub(api_key: str) -> AlertHub:
+    hub = HUBS.get(key_id(api_key))
+    if hub is None:
+        hub = HUBS[key_id(api_key)] = AlertHub(api_key)
+    return hub
+
+
+async def close_hubs() -> None:
+    for hub in list(HUBS.values()):
+        await hub.stop()
+    HUBS.clear()
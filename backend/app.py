@@ -1,12 +1,50 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks, Response, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-import subprocess, shlex, os, uuid, json, re, datetime, pathlib, asyncio, traceback, subprocess, shodan 
+import subprocess, shlex, os, uuid, json, re, datetime, pathlib, asyncio, traceback, subprocess, shodan, time
 from typing import Dict, Any, List
 from fastapi.middleware.cors import CORSMiddleware
 import ast
-
-app = FastAPI(title="Shodan API Backend")
+import concurrent.futures
+from contextlib import asynccontextmanager
+
+from jobs import JOBS, ESTADOS_FINALES, Job
+from script_engine import ENGINE, EngineUnavailable
+from script_registry import ScriptRegistry, read_script_metadata
+from results_catalog import ResultsCatalog
+from nvd_cache import obtener_cve_nvd_async, obtener_cves_nvd, obtener_cves_nvd_async
+import http_client
+from shodan_common import crear_api
+from shodan_limiter import LIMITER, CREDITS, estimar_creditos, key_id
+from shodan_keys import KeyPool, load_api_keys
+from shodan_async import AsyncShodan, hosts_concurrentes
+from alert_stream import HUBS, close_hubs, get_hub
+from result_files import PARSED, ETAGS, DEFAULT_EXCLUDE, choose_encoding, iter_file, select_rows
+
+#auto: en proceso si el script declara "entrypoint"; subprocess: siempre python scripts/x.py
+SCRIPT_ENGINE = os.getenv("SCRIPT_ENGINE", "auto")
+ENGINE_MODES = ("auto", "inprocess", "subprocess")
+
+#trabajos que no caben en los créditos de Shodan: reject -> 429, queue -> esperan en cola
+SHODAN_CREDIT_POLICY = os.getenv("SHODAN_CREDIT_POLICY", "reject")
+SHODAN_CREDIT_WAIT = int(os.getenv("SHODAN_CREDIT_WAIT", "900"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    REGISTRY.start_watcher()
+    CATALOG.sync()
+    if SCRIPT_ENGINE != "subprocess":
+        entrypoints = [p for name, p in REGISTRY.scripts().items() if REGISTRY.metadata(name).get("entrypoint")]
+        ENGINE.start(entrypoints)
+    yield
+    await close_hubs()
+    await http_client.aclose()
+    ENGINE.shutdown()
+    REGISTRY.stop_watcher()
+
+
+app = FastAPI(title="Shodan API Backend", lifespan=lifespan)
 
 #pera permitir solicitudes desde el frontend
 origins = [
@@ -20,6 +58,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],         
     allow_headers=["*"],         
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 
@@ -28,74 +67,245 @@ RESULTS_DIR = pathlib.Path("results")
 SCRIPTS_DIR = pathlib.Path("scripts")
 RESULTS_DIR.mkdir(exist_ok=True)
 
+#metadata de scripts cacheada; se invalida por mtime/tamaño desde el hilo vigilante
+REGISTRY = ScriptRegistry(SCRIPTS_DIR, poll_interval=float(os.getenv("SCRIPTS_POLL_INTERVAL", "2")))
+
+#catálogo de results/ para /results sin recorrer el directorio en cada petición
+CATALOG = ResultsCatalog(RESULTS_DIR)
+
+#parámetros que identifican el objetivo de una ejecución, por orden de preferencia
+TARGET_PARAMS = ("target", "ip", "network", "query", "input_file")
+
 
 
 CVE_RE = re.compile(r"\bCVE-\d{4}-\d{4,7}\b", re.IGNORECASE)
+MIN_CVE_LEN = len("CVE-0000-0000")
+
+#máximo de CVEs por petición en /nvd/cves y en /extract-cves?enrich=true
+MAX_CVE_BATCH = int(os.getenv("MAX_CVE_BATCH", "1000"))
+
+#máximo de IPs por petición en /shodan/hosts
+MAX_HOST_BATCH = int(os.getenv("MAX_HOST_BATCH", "5000"))
 
 class RunRequest(BaseModel):
     params: Dict[str, Any] = {}
+    engine: str | None = None
     
 
-def read_script_metadata(script_path: str) -> dict:  
-    try:
-        with open(script_path, 'r', encoding='utf-8') as f:
-            source = f.read()      
-        tree = ast.parse(source)
-        for node in tree.body:
-            if isinstance(node, ast.Assign):
-                for target in node.targets:
-                    if getattr(target, 'id', None) == "SCRIPT_METADATA":
-                        return ast.literal_eval(node.value)
-    except Exception as e:
-        print(f"[WARN] Cannot read metadata from {script_path}: {e}")
-    return {}
-    
-    
-
-def _save_result_file(prefix: str, data: Dict[str,Any]) -> str:
+def _save_result_file(prefix: str, data: Dict[str,Any], **catalog) -> str:
     ts = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
     fname = f"{prefix}_{ts}_{uuid.uuid4().hex[:6]}.json"
     path = RESULTS_DIR / fname
     with open(path, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
+    CATALOG.record(path, **catalog)
     return str(path)
 
+
+def _target_from_params(params: Dict[str, Any]) -> str | None:
+    for name in TARGET_PARAMS:
+        if params.get(name):
+            return str(params[name])
+    return None
+
 def extract_cves_from_obj(obj) -> List[str]:
+    """
+    recorre el objeto con una pila explícita y aplica CVE_RE solo a las cadenas
+    (valores y claves, p.ej. el dict "vulns" indexado por CVE), sin volcarlo
+    entero a texto con json.dumps.
+    """
     found = set()
-    text = json.dumps(obj, ensure_ascii=False)
-    for m in CVE_RE.findall(text):
-        found.add(m.upper())
+    stack = [obj]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, str):
+            if len(cur) >= MIN_CVE_LEN:
+                found.update(m.upper() for m in CVE_RE.findall(cur))
+        elif isinstance(cur, dict):
+            for k, v in cur.items():
+                if isinstance(k, str) and len(k) >= MIN_CVE_LEN:
+                    found.update(m.upper() for m in CVE_RE.findall(k))
+                if isinstance(v, (str, dict, list)):
+                    stack.append(v)
+        elif isinstance(cur, list):
+            stack.extend(v for v in cur if isinstance(v, (str, dict, list)))
     return sorted(found)
 
-async def _run_script_and_capture(cmd: str, timeout: int = 120, env: Dict[str, str] | None = None) -> Dict[str,Any]:
-  
-    print(f"[DEBUG] _run_script_and_capture -> launching (in thread): {cmd} (timeout={timeout}s)")
+
+#campos de contexto heredados al recorrer un resultado (host -> banner -> vuln)
+OCCURRENCE_FIELDS = {"ip": ("ip_str", "ip"), "port": ("port",), "product": ("product",), "version": ("version",)}
+
+
+def _occurrence_context(ctx: Dict[str, Any], node: Dict[str, Any]) -> Dict[str, Any]:
+    nuevo = None
+    for campo, claves in OCCURRENCE_FIELDS.items():
+        for k in claves:
+            v = node.get(k)
+            if isinstance(v, (str, int)) and not isinstance(v, bool) and v != "":
+                if nuevo is None:
+                    nuevo = dict(ctx)
+                nuevo[campo] = v
+                break
+    return nuevo if nuevo is not None else ctx
+
+
+def extract_cve_occurrences(obj) -> List[Dict[str, Any]]:
+    """
+    como extract_cves_from_obj, pero cada CVE sale con el ip/puerto/producto/versión
+    del dict más cercano que lo contiene. Una aparición sin puerto se descarta si el
+    mismo CVE ya aparece con puerto en ese host.
+    """
+    found: Dict[tuple, Dict[str, Any]] = {}
+
+    def emit(text: str, ctx: Dict[str, Any]) -> None:
+        for m in CVE_RE.findall(text):
+            port = ctx.get("port")
+            try:
+                port = int(port) if port is not None else None
+            except (TypeError, ValueError):
+                port = None
+            key = (m.upper(), ctx.get("ip"), port)
+            if key not in found:
+                found[key] = {"cve": m.upper(), "ip": ctx.get("ip"), "port": port,
+                              "product": ctx.get("product"), "version": ctx.get("version")}
+
+    stack = [(obj, {})]
+    while stack:
+        cur, ctx = stack.pop()
+        if isinstance(cur, dict):
+            ctx = _occurrence_context(ctx, cur)
+            for k, v in cur.items():
+                if isinstance(k, str) and len(k) >= MIN_CVE_LEN:
+                    emit(k, _occurrence_context(ctx, v) if isinstance(v, dict) else ctx)
+                if isinstance(v, str):
+                    if len(v) >= MIN_CVE_LEN:
+                        emit(v, ctx)
+                elif isinstance(v, (dict, list)):
+                    stack.append((v, ctx))
+        elif isinstance(cur, list):
+            for v in cur:
+                if isinstance(v, str):
+                    if len(v) >= MIN_CVE_LEN:
+                        emit(v, ctx)
+                elif isinstance(v, (dict, list)):
+                    stack.append((v, ctx))
+        elif isinstance(cur, str) and len(cur) >= MIN_CVE_LEN:
+            emit(cur, ctx)
+
+    con_puerto = {(cve, ip) for (cve, ip, port) in found if port is not None}
+    return [o for (cve, ip, port), o in found.items() if port is not None or (cve, ip) not in con_puerto]
+
+
+def index_result_cves(path: str | pathlib.Path, obj: Any = None, script: str | None = None) -> int:
+    """alimenta el índice invertido CVE -> apariciones con un archivo de resultados."""
+    p = pathlib.Path(path).resolve()
+    if obj is None:
+        obj = PARSED.load(p)
+    entry = CATALOG.get(p.name) or {}
+    occurrences = extract_cve_occurrences(obj)
+    CATALOG.index_occurrences(p.name, occurrences, script=script or entry.get("script"),
+                              created_at=entry.get("created_at"), mtime_ns=p.stat().st_mtime_ns)
+    return len(occurrences)
+
+
+def cves_for_file(path: str | pathlib.Path, obj: Any = None) -> List[str]:
+    """
+    CVEs de un archivo de resultados, persistidos en el catálogo por ruta+mtime:
+    tras la primera pasada la respuesta no vuelve a leer ni parsear el archivo.
+    """
+    p = pathlib.Path(path).resolve()
+    st = p.stat()
+    cached = CATALOG.get_cves(p, st.st_mtime_ns, st.st_size)
+    if cached is not None:
+        return cached
+    if obj is None:
+        obj = PARSED.load(p)
+    cves = extract_cves_from_obj(obj)
+    CATALOG.set_cves(p, st.st_mtime_ns, st.st_size, cves)
+    return cves
+
+#tamaño máximo de una línea emitida al stream (p.ej. el JSON final de realtime_monitor)
+MAX_LINE_BYTES = 64 * 1024
+
+#progreso estructurado reconocible en la salida de los scripts
+PROGRESS_RE = re.compile(r"^\[(\d+)/(\d+)\]\s*(\S+)\s*->\s*(\S+)")
+EVENT_RE = re.compile(r"Evento detectado: ([^\s:]+):(\d+)")
+
+
+def parse_progress_line(line: str) -> Dict[str, Any] | None:
+    """
+    traduce líneas conocidas a eventos: '[3/254] nmap -> 10.0.0.3' de nmap_scan
+    y 'Evento detectado: ip:puerto' de realtime_monitor.
+    """
+    if m := PROGRESS_RE.search(line):
+        current, total = int(m.group(1)), int(m.group(2))
+        return {"type": "progress", "current": current, "total": total,
+                "tool": m.group(3), "target": m.group(4),
+                "percent": round(100 * current / total, 1) if total else None}
+    if m := EVENT_RE.search(line):
+        return {"type": "event", "ip": m.group(1), "port": int(m.group(2))}
+    return None
+
+
+async def _pump_stream(stream: asyncio.StreamReader, name: str, chunks: List[bytes], on_line) -> None:
+    pending = b""
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        if len(pending) > MAX_LINE_BYTES:
+            lines.append(pending[:MAX_LINE_BYTES] + b" ...[truncated]")
+            pending = b""
+        if on_line:
+            for line in lines:
+                on_line(name, ensure_str(line[:MAX_LINE_BYTES]).rstrip("\r"))
+    if pending and on_line:
+        on_line(name, ensure_str(pending[:MAX_LINE_BYTES]).rstrip("\r"))
+
+
+async def _run_script_streaming(cmd: str, timeout: int, env: Dict[str, str] | None, on_line) -> Dict[str, Any]:
+    proc = await asyncio.create_subprocess_shell(
+        cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env
+    )
+    out_chunks: List[bytes] = []
+    err_chunks: List[bytes] = []
+    pumps = asyncio.gather(
+        _pump_stream(proc.stdout, "stdout", out_chunks, on_line),
+        _pump_stream(proc.stderr, "stderr", err_chunks, on_line),
+        proc.wait()
+    )
     try:
-        proc = await asyncio.to_thread(
-            subprocess.run,
-            cmd,
-            shell=True,
-            capture_output=True,
-            text=True,     
-            timeout=timeout,
-            env=env
-        )
-        return {
-            "timeout": False,
-            "exception": False,
-            "returncode": proc.returncode,
-            "stdout": ensure_str(proc.stdout),
-            "stderr": ensure_str(proc.stderr)
-        }
-    except subprocess.TimeoutExpired as te:       
+        await asyncio.wait_for(pumps, timeout=timeout)
+        timed_out = False
+    except asyncio.TimeoutError:
         print("[DEBUG] _run_script_and_capture -> TimeoutExpired")
-        return {
-            "timeout": True,
-            "exception": False,
-            "returncode": None,
-            "stdout": ensure_str(getattr(te, "output", "") or getattr(te, "stdout", "")),
-            "stderr": ensure_str(getattr(te, "stderr", "") or getattr(te, "stderr", ""))
-        }
+        timed_out = True
+        proc.kill()
+        await proc.wait()
+    return {
+        "timeout": timed_out,
+        "exception": False,
+        "returncode": None if timed_out else proc.returncode,
+        "stdout": ensure_str(b"".join(out_chunks)),
+        "stderr": ensure_str(b"".join(err_chunks))
+    }
+
+
+def _run_script_and_capture(cmd: str, timeout: int = 120, env: Dict[str, str] | None = None, on_line=None) -> Dict[str,Any]:
+    """
+    se ejecuta dentro de un hilo del JobManager, nunca en el threadpool de uvicorn.
+    El subproceso es asíncrono y cada línea de stdout/stderr se entrega a on_line
+    según llega, sin esperar al final del script.
+    """
+    print(f"[DEBUG] _run_script_and_capture -> launching: {cmd} (timeout={timeout}s)")
+    try:
+        return asyncio.run(_run_script_streaming(cmd, timeout, env, on_line))
     except Exception as e:
         tb = traceback.format_exc()
         print(f"[DEBUG] _run_script_and_capture -> Exception: {e}\n{tb}")
@@ -116,10 +326,7 @@ def get_available_scripts() -> Dict[str, pathlib.Path]:
     devuelve un dict {script_name: script_path} con todos los scripts .py
     en la carpeta scripts.
     """
-    scripts = {}
-    for f in SCRIPTS_DIR.glob("*.py"):
-        scripts[f.stem] = f.resolve()
-    return scripts
+    return REGISTRY.scripts()
 
 #mapa global cacheado (se puede refrescar si se agregan scripts nuevos dinámicamente)
 AVAILABLE_SCRIPTS = get_available_scripts()
@@ -127,10 +334,11 @@ AVAILABLE_SCRIPTS = get_available_scripts()
 
 
 @app.post("/run/{script_name}")
-async def run_script(script_name: str, req: RunRequest, background_tasks: BackgroundTasks):
+def run_script(script_name: str, req: RunRequest, response: Response):
     """
-    ejecuta el script Python de la carpeta SCRIPTS_DIR tomando parámetros
-    desde el frontend. Devuelve resultado en JSON.
+    encola el script Python de la carpeta SCRIPTS_DIR tomando parámetros
+    desde el frontend. Devuelve el id del trabajo; el estado se consulta
+    en /jobs/{job_id}.
     """
     try:
         print(f"[DEBUG] Received params: {req.params}")
@@ -139,14 +347,20 @@ async def run_script(script_name: str, req: RunRequest, background_tasks: Backgr
             raise HTTPException(400, f"Invalid script name: {script_name}")
 
         script_path = available_scripts[script_name]
-        meta = read_script_metadata(str(script_path))
+        meta = REGISTRY.metadata(script_name)
         params_schema = meta.get("params", [])
 
         base_env = os.environ.copy()
-        if api_key := req.params.get("api_key"):
+        #sin buffer para que /jobs/{id}/stream reciba cada print al momento
+        base_env["PYTHONUNBUFFERED"] = "1"
+        api_key = req.params.get("api_key")
+        if api_key:
+            #una clave explícita sustituye al pool de SHODAN_API_KEYS
             base_env["SHODAN_API_KEY"] = api_key
+            base_env["SHODAN_API_KEYS"] = api_key
 
         cmd = f'python "{script_path}"'
+        call_params: Dict[str, Any] = {}
 
         #construiye argumentos dinámicamente según SCRIPT_METADATA
         for p in params_schema:
@@ -162,6 +376,8 @@ async def run_script(script_name: str, req: RunRequest, background_tasks: Backgr
                     raise HTTPException(400, f"Missing required parameter: {name}")
                 value = p.get("placeholder")
 
+            call_params[name] = value
+
             #convertir Python a CLI
             if isinstance(value, bool):
                 if value:
@@ -171,7 +387,8 @@ async def run_script(script_name: str, req: RunRequest, background_tasks: Backgr
 
 
         #archivos de salida y log
-        ts = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        #sufijo aleatorio: varios trabajos del mismo script pueden arrancar en el mismo segundo
+        ts = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ") + f"_{uuid.uuid4().hex[:6]}"
         out_file = RESULTS_DIR / f"{script_name}_{ts}.json"
         cmd += f' --out "{out_file}"'
 
@@ -184,43 +401,241 @@ async def run_script(script_name: str, req: RunRequest, background_tasks: Backgr
         #mostrar comando final
         print(f"[DEBUG] CMD to run: {cmd}")
 
-        #ejecuta el script
-        timeout = meta.get("timeout", 600)
-        res = await _run_script_and_capture(cmd, timeout=timeout, env=base_env)
-
-        success = not res.get("timeout") and not res.get("exception") and res.get("returncode") == 0
-
-        if success and out_file.exists():
-            data = json.loads(out_file.read_text(encoding="utf-8"))
-            _save_result_file(f"meta_{script_name}", {
-                "cmd": cmd,
-                "stdout": res.get("stdout"),
-                "stderr": res.get("stderr"),
-                "returncode": res.get("returncode"),
-                "data": data
-            })
-            return {
-                "status": "finished",
-                "out_path": str(out_file.resolve()),
-                "log_path": str(log_file_abs) if log_file_abs else None,
-                "result": res,
-                "data": data
+        #motor de ejecución: en proceso solo si el script expone entrypoint
+        engine = req.engine or SCRIPT_ENGINE
+        if engine not in ENGINE_MODES:
+            raise HTTPException(400, f"Invalid engine: {engine}")
+        engine_call = None
+        if engine != "subprocess" and meta.get("entrypoint"):
+            engine_call = {
+                "script_path": str(script_path),
+                "entrypoint": meta["entrypoint"],
+                "params": call_params,
+                "env": {"SHODAN_API_KEY": api_key, "SHODAN_API_KEYS": api_key} if api_key else {},
             }
-        else:
-            err_path = _save_result_file(f"error_{script_name}", {
-                "cmd": cmd,
-                "stdout": res.get("stdout"),
-                "stderr": res.get("stderr"),
-                "timeout": res.get("timeout"),
-                "exception": res.get("exception")
-            })
-            return {"status": "error", "error_file": err_path, "result": res}
+        elif engine == "inprocess":
+            raise HTTPException(400, f"Script {script_name} has no entrypoint for in-process execution")
+
+        #encola el script; la respuesta sale sin esperar a que termine
+        timeout = meta.get("timeout", 600)
+        credits = _reserve_credits(script_name, meta, call_params, api_key, timeout)
+        job = JOBS.submit(
+            script_name,
+            req.params,
+            lambda job: _with_credits(job, credits, lambda: _execute_script_job(
+                job, script_name, cmd, out_file, log_file_abs, timeout, base_env, engine_call)),
+            gate=_credits_gate(credits, timeout),
+            gate_timeout=SHODAN_CREDIT_WAIT,
+        )
+        response.status_code = 202
+        return {"status": job.status, "job_id": job.id, "job": job.to_dict()}
 
+    except HTTPException:
+        raise
     except Exception as e:
         tb = traceback.format_exc()
         raise HTTPException(500, f"Internal server error: {e}\n{tb}")
 
 
+def _reserve_credits(script_name: str, meta: Dict[str, Any], params: Dict[str, Any],
+                     api_key: str | None, timeout: int) -> Dict[str, Any] | None:
+    """
+    reserva los créditos de Shodan que declara el script antes de encolarlo.
+    Si no llegan, 429 (política reject) o el trabajo esperará en cola (queue).
+    """
+    coste = estimar_creditos(meta, params)
+    keys = [api_key] if api_key else load_api_keys()
+    if not coste or not keys:
+        return None
+    kind, amount = coste
+    try:
+        #con pool se reserva en la clave sana con más créditos de ese tipo
+        api_key = KeyPool(keys).best_for(kind) if len(keys) > 1 else keys[0]
+        reservation = CREDITS.reserve(api_key, kind, amount, ttl=timeout + 60)
+    except Exception as e:
+        #sin api.info() no se bloquea el trabajo: el limitador de peticiones sigue activo
+        print(f"[WARN] Shodan credits -> {e}")
+        return None
+    if not reservation and SHODAN_CREDIT_POLICY != "queue":
+        raise HTTPException(429, f"Not enough Shodan {kind} credits for {script_name} ({amount} needed)")
+    return {"api_key": api_key, "kind": kind, "amount": amount, "reservation": reservation}
+
+
+def _credits_gate(credits: Dict[str, Any] | None, timeout: int):
+    """
+    condición de arranque para JOBS.submit con política queue: el trabajo
+    espera sin ocupar worker hasta que reserve() consigue los créditos.
+    """
+    if not credits or credits["reservation"]:
+        return None
+    avisado = False
+
+    def gate(job: Job) -> bool:
+        nonlocal avisado
+        if not avisado:
+            avisado = True
+            job.append_output("stdout", f"[credits] esperando {credits['amount']} {credits['kind']} credits")
+        credits["reservation"] = CREDITS.reserve(credits["api_key"], credits["kind"], credits["amount"],
+                                                 ttl=timeout + 60)
+        return bool(credits["reservation"])
+    return gate
+
+
+def _with_credits(job: Job, credits: Dict[str, Any] | None, fn) -> Dict[str, Any]:
+    #ejecuta con los créditos ya reservados y libera la reserva al terminar
+    if not credits or not credits["reservation"]:
+        return fn()
+    try:
+        return fn()
+    finally:
+        CREDITS.release(credits["reservation"], credits["api_key"])
+        #los créditos liberados pueden desbloquear trabajos en espera
+        JOBS.poke()
+
+
+def _run_script_inprocess(engine_call: Dict[str, Any], out_file: pathlib.Path,
+                          log_file_abs: pathlib.Path | None, timeout: int) -> Dict[str, Any]:
+    """
+    llama al entrypoint del script en un worker precalentado y escribe su
+    resultado en out_file, igual que haría el script con --out.
+    """
+    try:
+        data = ENGINE.run(engine_call["script_path"], engine_call["entrypoint"], engine_call["params"],
+                          env=engine_call["env"], log_file=str(log_file_abs) if log_file_abs else None,
+                          timeout=timeout)
+        with open(out_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        return {"timeout": False, "exception": False, "returncode": 0, "stdout": "", "stderr": ""}
+    except concurrent.futures.TimeoutError:
+        return {"timeout": True, "exception": False, "returncode": None, "stdout": "", "stderr": ""}
+    except EngineUnavailable:
+        raise
+    except Exception as e:
+        tb = traceback.format_exc()
+        return {"timeout": False, "exception": True, "error": str(e), "traceback": tb,
+                "returncode": None, "stdout": "", "stderr": tb}
+
+
+def _execute_script_job(job: Job, script_name: str, cmd: str, out_file: pathlib.Path,
+                        log_file_abs: pathlib.Path | None, timeout: int, env: Dict[str, str],
+                        engine_call: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """
+    cuerpo de un trabajo de /run: ejecuta el script y guarda meta_/error_.
+    Devuelve los campos del Job que se actualizan al terminar.
+    """
+    res = None
+    if engine_call:
+        job.engine = "inprocess"
+        job.append_output("stdout", f"[engine] {script_name}.{engine_call['entrypoint']}() en worker precalentado")
+        try:
+            res = _run_script_inprocess(engine_call, out_file, log_file_abs, timeout)
+            cmd = f"{script_name}.{engine_call['entrypoint']}({engine_call['params']})"
+        except EngineUnavailable as e:
+            job.append_output("stderr", f"[engine] pool no disponible ({e}); se usa subproceso")
+
+    if res is None:
+        job.engine = "subprocess"
+        on_line = lambda stream, line: job.append_output(stream, line, parse_progress_line(line))
+        res = _run_script_and_capture(cmd, timeout=timeout, env=env, on_line=on_line)
+
+    success = not res.get("timeout") and not res.get("exception") and res.get("returncode") == 0
+
+    target = _target_from_params(job.params)
+
+    if success and out_file.exists():
+        data = PARSED.load(out_file)
+        cve_count = len(cves_for_file(out_file, data))
+        if cve_count:
+            index_result_cves(out_file, data, script=script_name)
+        #el archivo de salida y los que el script escribe a su lado (p.ej. *_final.json)
+        for f in RESULTS_DIR.glob(f"{out_file.stem}*.json"):
+            CATALOG.record(f, script=script_name, target=target, status="finished",
+                           cve_count=cve_count if f == out_file else None)
+        _save_result_file(f"meta_{script_name}", {
+            "cmd": cmd,
+            "engine": job.engine,
+            "stdout": res.get("stdout"),
+            "stderr": res.get("stderr"),
+            "returncode": res.get("returncode"),
+            "data": data
+        }, script=script_name, target=target, cve_count=cve_count)
+        return {
+            "status": "finished",
+            "out_path": str(out_file.resolve()),
+            "log_path": str(log_file_abs) if log_file_abs else None,
+            "returncode": res.get("returncode"),
+        }
+
+    err_path = _save_result_file(f"error_{script_name}", {
+        "cmd": cmd,
+        "engine": job.engine,
+        "stdout": res.get("stdout"),
+        "stderr": res.get("stderr"),
+        "timeout": res.get("timeout"),
+        "exception": res.get("exception")
+    }, script=script_name, target=target)
+    return {
+        "status": "error",
+        "error_file": err_path,
+        "returncode": res.get("returncode"),
+        "error": "timeout" if res.get("timeout") else res.get("error") or (res.get("stderr") or "")[-2000:],
+    }
+
+
+@app.get("/jobs")
+def list_jobs(status: str | None = None, script: str | None = None, limit: int = 100):
+    """lista los trabajos más recientes primero, con filtros opcionales."""
+    return {
+        "stats": JOBS.stats(),
+        "jobs": [j.to_dict() for j in JOBS.list(status=status, script=script, limit=limit)]
+    }
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(404, f"Job not found: {job_id}")
+    return job.to_dict()
+
+
+def _sse(event: str, data: Any, event_id: int | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/jobs/{job_id}/stream")
+async def stream_job(job_id: str, request: Request, since: int = 0):
+    """
+    Server-Sent Events con la salida del trabajo según se produce: eventos
+    'line' (stdout/stderr), 'progress'/'event' estructurados y un 'end' final
+    con el estado del trabajo. Admite reanudar con Last-Event-ID o ?since=.
+    """
+    job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(404, f"Job not found: {job_id}")
+    last = int(request.headers.get("last-event-id") or since)
+
+    async def events():
+        nonlocal last
+        while True:
+            terminado = job.status in ESTADOS_FINALES
+            for item in job.output_since(last):
+                last = item["seq"]
+                yield _sse("line", {"stream": item["stream"], "line": item["line"]}, last)
+                if item["event"]:
+                    yield _sse(item["event"]["type"], item["event"], last)
+            if terminado:
+                yield _sse("end", job.to_dict())
+                return
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(0.25)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 
 
 def ensure_str(x):    
@@ -232,30 +647,78 @@ def ensure_str(x):
 
 
 
+def etag_matches(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    return inm.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in inm.split(",")]
+
+
 @app.get("/scripts/schema")
-def get_scripts_schema():
-    schema = {}
-    for script_file in SCRIPTS_DIR.glob("*.py"):
-        name = script_file.stem
-        meta = read_script_metadata(script_file)       
-        schema[name] = {
-            "description": meta.get("description", ""),
-            "params": meta.get("params", [])
-        }
+def get_scripts_schema(request: Request, response: Response):
+    schema, etag = REGISTRY.schema()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     return schema
 
 
 @app.get("/shodan/api-info")
-def shodan_api_info(api_key: str):
+async def shodan_api_info(api_key: str):
     try:
-        url = f"https://api.shodan.io/api-info?key={api_key}"
-        r = requests.get(url, timeout=10)
+        #también cuenta para el ritmo de la clave
+        await asyncio.to_thread(LIMITER.acquire, key_id(api_key))
+        r = await http_client.async_get("https://api.shodan.io/api-info", params={"key": api_key}, timeout=10)
         r.raise_for_status()
         return r.json()
     except Exception as e:
         raise HTTPException(500, f"Error fetching Shodan API info: {e}")
 
 
+@app.get("/shodan/limits")
+def shodan_limits(api_key: str | None = None):
+    """ritmo del limitador compartido y créditos de la clave descontando reservas."""
+    key = api_key or next(iter(load_api_keys()), None)
+    try:
+        credits = CREDITS.stats(key)
+    except Exception as e:
+        credits = {"error": str(e)}
+    return {"policy": SHODAN_CREDIT_POLICY, "rate": LIMITER.stats(), "credits": credits}
+
+
+class HostBatchRequest(BaseModel):
+    ips: List[str]
+    refresh: bool = False
+    api_key: str | None = None
+
+
+@app.post("/shodan/hosts")
+async def shodan_hosts(req: HostBatchRequest):
+    """
+    registros de host de muchas IPs en una petición: los vigentes salen de la
+    caché de hosts y el resto se pide a Shodan con corrutinas en el bucle de la API.
+    """
+    ips = list(dict.fromkeys(ip.strip() for ip in req.ips if ip and ip.strip()))
+    if len(ips) > MAX_HOST_BATCH:
+        raise HTTPException(400, f"Too many IPs: {len(ips)} (max {MAX_HOST_BATCH})")
+    try:
+        api = AsyncShodan(req.api_key)
+    except RuntimeError as e:
+        raise HTTPException(400, str(e))
+    hosts = await hosts_concurrentes(api, ips, refresh=req.refresh)
+    return {"count": len(hosts), "hosts": hosts}
+
+
+@app.get("/shodan/keys")
+def shodan_keys():
+    """uso, salud y créditos de cada clave del pool (enmascaradas)."""
+    keys = load_api_keys()
+    if not keys:
+        return {"keys": []}
+    return {"keys": KeyPool(keys).stats()}
+
+
 
 @app.post("/upload-json")
 async def upload_json(file: UploadFile = File(...)):
@@ -264,55 +727,237 @@ async def upload_json(file: UploadFile = File(...)):
         obj = json.loads(content)
     except Exception as e:
         raise HTTPException(400, f"Invalid JSON: {e}")
-    path = _save_result_file(file.filename.rsplit('.',1)[0], obj)
     cves = extract_cves_from_obj(obj)
+    path = _save_result_file(file.filename.rsplit('.',1)[0], obj,
+                             script="upload", target=file.filename, cve_count=len(cves))
+    st = pathlib.Path(path).resolve().stat()
+    CATALOG.set_cves(pathlib.Path(path).resolve(), st.st_mtime_ns, st.st_size, cves)
+    if cves:
+        index_result_cves(path, obj, script="upload")
     return {"path": path, "cves": cves}
 
 @app.get("/results")
-def list_results():
-    files = sorted(RESULTS_DIR.glob("*.json"), reverse=True)
-    return [{"name": f.name, "path": str(f)} for f in files]
+def list_results(response: Response, script: str | None = None, target: str | None = None,
+                 status: str | None = None, kind: str | None = None,
+                 since: str | None = None, until: str | None = None,
+                 sort: str = "created_at", order: str = "desc",
+                 limit: int = 100, cursor: str | None = None):
+    """
+    listado paginado desde el catálogo. Filtros por script, objetivo, estado,
+    tipo (result/meta/error) y fecha ISO; la siguiente página se pide con el
+    cursor de la cabecera X-Next-Cursor.
+    """
+    try:
+        items, next_cursor, total = CATALOG.query(
+            script=script, target=target, status=status, kind=kind, since=since, until=until,
+            sort=sort, order=order, limit=max(1, min(limit, 1000)), cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    response.headers["X-Total-Count"] = str(total)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+
+@app.post("/results/reindex")
+def reindex_results():
+    """reconcilia el catálogo con el contenido actual de results/."""
+    return CATALOG.sync()
 
 
 @app.get("/results/file")
-def get_result_file(path: str):
+def get_result_file(path: str, request: Request):
+    """
+    devuelve el archivo tal cual está en disco, por bloques y sin parsearlo,
+    comprimido con br/gzip según Accept-Encoding. Responde 304 si el ETag
+    (sha256 del contenido más la codificación, "<hash>-gzip") coincide con
+    If-None-Match: cada representación tiene su propio validador fuerte.
+    """
+    p = pathlib.Path(path)
+    if not p.exists() or not p.is_file():
+        raise HTTPException(404, f"File not found: {path}")
+    try:
+        etag = ETAGS.get(p)
+        size = p.stat().st_size
+    except Exception as e:
+        raise HTTPException(500, f"Error reading file: {e}")
+    encoding = choose_encoding(request.headers.get("accept-encoding"), size)
+    if encoding != "identity":
+        etag = f'{etag[:-1]}-{encoding}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if encoding == "identity":
+        headers["Content-Length"] = str(size)
+    else:
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(iter_file(p, encoding), media_type="application/json", headers=headers)
+
+
+def load_result_json(path: str) -> Any:
+    """objeto parseado desde la LRU (clave ruta+mtime); 404/500 como HTTPException."""
     p = pathlib.Path(path)
     if not p.exists() or not p.is_file():
         raise HTTPException(404, f"File not found: {path}")
     try:
-        return json.loads(p.read_text(encoding="utf-8"))
+        return PARSED.load(p)
     except Exception as e:
         raise HTTPException(500, f"Error reading file: {e}")
 
 
+def resolve_result_name(name: str) -> pathlib.Path:
+    """nombre de archivo del catálogo -> ruta dentro de results/."""
+    if "/" in name or "\\" in name or name.startswith("."):
+        raise HTTPException(400, f"Invalid result id: {name}")
+    entry = CATALOG.get(name)
+    p = pathlib.Path(entry["path"]) if entry else RESULTS_DIR / name
+    if not p.is_file():
+        raise HTTPException(404, f"File not found: {name}")
+    return p
+
+
+@app.get("/results/{name}/rows")
+def get_result_rows(name: str, fields: str | None = None, offset: int = 0, limit: int = 100,
+                    sort: str | None = None, collection: str | None = None,
+                    exclude: str | None = None):
+    """
+    filas de un resultado ya recortadas en el servidor: columnas (fields=ip,port,
+    location.city), orden (sort=cvss o sort=-cvss) y ventana offset/limit. Detecta
+    results/data/matches o una lista de primer nivel; collection fuerza otra ruta.
+    Sin fields se omiten raw_data, raw, http y ssl.cert.extensions (ver exclude).
+    """
+    obj = load_result_json(str(resolve_result_name(name)))
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+    exclude_list = tuple(e.strip() for e in exclude.split(",") if e.strip()) if exclude is not None else DEFAULT_EXCLUDE
+    try:
+        res = select_rows(obj, fields=field_list, offset=max(0, offset), limit=max(1, min(limit, 5000)),
+                          sort=sort, collection=collection, exclude=exclude_list)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"name": name, **res}
+
+
 @app.get("/extract-cves")
-def extract_cves(path: str):
+def extract_cves(path: str, enrich: bool = False, nvd_api_key: str | None = None):
+    """
+    CVEs del archivo. Con enrich=true el severity_map trae CVSS, severidad y
+    descripción de NVD (caché compartida, lote concurrente como /nvd/cves).
+    """
     p = pathlib.Path(path)
-    if not p.exists():
+    if not p.exists() or not p.is_file():
         raise HTTPException(404, "File not found")
-    obj = json.loads(p.read_text(encoding="utf-8"))
-    cves = extract_cves_from_obj(obj)
+    try:
+        cves = cves_for_file(p)
+    except Exception as e:
+        raise HTTPException(500, f"Error reading file: {e}")
     severity_map = {}
     for c in cves:
         severity_map[c] = {"severity": "Unknown", "suggested": []}
+    if enrich and cves:
+        nvd = obtener_cves_nvd(cves[:MAX_CVE_BATCH], nvd_api_key or os.getenv("NVD_API_KEY"))
+        for c, info in nvd.items():
+            severity_map[c].update({k: info.get(k) for k in ("severity", "cvss", "description", "error") if k in info})
     return {"cves": cves, "count": len(cves), "severity_map": severity_map}
     
 
 
+@app.get("/cves/top")
+def top_cves(limit: int = 20, script: str | None = None):
+    """CVEs con más hosts afectados en todos los resultados indexados."""
+    return CATALOG.top_cves(limit=max(1, min(limit, 500)), script=script)
+
+
+@app.get("/cves/{cve_id}/occurrences")
+def cve_occurrences(cve_id: str, limit: int = 100, offset: int = 0):
+    """hosts, puertos, producto/versión y archivos en los que aparece el CVE."""
+    cve = cve_id.upper()
+    if not CVE_RE.fullmatch(cve):
+        raise HTTPException(400, f"Invalid CVE id: {cve_id}")
+    rows, totals = CATALOG.cve_occurrences(cve, limit=max(1, min(limit, 1000)), offset=max(0, offset))
+    return {"cve": cve, **totals, "items": rows}
+
+
+@app.post("/cves/reindex")
+def reindex_cves():
+    """indexa los resultados del catálogo que aún no están en el índice de CVEs."""
+    indexed, errors = 0, []
+    for entry in CATALOG.pending_cve_files():
+        try:
+            index_result_cves(entry["path"], script=entry.get("script"))
+            indexed += 1
+        except Exception as e:
+            errors.append({"name": entry["name"], "error": str(e)})
+    return {"indexed": indexed, "errors": errors}
+
+
 @app.post("/alerts/list")
-def list_alerts(req: RunRequest):
+async def list_alerts(req: RunRequest):
     """Lista las alertas activas de la cuenta Shodan."""
     api_key = req.params.get("api_key")
     if not api_key:
         raise HTTPException(400, "Missing api_key")
 
     try:
-        api = shodan.Shodan(api_key)
-        alerts = api.alerts()
+        alerts = await AsyncShodan(api_key).alerts()
         return alerts
     except Exception as e:
         raise HTTPException(500, f"Error fetching alerts: {e}")
 
+@app.get("/alerts/stream")
+async def stream_alerts(request: Request, api_key: str | None = None, alert_id: str | None = None):
+    """
+    Server-Sent Events con los banners de las alertas de la cuenta según llegan.
+    Todos los clientes comparten una conexión al stream de Shodan por clave;
+    alert_id=a,b filtra por alerta. Un mismo (ip, puerto, módulo) solo se envía
+    una vez por ventana de deduplicación (ALERT_DEDUP_WINDOW). Si el cliente no
+    lee a tiempo se descartan los eventos más antiguos y se le avisa con un
+    evento 'dropped'.
+    """
+    api_key = api_key or next(iter(load_api_keys()), None)
+    if not api_key:
+        raise HTTPException(400, "Missing api_key")
+    hub = get_hub(api_key)
+    sub = hub.subscribe([a.strip() for a in (alert_id or "").split(",") if a.strip()])
+
+    async def events():
+        avisados = 0
+        try:
+            yield _sse("subscribed", {"alerts": sub.stats()["alerts"], "hub": hub.stats()["key"]})
+            while not await request.is_disconnected():
+                event = await sub.get(timeout=15)
+                if sub.dropped > avisados:
+                    avisados = sub.dropped
+                    yield _sse("dropped", {"dropped": sub.dropped})
+                #sin eventos: comentario SSE como latido para los proxies
+                yield _sse("alert", event) if event else ": ping\n\n"
+        finally:
+            await hub.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/alerts/monitor")
+async def alerts_monitor():
+    """estado de las conexiones compartidas al stream de alertas y sus suscriptores."""
+    return {"hubs": [hub.stats() for hub in HUBS.values()]}
+
+
+@app.get("/alerts/aggregates")
+async def alerts_aggregates(api_key: str | None = None, alert_id: str | None = None, minutes: int = 15):
+    """
+    agregados por minuto de las alertas seguidas en /alerts/stream (eventos,
+    repetidos, servicios nuevos, IPs únicas, top puertos/módulos/IPs).
+    Es async para leer los contadores en el mismo bucle que los actualiza.
+    """
+    api_key = api_key or next(iter(load_api_keys()), None)
+    if not api_key:
+        raise HTTPException(400, "Missing api_key")
+    hub = HUBS.get(key_id(api_key))
+    return {"alerts": hub.aggregates(alert_id, max(1, minutes)) if hub else {}}
+
+
 @app.post("/alerts/delete")
 def delete_alert(req: RunRequest):   
     api_key = req.params.get("api_key")
@@ -321,7 +966,7 @@ def delete_alert(req: RunRequest):
         raise HTTPException(400, "Missing parameters: api_key and alert_id required")
 
     try:
-        api = shodan.Shodan(api_key)
+        api = crear_api(api_key)
         api.delete_alert(alert_id)
         return {"status": "deleted", "id": alert_id}
     except Exception as e:
@@ -332,34 +977,32 @@ def delete_alert(req: RunRequest):
     
     
 
-import time
-import requests
-
-_nvd_cache = {}
-_nvd_cache_ttl = 60 * 60 * 24
-
 @app.get("/nvd/cve")
-def nvd_cve(cve: str):  
+async def nvd_cve(cve: str, nvd_api_key: str | None = None):  
+    #caché en disco compartida con los scripts; peticiones simultáneas -> una sola consulta
     key = cve.upper()
-    now = time.time()
-    if key in _nvd_cache:
-        entry = _nvd_cache[key]
-        if now - entry['fetched_at'] < _nvd_cache_ttl:
-            return entry['data']
-    #Query NVD
-    url = f"https://services.nvd.nist.gov/rest/json/cve/1.0/{key}"
     try:
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        payload = r.json()       
-        desc = ''
-        try:
-            desc = payload.get('result', {}).get('CVE_Items', [])[0].get('cve', {}).get('description', {}).get('description_data', [])[0].get('value', '')
-        except Exception:
-            desc = ''
-        impact = payload.get('result', {}).get('CVE_Items', [])[0].get('impact', {})
-        data = {'cve': key, 'description': desc, 'impact': impact, 'raw': payload}
-        _nvd_cache[key] = {'fetched_at': now, 'data': data}
-        return data
+        return await obtener_cve_nvd_async(key, nvd_api_key or os.getenv("NVD_API_KEY"))
     except Exception as e:
         return {'cve': key, 'error': str(e)}
+
+
+class CveBatchRequest(BaseModel):
+    cves: List[str]
+    nvd_api_key: str | None = None
+
+
+@app.post("/nvd/cves")
+async def nvd_cves(req: CveBatchRequest):
+    """
+    enriquece cientos de CVEs en una sola petición: CVSS, severidad y descripción
+    desde la caché compartida, pidiendo a NVD solo los que faltan y en paralelo.
+    """
+    ids = [c.strip().upper() for c in req.cves if c and c.strip()]
+    invalid = [c for c in ids if not CVE_RE.fullmatch(c)]
+    if invalid:
+        raise HTTPException(400, f"Invalid CVE ids: {', '.join(invalid[:10])}")
+    if len(ids) > MAX_CVE_BATCH:
+        raise HTTPException(400, f"Too many CVEs: {len(ids)} (max {MAX_CVE_BATCH})")
+    data = await obtener_cves_nvd_async(ids, req.nvd_api_key or os.getenv("NVD_API_KEY"))
+    return {"count": len(data), "cves": data}
@@ -0,0 +1,185 @@
+"""batch_scan.py
+Escaneo activo por lotes para active_scan y escaneo_activo_cve: agrupa muchos
+objetivos (lista, CIDR o archivo) en pocas peticiones api.scan, sondea todos
+los scans a la vez con backoff adaptativo y pide los hosts según terminan:
+expandir_objetivos, contar_ips, agrupar, esperar_escaneos, escanear_lote
+"""
+from __future__ import annotations
+import ipaddress
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List
+
+import shodan
+
+from host_cache import obtener_host
+
+#objetivos por petición api.scan (Shodan acepta una lista de IPs/redes)
+SCAN_BATCH_SIZE = int(os.getenv("SHODAN_SCAN_BATCH", "100"))
+#sondeo de scan_status: empieza en el mínimo y crece mientras nada cambia
+SCAN_POLL_MIN = float(os.getenv("SHODAN_SCAN_POLL_MIN", "2"))
+SCAN_POLL_MAX = float(os.getenv("SHODAN_SCAN_POLL_MAX", "60"))
+SCAN_POLL_FACTOR = 1.5
+#redes más grandes se rechazan: se cobrarían pero no se piden sus hosts
+MAX_HOSTS_RED = int(os.getenv("SHODAN_SCAN_MAX_NETWORK", "4096"))
+#únicos directorios desde los que se leen listas de objetivos
+TARGET_FILE_DIRS = [Path(__file__).resolve().parent / "results"]
+
+
+def archivo_objetivos(valor: str) -> Path | None:
+    """ruta de una lista de objetivos dentro de TARGET_FILE_DIRS; None si no lo es."""
+    for base in TARGET_FILE_DIRS:
+        base = base.resolve()
+        p = (base / valor).resolve()
+        if p.is_file() and p.is_relative_to(base):
+            return p
+    return None
+
+
+def expandir_objetivos(valor: Any) -> List[str]:
+    """
+    IPs y redes CIDR normalizadas y sin repetir a partir de una lista, un texto
+    separado por comas/espacios o el nombre de un archivo de TARGET_FILE_DIRS
+    con uno por línea (# comentarios). ValueError si alguno no es una IP ni una
+    red válida o si la red supera MAX_HOSTS_RED direcciones; con archivo el
+    error indica la línea, no su contenido.
+    """
+    archivo = archivo_objetivos(valor.strip()) if isinstance(valor, str) and valor.strip() else None
+    if archivo:
+        texto = archivo.read_text(encoding="utf-8")
+        partes = [(f"línea {n} de {archivo.name}", linea.split("#", 1)[0])
+                  for n, linea in enumerate(texto.splitlines(), 1)]
+    elif isinstance(valor, (list, tuple, set)):
+        partes = [(None, str(v)) for v in valor]
+    else:
+        partes = [(None, str(valor or ""))]
+    objetivos: List[str] = []
+    for origen, parte in partes:
+        for t in re.split(r"[\s,;]+", parte.strip()):
+            if not t:
+                continue
+            donde = origen or t
+            try:
+                red = ipaddress.ip_network(t, strict=False)
+            except ValueError:
+                raise ValueError(f"Objetivo no válido: {donde}")
+            if red.num_addresses > MAX_HOSTS_RED:
+                raise ValueError(f"Red demasiado grande ({red.num_addresses} direcciones, "
+                                 f"máximo {MAX_HOSTS_RED}): {donde}")
+            norm = str(red.network_address) if red.num_addresses == 1 else str(red)
+            if norm not in objetivos:
+                objetivos.append(norm)
+    return objetivos
+
+
+def contar_ips(objetivos: List[str]) -> int:
+    """IPs que cubren los objetivos (créditos de escaneo que van a gastar)."""
+    return sum(ipaddress.ip_network(t, strict=False).num_addresses for t in objetivos)
+
+
+def ips_de(objetivo: str) -> List[str]:
+    red = ipaddress.ip_network(objetivo, strict=False)
+    if red.num_addresses == 1:
+        return [str(red.network_address)]
+    return [str(ip) for ip in red.hosts()]
+
+
+def agrupar(objetivos: List[str], tam: int = SCAN_BATCH_SIZE) -> List[List[str]]:
+    tam = max(1, tam)
+    return [objetivos[i:i + tam] for i in range(0, len(objetivos), tam)]
+
+
+def lanzar_escaneos(api: shodan.Shodan, grupos: List[List[str]], logger=None) -> List[Dict[str, Any]]:
+    """un api.scan por grupo; los que fallan quedan con status ERROR."""
+    scans = []
+    for grupo in grupos:
+        try:
+            r = api.scan(grupo if len(grupo) > 1 else grupo[0])
+            scans.append({"id": r.get("id"), "targets": grupo, "count": r.get("count"),
+                          "credits_left": r.get("credits_left"), "status": "SUBMITTED"})
+            if logger:
+                logger.info("Scan %s lanzado para %d objetivos", r.get("id"), len(grupo))
+        except shodan.APIError as e:
+            scans.append({"id": None, "targets": grupo, "status": "ERROR", "error": str(e)})
+            if logger:
+                logger.error("No se pudo lanzar el scan de %s: %s", ",".join(grupo[:3]), e)
+    return scans
+
+
+def esperar_escaneos(api: shodan.Shodan, scans: List[Dict[str, Any]], timeout: float = 600,
+                     poll_min: float = SCAN_POLL_MIN, poll_max: float = SCAN_POLL_MAX,
+                     sleep: Callable[[float], None] | None = None) -> Iterator[Dict[str, Any]]:
+    """
+    sondea todos los scans pendientes en cada vuelta y devuelve cada uno en
+    cuanto termina (DONE, ERROR o TIMEOUT). El intervalo vuelve al mínimo
+    cuando algún scan cambia de estado y crece x1.5 hasta poll_max si no.
+    """
+    pendientes = []
+    for s in scans:
+        if s.get("id"):
+            pendientes.append(s)
+        else:
+            yield s
+    fin = time.time() + timeout
+    intervalo = poll_min
+    while pendientes:
+        cambio = False
+        for s in list(pendientes):
+            try:
+                estado = (api.scan_status(s["id"]).get("status") or "").upper()
+            except shodan.APIError as e:
+                estado, s["error"] = "ERROR", str(e)
+            if estado != s["status"]:
+                cambio = True
+                s["status"] = estado
+            if estado in ("DONE", "ERROR"):
+                pendientes.remove(s)
+                yield s
+        if not pendientes:
+            return
+        if time.time() >= fin:
+            for s in pendientes:
+                s["status"] = "TIMEOUT"
+                yield s
+            return
+        intervalo = poll_min if cambio else min(poll_max, intervalo * SCAN_POLL_FACTOR)
+        (sleep or time.sleep)(min(intervalo, max(0.0, fin - time.time())))
+
+
+def escanear_lote(api: shodan.Shodan, objetivos: List[str], timeout: float = 600, max_workers: int = 8,
+                  batch_size: int = SCAN_BATCH_SIZE, poll_min: float = SCAN_POLL_MIN, logger=None,
+                  on_host: Callable[[str, Dict[str, Any]], Any] | None = None) -> Dict[str, Any]:
+    """
+    escanea todos los objetivos y devuelve {"scans": [...], "hosts": {ip: resultado}}.
+    Los hosts de cada scan se piden en paralelo (refrescando la caché de hosts)
+    en cuanto ese scan termina; on_host(ip, host) procesa cada uno en el hilo
+    del pool y su valor es el resultado guardado. Los fallos quedan como
+    {"ip", "error"}.
+    """
+    scans = lanzar_escaneos(api, agrupar(objetivos, batch_size), logger)
+    hosts: Dict[str, Any] = {}
+    futuros = {}
+
+    def pedir(ip: str):
+        host = obtener_host(api, ip, refresh=True)
+        return on_host(ip, host) if on_host else host
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for s in esperar_escaneos(api, scans, timeout, poll_min=poll_min):
+            if logger:
+                logger.info("Scan %s: %s", s.get("id"), s["status"])
+            for objetivo in s["targets"]:
+                for ip in ips_de(objetivo):
+                    if s["status"] != "DONE":
+                        hosts[ip] = {"ip": ip, "error": s.get("error") or s["status"]}
+                    elif ip not in futuros:
+                        futuros[ip] = pool.submit(pedir, ip)
+        for ip, f in futuros.items():
+            try:
+                hosts[ip] = f.result()
+            except Exception as e:
+                hosts[ip] = {"ip": ip, "error": str(e)}
+    return {"scans": scans, "hosts": hosts}
@@ -0,0 +1,60 @@
+"""host_cache.py
+Caché persistente de api.host() por IP compartida por scripts y API:
+consultar_host, obtener_host (y obtener_host_async para AsyncShodan)
+"""
+from __future__ import annotations
+import os
+import time
+from typing import Any, Dict
+
+from persistent_cache import PersistentCache
+
+SHODAN_HOST_TTL = int(os.getenv("SHODAN_HOST_TTL", str(60 * 60 * 24)))
+SHODAN_HOST_CACHE_MAX = int(os.getenv("SHODAN_HOST_CACHE_MAX", "50000"))
+
+#IP -> {"host": registro completo (minify=False), "fetched_at", "last_update"}
+HOST_CACHE = PersistentCache("host", ttl=SHODAN_HOST_TTL, max_entries=SHODAN_HOST_CACHE_MAX)
+
+
+def consultar_host(api, ip: str, refresh: bool = False) -> Dict[str, Any]:
+    """
+    entrada de caché del host: registro completo de api.host(ip, minify=False),
+    fetched_at, last_update de Shodan y cached (si no hubo llamada a la API).
+    Con refresh se ignora lo guardado y se reescribe con la respuesta nueva.
+    Los errores de la API no se guardan.
+    """
+    llamadas = []
+
+    def pedir():
+        llamadas.append(ip)
+        host = api.host(ip, minify=False)
+        return {"host": host, "fetched_at": time.time(), "last_update": host.get("last_update")}
+
+    if refresh:
+        HOST_CACHE.delete(ip)
+    entrada = HOST_CACHE.get_or_compute(ip, pedir)
+    return {**entrada, "cached": not llamadas}
+
+
+def obtener_host(api, ip: str, refresh: bool = False) -> Dict[str, Any]:
+    """api.host(ip, minify=False) servido desde la caché si está vigente."""
+    return consultar_host(api, ip, refresh)["host"]
+
+
+async def consultar_host_async(api, ip: str, refresh: bool = False) -> Dict[str, Any]:
+    """consultar_host con un AsyncShodan (await api.host)."""
+    llamadas = []
+
+    async def pedir():
+        llamadas.append(ip)
+        host = await api.host(ip, minify=False)
+        return {"host": host, "fetched_at": time.time(), "last_update": host.get("last_update")}
+
+    if refresh:
+        HOST_CACHE.delete(ip)
+    entrada = await HOST_CACHE.aget_or_compute(ip, pedir)
+    return {**entrada, "cached": not llamadas}
+
+
+async def obtener_host_async(api, ip: str, refresh: bool = False) -> Dict[str, Any]:
+    return (await consultar_host_async(api, ip, refresh))["host"]
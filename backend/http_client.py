@@ -0,0 +1,211 @@
+"""http_client.py
+Cliente HTTP compartido (Shodan, NVD, Vulners): pool keep-alive, límite de
+concurrencia por host y reintentos con backoff. get/post/request para los
+scripts y async_get/async_post/async_request para la API.
+"""
+from __future__ import annotations
+import asyncio
+import importlib.util
+import os
+import random
+import threading
+import time
+import weakref
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+#HTTP/2 solo si httpx tiene el extra h2 instalado
+HTTP2 = httpx is not None and importlib.util.find_spec("h2") is not None
+
+DEFAULT_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+HTTP_BACKOFF_MAX = 30.0
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", "8"))
+
+#peticiones simultáneas por host (las APIs públicas limitan por IP/clave)
+HOST_LIMITS: Dict[str, int] = {
+    "api.shodan.io": 4,
+    "exploits.shodan.io": 4,
+    "services.nvd.nist.gov": 4,
+    "vulners.com": 4,
+}
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+USER_AGENT = "shodan-pro/1.0"
+
+
+def host_limit(host: str) -> int:
+    return HOST_LIMITS.get(host, HTTP_MAX_PER_HOST)
+
+
+def _backoff(attempt: int, retry_after: str | None = None) -> float:
+    #Retry-After en segundos si el servidor lo manda, si no exponencial con jitter
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return min(HTTP_BACKOFF * (2 ** attempt), HTTP_BACKOFF_MAX) * (0.5 + random.random() / 2)
+
+
+# ---------------------------------------------------------------------------
+# cliente síncrono (scripts y hilos de la API)
+# ---------------------------------------------------------------------------
+
+_state_lock = threading.Lock()
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_host_sems: Dict[str, threading.BoundedSemaphore] = {}
+
+
+def get_session() -> requests.Session:
+    """sesión requests del proceso con pool de conexiones keep-alive."""
+    global _session, _session_pid
+    with _state_lock:
+        #los workers creados por fork no deben compartir sockets con el padre
+        if _session is None or _session_pid != os.getpid():
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers["User-Agent"] = USER_AGENT
+            _session, _session_pid = s, os.getpid()
+            _host_sems.clear()
+        return _session
+
+
+def _host_sem(host: str) -> threading.BoundedSemaphore:
+    with _state_lock:
+        sem = _host_sems.get(host)
+        if sem is None:
+            sem = _host_sems[host] = threading.BoundedSemaphore(host_limit(host))
+        return sem
+
+
+def request(method: str, url: str, retries: int = HTTP_RETRIES, **kwargs: Any) -> requests.Response:
+    """
+    petición con la sesión compartida. Reintenta errores de conexión y
+    429/5xx con backoff; tras el último intento devuelve la respuesta tal
+    cual (o relanza la excepción) para que el llamador decida.
+    """
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    session = get_session()
+    sem = _host_sem(urlsplit(url).hostname or "")
+    for attempt in range(retries + 1):
+        try:
+            with sem:
+                r = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= retries:
+                raise
+            time.sleep(_backoff(attempt))
+            continue
+        if r.status_code not in RETRY_STATUS or attempt >= retries:
+            return r
+        time.sleep(_backoff(attempt, r.headers.get("Retry-After")))
+        r.close()
+    return r
+
+
+def get(url: str, **kwargs: Any) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs: Any) -> requests.Response:
+    return request("POST", url, **kwargs)
+
+
+# ---------------------------------------------------------------------------
+# cliente async (handlers de la API)
+# ---------------------------------------------------------------------------
+
+#un AsyncClient y un semáforo por host en cada bucle de eventos
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+_async_sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """httpx.AsyncClient del bucle actual (HTTP/2 si hay h2); None sin httpx."""
+    if httpx is None:
+        return None
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=HTTP2,
+            timeout=DEFAULT_TIMEOUT,
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _async_sem(host: str) -> asyncio.Semaphore:
+    sems = _async_sems.setdefault(asyncio.get_running_loop(), {})
+    sem = sems.get(host)
+    if sem is None:
+        sem = sems[host] = asyncio.Semaphore(host_limit(host))
+    return sem
+
+
+async def async_request(method: str, url: str, retries: int = HTTP_RETRIES, **kwargs: Any):
+    """
+    igual que request() pero sin bloquear el bucle de eventos. Sin httpx
+    instalado cae a request() en un hilo. La respuesta expone status_code,
+    headers, json(), text y raise_for_status() en ambos casos.
+    """
+    client = get_async_client()
+    if client is None:
+        return await asyncio.to_thread(request, method, url, retries, **kwargs)
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    sem = _async_sem(urlsplit(url).hostname or "")
+    for attempt in range(retries + 1):
+        try:
+            async with sem:
+                r = await client.request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.TimeoutException, httpx.RemoteProtocolError):
+            if attempt >= retries:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+            continue
+        if r.status_code not in RETRY_STATUS or attempt >= retries:
+            return r
+        await asyncio.sleep(_backoff(attempt, r.headers.get("Retry-After")))
+    return r
+
+
+async def async_get(url: str, **kwargs: Any):
+    return await async_request("GET", url, **kwargs)
+
+
+async def async_post(url: str, **kwargs: Any):
+    return await async_request("POST", url, **kwargs)
+
+
+async def aclose() -> None:
+    """cierra el AsyncClient del bucle actual (apagado de la API)."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "http2": HTTP2,
+        "async": httpx is not None,
+        "pool_size": HTTP_POOL_SIZE,
+        "retries": HTTP_RETRIES,
+        "host_limits": {**HOST_LIMITS, "*": HTTP_MAX_PER_HOST},
+    }
@@ -0,0 +1,215 @@
+"""jobs.py
+Cola de trabajos en segundo plano para /run: Job, JobManager
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+
+ESTADOS_FINALES = ("finished", "error")
+
+#parámetros que nunca se devuelven en /jobs
+PARAMS_SECRETOS = ("api_key", "nvd_api_key", "vulners_api_key")
+
+#líneas de salida que se conservan por trabajo para /jobs/{id}/stream
+MAX_LINEAS_SALIDA = int(os.getenv("JOBS_OUTPUT_LINES", "2000"))
+#cada cuánto se reevalúan los trabajos que esperan una condición (p.ej. créditos)
+GATE_POLL = float(os.getenv("JOBS_GATE_POLL", "15"))
+
+
+@dataclass
+class Job:
+    id: str
+    script: str
+    params: Dict[str, Any]
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    out_path: str | None = None
+    log_path: str | None = None
+    error_file: str | None = None
+    error: str | None = None
+    returncode: int | None = None
+    engine: str | None = None
+    progress: Dict[str, Any] | None = None
+    output: deque = field(default_factory=lambda: deque(maxlen=MAX_LINEAS_SALIDA), repr=False)
+    output_seq: int = 0
+
+    def append_output(self, stream: str, line: str, event: Dict[str, Any] | None = None) -> None:
+        """añade una línea al buffer acotado; las más antiguas se descartan."""
+        self.output_seq += 1
+        self.output.append({"seq": self.output_seq, "stream": stream, "line": line, "event": event})
+        if event and event.get("type") == "progress":
+            self.progress = event
+
+    def output_since(self, seq: int) -> List[Dict[str, Any]]:
+        return [o for o in list(self.output) if o["seq"] > seq]
+
+    def to_dict(self) -> Dict[str, Any]:
+        fin = self.finished_at or time.time()
+        return {
+            "id": self.id,
+            "script": self.script,
+            "params": {k: ("***" if k in PARAMS_SECRETOS else v) for k, v in self.params.items()},
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": round((self.started_at or fin) - self.created_at, 3),
+            "run_seconds": round(fin - self.started_at, 3) if self.started_at else None,
+            "out_path": self.out_path,
+            "log_path": self.log_path,
+            "error_file": self.error_file,
+            "error": self.error,
+            "returncode": self.returncode,
+            "engine": self.engine,
+            "progress": self.progress,
+            "output_lines": self.output_seq,
+        }
+
+
+class JobManager:
+    """
+    ejecuta los trabajos en un pool de hilos propio y acotado (no usa el
+    threadpool de uvicorn) y conserva el historial de los últimos trabajos.
+    Los trabajos con gate esperan fuera del pool, sin ocupar un worker,
+    hasta que gate() devuelve True.
+    """
+
+    def __init__(self, max_workers: int = 16, max_history: int = 500, gate_poll: float = GATE_POLL):
+        self.max_workers = max_workers
+        self.max_history = max_history
+        self.gate_poll = gate_poll
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        #trabajos en espera: (job, fn, gate, deadline); los revisa un único hilo
+        self._waiting: List[tuple] = []
+        self._wake = threading.Event()
+        self._waiter: threading.Thread | None = None
+
+    def submit(self, script: str, params: Dict[str, Any], fn: Callable[[Job], Dict[str, Any] | None],
+               gate: Callable[[Job], bool] | None = None, gate_timeout: float | None = None) -> Job:
+        """
+        encola fn(job). Con gate, el trabajo queda en 'queued' sin ocupar
+        worker hasta que gate(job) sea True; si pasa gate_timeout antes,
+        termina en error.
+        """
+        job = Job(id=uuid.uuid4().hex, script=script, params=dict(params))
+        with self._lock:
+            self._jobs[job.id] = job
+            self._purgar()
+        if gate is None:
+            self._pool.submit(self._run, job, fn)
+            return job
+        if self._abrir(job, fn, gate):
+            return job
+        deadline = None if gate_timeout is None else time.time() + gate_timeout
+        with self._lock:
+            self._waiting.append((job, fn, gate, deadline))
+            if self._waiter is None or not self._waiter.is_alive():
+                self._waiter = threading.Thread(target=self._esperar, name="job-gate", daemon=True)
+                self._waiter.start()
+        return job
+
+    def _abrir(self, job: Job, fn, gate) -> bool:
+        #True si el trabajo ya no espera (pasó al pool o falló la condición)
+        try:
+            if not gate(job):
+                return False
+        except Exception as e:
+            self._fallar(job, str(e))
+            return True
+        self._pool.submit(self._run, job, fn)
+        return True
+
+    def _fallar(self, job: Job, error: str) -> None:
+        job.status = "error"
+        job.error = error
+        job.finished_at = time.time()
+
+    def _esperar(self) -> None:
+        while True:
+            #la lista sigue en su sitio mientras se evalúan las condiciones
+            with self._lock:
+                if not self._waiting:
+                    self._waiter = None
+                    return
+                waiting = list(self._waiting)
+            salen = []
+            for item in waiting:
+                job, fn, gate, deadline = item
+                if self._abrir(job, fn, gate):
+                    salen.append(item)
+                elif deadline is not None and time.time() >= deadline:
+                    self._fallar(job, "no pudo empezar antes del límite de espera")
+                    salen.append(item)
+            with self._lock:
+                for item in salen:
+                    self._waiting.remove(item)
+            self._wake.wait(self.gate_poll)
+            self._wake.clear()
+
+    def poke(self) -> None:
+        """reevalúa ya los trabajos en espera (p.ej. al liberarse créditos)."""
+        self._wake.set()
+
+    def _run(self, job: Job, fn: Callable[[Job], Dict[str, Any] | None]) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            cambios = fn(job) or {}
+            for k, v in cambios.items():
+                setattr(job, k, v)
+            if job.status == "running":
+                job.status = "finished"
+        except Exception as e:
+            job.status = "error"
+            job.error = f"{e}\n{traceback.format_exc()}"
+        finally:
+            job.finished_at = time.time()
+
+    def _purgar(self) -> None:
+        #descarta los trabajos terminados más antiguos cuando se supera el historial
+        exceso = len(self._jobs) - self.max_history
+        if exceso <= 0:
+            return
+        for job_id in [j.id for j in self._jobs.values() if j.status in ESTADOS_FINALES][:exceso]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def list(self, status: str | None = None, script: str | None = None, limit: int = 100) -> List[Job]:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        jobs.reverse()
+        if status:
+            jobs = [j for j in jobs if j.status == status]
+        if script:
+            jobs = [j for j in jobs if j.script == script]
+        return jobs[:limit]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            estados = [j.status for j in self._jobs.values()]
+            waiting = len(self._waiting)
+        return {
+            "max_workers": self.max_workers,
+            "waiting": waiting,
+            "queued": estados.count("queued"),
+            "running": estados.count("running"),
+            "finished": estados.count("finished"),
+            "error": estados.count("error"),
+        }
+
+
+JOBS = JobManager(max_workers=int(os.getenv("JOBS_MAX_WORKERS", "16")))
@@ -0,0 +1,204 @@
+"""nvd_cache.py
+Consultas a NVD con caché persistente compartida: buscar_items_nvd,
+obtener_cve_nvd, obtener_cves_nvd, cvss_de_item (y versiones async para la API)
+"""
+from __future__ import annotations
+import asyncio
+import concurrent.futures
+import os
+from typing import Any, Dict, Iterable, List
+
+import http_client
+from persistent_cache import PersistentCache
+
+
+NVD_API_URL = "https://services.nvd.nist.gov/rest/json/cves/2.0"
+
+NVD_CACHE_TTL = int(os.getenv("NVD_CACHE_TTL", str(60 * 60 * 24)))
+NVD_CACHE_MAX = int(os.getenv("NVD_CACHE_MAX", "20000"))
+
+#producto+versión -> primeros items crudos de NVD (escaneo_activo_cve, nmap_scan)
+NVD_KEYWORD_CACHE = PersistentCache("nvd_keyword", ttl=NVD_CACHE_TTL, max_entries=NVD_CACHE_MAX)
+#CVE -> datos del CVE (/nvd/cve de la API)
+NVD_CVE_CACHE = PersistentCache("nvd_cve", ttl=NVD_CACHE_TTL, max_entries=NVD_CACHE_MAX)
+
+MAX_ITEMS = 10
+
+#consultas simultáneas a NVD en los lotes de obtener_cves_nvd
+NVD_MAX_WORKERS = int(os.getenv("NVD_MAX_WORKERS", "4"))
+
+
+def _headers(api_key: str | None) -> Dict[str, str]:
+    return {"apiKey": api_key} if api_key else {}
+
+
+def _consultar_keyword(product: str, version: str, api_key: str | None) -> List[Dict[str, Any]]:
+    queries = []
+    if version:
+        queries.append(f"{product} {version}")
+    queries.append(product)
+
+    errores = []
+    for query in queries:
+        try:
+            r = http_client.get(
+                NVD_API_URL,
+                params={"keywordSearch": query, "resultsPerPage": 80},
+                headers=_headers(api_key),
+                timeout=10
+            )
+            if r.status_code != 200:
+                errores.append(f"HTTP {r.status_code}")
+                continue
+            found = r.json().get("vulnerabilities", [])
+            if found:
+                return found[:MAX_ITEMS]
+        except Exception as e:
+            errores.append(str(e))
+
+    #un fallo de red o de cuota no debe quedar cacheado como "sin CVEs"
+    if errores:
+        raise RuntimeError(f"NVD keywordSearch {product} {version}: {'; '.join(errores)}")
+    return []
+
+
+def buscar_items_nvd(product: str, version: str = "", api_key: str | None = None) -> List[Dict[str, Any]]:
+    """
+    items crudos de NVD para producto/versión (búsqueda por versión y, si no hay
+    nada, solo por producto). Cacheado en disco para todos los procesos; las
+    peticiones simultáneas de la misma clave hacen una sola llamada a NVD.
+    """
+    key = f"{product}_{version}"
+    return NVD_KEYWORD_CACHE.get_or_compute(key, lambda: _consultar_keyword(product, version, api_key))
+
+
+def cvss_de_item(item: Dict[str, Any]) -> float | None:
+    metrics = item.get("cve", {}).get("metrics", {})
+    for name in ("cvssMetricV31", "cvssMetricV30", "cvssMetricV2"):
+        if name in metrics:
+            return metrics[name][0]["cvssData"]["baseScore"]
+    return None
+
+
+def descripcion_de_item(item: Dict[str, Any]) -> str:
+    descs = item.get("cve", {}).get("descriptions") or []
+    return descs[0]["value"] if descs else ""
+
+
+def severidad_de_item(item: Dict[str, Any]) -> str:
+    """baseSeverity de NVD (Critical/High/Medium/Low) o, si falta, derivada del CVSS."""
+    metrics = item.get("cve", {}).get("metrics", {})
+    for name in ("cvssMetricV31", "cvssMetricV30", "cvssMetricV2"):
+        if name in metrics:
+            m = metrics[name][0]
+            sev = m.get("cvssData", {}).get("baseSeverity") or m.get("baseSeverity")
+            if sev:
+                return sev.title()
+    cvss = cvss_de_item(item)
+    if cvss is None:
+        return "Unknown"
+    if cvss >= 9.0:
+        return "Critical"
+    if cvss >= 7.0:
+        return "High"
+    if cvss >= 4.0:
+        return "Medium"
+    return "Low"
+
+
+def resumen_de_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    cve = item.get("cve", {})
+    return {
+        "cve": cve.get("id"),
+        "description": descripcion_de_item(item),
+        "cvss": cvss_de_item(item),
+        "severity": severidad_de_item(item),
+        "published": cve.get("published"),
+        "last_modified": cve.get("lastModified"),
+        "cwe": sorted({d.get("value") for w in cve.get("weaknesses", []) for d in w.get("description", [])
+                       if d.get("value")}),
+        "impact": cve.get("metrics", {}),
+    }
+
+
+def _resumen_respuesta(cve_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    found = data.get("vulnerabilities", [])
+    if not found:
+        return {"cve": cve_id, "description": "", "cvss": None, "severity": "Unknown", "found": False}
+    return {**resumen_de_item(found[0]), "found": True}
+
+
+def _consultar_cve(cve_id: str, api_key: str | None) -> Dict[str, Any]:
+    r = http_client.get(NVD_API_URL, params={"cveId": cve_id}, headers=_headers(api_key), timeout=10)
+    r.raise_for_status()
+    return _resumen_respuesta(cve_id, r.json())
+
+
+async def _consultar_cve_async(cve_id: str, api_key: str | None) -> Dict[str, Any]:
+    r = await http_client.async_get(NVD_API_URL, params={"cveId": cve_id}, headers=_headers(api_key), timeout=10)
+    r.raise_for_status()
+    return _resumen_respuesta(cve_id, r.json())
+
+
+def obtener_cve_nvd(cve_id: str, api_key: str | None = None) -> Dict[str, Any]:
+    """resumen de un CVE (API 2.0, cveId=), cacheado en disco y con single-flight."""
+    key = cve_id.upper()
+    return NVD_CVE_CACHE.get_or_compute(key, lambda: _consultar_cve(key, api_key))
+
+
+def obtener_cves_nvd(cve_ids: Iterable[str], api_key: str | None = None,
+                     max_workers: int = NVD_MAX_WORKERS) -> Dict[str, Dict[str, Any]]:
+    """
+    resuelve un lote de CVEs: los cacheados salen sin red y el resto se pide a
+    NVD con concurrencia acotada. Un fallo individual queda como {"error": ...}.
+    """
+    ids = sorted({c.upper() for c in cve_ids if c})
+    out: Dict[str, Dict[str, Any]] = {}
+    pendientes = []
+    for cve_id in ids:
+        cached = NVD_CVE_CACHE.get(cve_id)
+        if cached is not None:
+            out[cve_id] = cached
+        else:
+            pendientes.append(cve_id)
+    if pendientes:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+            futures = {ex.submit(obtener_cve_nvd, c, api_key): c for c in pendientes}
+            for f in concurrent.futures.as_completed(futures):
+                cve_id = futures[f]
+                try:
+                    out[cve_id] = f.result()
+                except Exception as e:
+                    out[cve_id] = {"cve": cve_id, "severity": "Unknown", "error": str(e)}
+    return out
+
+
+async def obtener_cve_nvd_async(cve_id: str, api_key: str | None = None) -> Dict[str, Any]:
+    """obtener_cve_nvd sin bloquear el bucle de eventos de la API."""
+    key = cve_id.upper()
+    return await NVD_CVE_CACHE.aget_or_compute(key, lambda: _consultar_cve_async(key, api_key))
+
+
+async def obtener_cves_nvd_async(cve_ids: Iterable[str], api_key: str | None = None,
+                                 max_workers: int = NVD_MAX_WORKERS) -> Dict[str, Dict[str, Any]]:
+    """obtener_cves_nvd con corrutinas en lugar de hilos."""
+    ids = sorted({c.upper() for c in cve_ids if c})
+    out: Dict[str, Dict[str, Any]] = {}
+    pendientes = []
+    for cve_id in ids:
+        cached = NVD_CVE_CACHE.get(cve_id)
+        if cached is not None:
+            out[cve_id] = cached
+        else:
+            pendientes.append(cve_id)
+    sem = asyncio.Semaphore(max(1, max_workers))
+
+    async def uno(cve_id: str) -> None:
+        async with sem:
+            try:
+                out[cve_id] = await obtener_cve_nvd_async(cve_id, api_key)
+            except Exception as e:
+                out[cve_id] = {"cve": cve_id, "severity": "Unknown", "error": str(e)}
+
+    await asyncio.gather(*(uno(c) for c in pendientes))
+    return out
@@ -0,0 +1,204 @@
+"""persistent_cache.py
+Caché en disco (SQLite) compartida entre la API y los scripts: PersistentCache
+"""
+from __future__ import annotations
+import asyncio
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+CACHE_DIR = pathlib.Path(os.getenv("SHODAN_CACHE_DIR", pathlib.Path(__file__).resolve().parent / "cache"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    ns TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+);
+CREATE INDEX IF NOT EXISTS idx_cache_access ON cache (ns, accessed_at);
+CREATE TABLE IF NOT EXISTS leases (
+    ns TEXT NOT NULL,
+    key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+);
+"""
+
+#no se reescribe accessed_at en cada lectura, solo si es más antiguo que esto
+TOUCH_INTERVAL = 60
+
+_MISS = object()
+
+
+class PersistentCache:
+    """
+    tabla clave/valor JSON por espacio de nombres con TTL y un máximo de
+    entradas (se expulsan las de acceso más antiguo). get_or_compute hace
+    single-flight: entre hilos con un lock por clave y entre procesos con un
+    lease en la propia base de datos, de modo que solo uno llama al origen.
+    """
+
+    def __init__(self, namespace: str, ttl: float, max_entries: int = 10000,
+                 db_path: str | pathlib.Path | None = None, lease_seconds: float = 60):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lease_seconds = lease_seconds
+        self.db_path = pathlib.Path(db_path or CACHE_DIR / "cache.sqlite3")
+        self._conn: sqlite3.Connection | None = None
+        self._pid = None
+        self._lock = threading.RLock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._async_locks: Dict[tuple, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _db(self) -> sqlite3.Connection:
+        #conexión perezosa y por proceso: los workers creados por fork no heredan la del padre
+        if self._conn is None or self._pid != os.getpid():
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.executescript(SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._db().execute(
+                "SELECT value, expires_at, accessed_at FROM cache WHERE ns = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if not row or row[1] < now:
+                self.misses += 1
+                return default
+            if now - row[2] > TOUCH_INTERVAL:
+                with self._db():
+                    self._db().execute("UPDATE cache SET accessed_at = ? WHERE ns = ? AND key = ?",
+                                       (now, self.namespace, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        now = time.time()
+        with self._lock, self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO cache (ns, key, value, stored_at, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), now,
+                 now + (self.ttl if ttl is None else ttl), now)
+            )
+            self._evict(db, now)
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._db() as db:
+            db.execute("DELETE FROM cache WHERE ns = ? AND key = ?", (self.namespace, key))
+
+    def _evict(self, db: sqlite3.Connection, now: float) -> None:
+        db.execute("DELETE FROM cache WHERE ns = ? AND expires_at < ?", (self.namespace, now))
+        count = db.execute("SELECT COUNT(*) FROM cache WHERE ns = ?", (self.namespace,)).fetchone()[0]
+        if count > self.max_entries:
+            db.execute(
+                "DELETE FROM cache WHERE ns = ? AND key IN "
+                "(SELECT key FROM cache WHERE ns = ? ORDER BY accessed_at LIMIT ?)",
+                (self.namespace, self.namespace, count - self.max_entries)
+            )
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _acquire_lease(self, key: str, owner: str) -> bool:
+        now = time.time()
+        with self._lock, self._db() as db:
+            cur = db.execute(
+                "INSERT INTO leases (ns, key, owner, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(ns, key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE leases.expires_at < ?",
+                (self.namespace, key, owner, now + self.lease_seconds, now)
+            )
+            return cur.rowcount == 1
+
+    def _release_lease(self, key: str, owner: str) -> None:
+        with self._lock, self._db() as db:
+            db.execute("DELETE FROM leases WHERE ns = ? AND key = ? AND owner = ?", (self.namespace, key, owner))
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: float | None = None) -> Any:
+        """
+        valor en caché o compute() una sola vez aunque lo pidan a la vez varios
+        hilos o procesos. Si compute() lanza una excepción no se guarda nada.
+        """
+        value = self.get(key, _MISS)
+        if value is not _MISS:
+            return value
+        with self._key_lock(key):
+            value = self.get(key, _MISS)
+            if value is not _MISS:
+                return value
+            owner = f"{os.getpid()}:{threading.get_ident()}"
+            deadline = time.time() + self.lease_seconds
+            while not self._acquire_lease(key, owner):
+                #otro proceso lo está calculando: esperar su resultado
+                time.sleep(0.2)
+                value = self.get(key, _MISS)
+                if value is not _MISS:
+                    return value
+                if time.time() > deadline:
+                    break
+            try:
+                value = compute()
+                self.set(key, value, ttl)
+                return value
+            finally:
+                self._release_lease(key, owner)
+
+    async def aget_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ttl: float | None = None) -> Any:
+        """
+        versión async de get_or_compute para los handlers de la API: mismo lease
+        entre procesos, lock asyncio por clave dentro del bucle de eventos.
+        """
+        value = self.get(key, _MISS)
+        if value is not _MISS:
+            return value
+        lock_key = (id(asyncio.get_running_loop()), key)
+        lock = self._async_locks.setdefault(lock_key, asyncio.Lock())
+        async with lock:
+            try:
+                value = self.get(key, _MISS)
+                if value is not _MISS:
+                    return value
+                owner = f"{os.getpid()}:async:{id(lock)}"
+                deadline = time.time() + self.lease_seconds
+                while not self._acquire_lease(key, owner):
+                    await asyncio.sleep(0.2)
+                    value = self.get(key, _MISS)
+                    if value is not _MISS:
+                        return value
+                    if time.time() > deadline:
+                        break
+                try:
+                    value = await compute()
+                    self.set(key, value, ttl)
+                    return value
+                finally:
+                    self._release_lease(key, owner)
+            finally:
+                if not lock._waiters:
+                    self._async_locks.pop(lock_key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count = self._db().execute("SELECT COUNT(*) FROM cache WHERE ns = ?", (self.namespace,)).fetchone()[0]
+        return {"namespace": self.namespace, "entries": count, "max_entries": self.max_entries,
+                "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
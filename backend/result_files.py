@@ -0,0 +1,244 @@
+"""result_files.py
+Entrega eficiente de archivos de resultados: ETag fuerte, streaming
+comprimido (gzip/br) y LRU de objetos JSON ya parseados.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Iterator, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+CHUNK_SIZE = 256 * 1024
+
+#por debajo de este tamaño no compensa comprimir
+MIN_COMPRESS_BYTES = 1024
+
+
+def _firma(path: pathlib.Path) -> Tuple[str, int, int]:
+    st = path.stat()
+    return str(path.resolve()), st.st_mtime_ns, st.st_size
+
+
+class ParsedCache:
+    """
+    LRU de objetos JSON parseados, clave ruta+mtime+tamaño. Se acota por
+    número de entradas y por la suma de tamaños en disco de los archivos.
+    El objeto devuelto es compartido: los llamadores no deben modificarlo.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, Tuple[int, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path: str | pathlib.Path) -> Any:
+        key, mtime, size = _firma(pathlib.Path(path))
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] == mtime and entry[1] == size:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+        self.misses += 1
+        with open(key, "rb") as f:
+            obj = json.load(f)
+        if size <= self.max_bytes:
+            with self._lock:
+                old = self._data.pop(key, None)
+                if old:
+                    self._bytes -= old[1]
+                self._data[key] = (mtime, size, obj)
+                self._bytes += size
+                while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                    _, (_, s, _) = self._data.popitem(last=False)
+                    self._bytes -= s
+        return obj
+
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+class EtagCache:
+    """sha256 del contenido, recalculado solo cuando cambian mtime o tamaño."""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str | pathlib.Path) -> str:
+        key, mtime, size = _firma(pathlib.Path(path))
+        with self._lock:
+            entry = self._data.get(key)
+            if entry and entry[0] == mtime and entry[1] == size:
+                self._data.move_to_end(key)
+                return entry[2]
+        h = hashlib.sha256()
+        with open(key, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                h.update(chunk)
+        etag = f'"{h.hexdigest()[:32]}"'
+        with self._lock:
+            self._data[key] = (mtime, size, etag)
+            if len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return etag
+
+
+def choose_encoding(accept_encoding: str | None, size: int) -> str:
+    """br si hay módulo brotli, si no gzip, si el cliente los acepta."""
+    if size < MIN_COMPRESS_BYTES or not accept_encoding:
+        return "identity"
+    aceptadas = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        aceptadas[name.strip().lower()] = q
+    if brotli is not None and aceptadas.get("br", 0) > 0:
+        return "br"
+    if aceptadas.get("gzip", 0) > 0:
+        return "gzip"
+    return "identity"
+
+
+def iter_file(path: str | pathlib.Path, encoding: str = "identity") -> Iterator[bytes]:
+    """lee el archivo por bloques y lo comprime sobre la marcha si se pide."""
+    if encoding == "gzip":
+        comp = zlib.compressobj(6, zlib.DEFLATED, 31)
+        flush = comp.flush
+    elif encoding == "br":
+        comp = brotli.Compressor(quality=5)
+        flush = comp.finish
+    else:
+        comp = None
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            if comp is None:
+                yield chunk
+            else:
+                out = comp.compress(chunk) if encoding == "gzip" else comp.process(chunk)
+                if out:
+                    yield out
+    if comp is not None:
+        yield flush()
+
+
+PARSED = ParsedCache(
+    max_entries=int(os.getenv("RESULTS_LRU_ENTRIES", "32")),
+    max_bytes=int(os.getenv("RESULTS_LRU_MB", "256")) * 1024 * 1024,
+)
+ETAGS = EtagCache()
+
+
+#colecciones reconocidas, en el mismo orden que normalizeData del frontend
+ROW_COLLECTIONS = ("results", "data", "matches")
+
+#campos pesados que se omiten si no se piden columnas concretas
+DEFAULT_EXCLUDE = ("raw_data", "raw", "http", "ssl.cert.extensions")
+
+_MISSING = object()
+
+
+def find_rows(obj: Any, collection: str | None = None) -> Tuple[str, list]:
+    """
+    localiza la lista de filas del resultado: lista de primer nivel o
+    results/data/matches. collection permite una ruta explícita (data.0.events).
+    """
+    if collection:
+        rows = get_field(obj, collection)
+        if not isinstance(rows, list):
+            raise ValueError(f"Collection {collection} is not a list")
+        return collection, rows
+    if isinstance(obj, list):
+        return "", obj
+    if isinstance(obj, dict):
+        for key in ROW_COLLECTIONS:
+            if isinstance(obj.get(key), list):
+                return key, obj[key]
+    return "", [obj]
+
+
+def get_field(obj: Any, dotted: str, default: Any = None) -> Any:
+    cur = obj
+    for part in dotted.split("."):
+        if isinstance(cur, dict):
+            cur = cur.get(part, _MISSING)
+        elif isinstance(cur, list) and part.isdigit() and int(part) < len(cur):
+            cur = cur[int(part)]
+        else:
+            cur = _MISSING
+        if cur is _MISSING:
+            return default
+    return cur
+
+
+def _without(row: Any, dotted: str) -> Any:
+    #copia superficial por niveles: la fila de la LRU no se modifica
+    if not isinstance(row, dict):
+        return row
+    head, _, rest = dotted.partition(".")
+    if head not in row:
+        return row
+    out = dict(row)
+    if rest:
+        out[head] = _without(row[head], rest)
+    else:
+        del out[head]
+    return out
+
+
+def _sort_key(value: Any):
+    if value is None:
+        return (2, 0, "")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, value, "")
+    return (1, 0, str(value))
+
+
+def select_rows(obj: Any, fields: list | None = None, offset: int = 0, limit: int = 100,
+                sort: str | None = None, collection: str | None = None,
+                exclude: tuple = DEFAULT_EXCLUDE) -> dict:
+    """proyección de columnas, orden (campo o -campo) y ventana offset/limit."""
+    path, rows = find_rows(obj, collection)
+    total = len(rows)
+    if sort:
+        desc = sort.startswith("-")
+        key = sort.lstrip("-")
+        #los vacíos quedan al final en ambos sentidos
+        con = [r for r in rows if get_field(r, key) is not None]
+        sin = [r for r in rows if get_field(r, key) is None]
+        rows = sorted(con, key=lambda r: _sort_key(get_field(r, key)), reverse=desc) + sin
+    window = rows[offset:offset + limit]
+    if fields:
+        window = [{f: get_field(r, f) for f in fields} for r in window]
+    else:
+        for dotted in exclude:
+            window = [_without(r, dotted) for r in window]
+    return {
+        "collection": path,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "sort": sort,
+        "fields": fields,
+        "rows": window,
+    }
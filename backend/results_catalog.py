@@ -0,0 +1,266 @@
+"""results_catalog.py
+Catálogo SQLite de los archivos de results/: ResultsCatalog
+"""
+from __future__ import annotations
+import base64
+import datetime
+import json
+import pathlib
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, List, Tuple
+
+
+#prefijo_YYYYmmddTHHMMSSZ[_hex][_sufijo].json (run_script, _save_result_file, *_final.json)
+NAME_RE = re.compile(r"^(?P<prefix>.+?)_(?P<ts>\d{8}T\d{6}Z)(?:_.+)?$")
+
+SORT_COLUMNS = ("created_at", "name", "size", "script", "cve_count")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    name TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    script TEXT,
+    target TEXT,
+    status TEXT,
+    created_at TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    cve_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_results_created ON results (created_at, name);
+CREATE INDEX IF NOT EXISTS idx_results_script ON results (script, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_target ON results (target);
+CREATE TABLE IF NOT EXISTS cve_occurrences (
+    cve TEXT NOT NULL,
+    ip TEXT,
+    port INTEGER,
+    product TEXT,
+    version TEXT,
+    script TEXT,
+    name TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_cve_occ_cve ON cve_occurrences (cve, created_at);
+CREATE INDEX IF NOT EXISTS idx_cve_occ_name ON cve_occurrences (name);
+CREATE TABLE IF NOT EXISTS cve_indexed_files (
+    name TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_cves (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    cves TEXT NOT NULL
+);
+"""
+
+
+def parse_result_name(name: str) -> Dict[str, Any]:
+    """deduce tipo, script y fecha a partir del nombre del archivo."""
+    stem = name[:-5] if name.endswith(".json") else name
+    m = NAME_RE.match(stem)
+    prefix = m.group("prefix") if m else stem
+    created_at = None
+    if m:
+        created_at = datetime.datetime.strptime(m.group("ts"), "%Y%m%dT%H%M%SZ").isoformat() + "Z"
+    kind, script, status = "result", prefix, "finished"
+    if prefix.startswith("meta_"):
+        kind, script = "meta", prefix[5:]
+    elif prefix.startswith("error_"):
+        kind, script, status = "error", prefix[6:], "error"
+    return {"kind": kind, "script": script, "status": status, "created_at": created_at}
+
+
+def _encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+class ResultsCatalog:
+    """
+    índice de los resultados: se alimenta cuando se escribe cada archivo
+    (record) y se reconcilia con el directorio solo en sync(). Las consultas
+    de /results no recorren el sistema de archivos.
+    """
+
+    def __init__(self, results_dir: pathlib.Path, db_path: pathlib.Path | None = None):
+        self.results_dir = pathlib.Path(results_dir)
+        self.db_path = pathlib.Path(db_path or self.results_dir / ".catalog.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._synced = False
+
+    def record(self, path: str | pathlib.Path, script: str | None = None, target: str | None = None,
+               status: str | None = None, cve_count: int | None = None) -> None:
+        p = pathlib.Path(path)
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            return
+        info = parse_result_name(p.name)
+        created_at = info["created_at"] or datetime.datetime.utcfromtimestamp(st.st_mtime).isoformat() + "Z"
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO results (name, path, kind, script, target, status, created_at, size, mtime_ns, cve_count)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET
+                     path=excluded.path, size=excluded.size, mtime_ns=excluded.mtime_ns,
+                     script=COALESCE(excluded.script, results.script),
+                     target=COALESCE(excluded.target, results.target),
+                     status=COALESCE(excluded.status, results.status),
+                     cve_count=COALESCE(excluded.cve_count, results.cve_count)""",
+                (p.name, str(p), info["kind"], script or info["script"], target, status or info["status"],
+                 created_at, st.st_size, st.st_mtime_ns, cve_count)
+            )
+
+    def sync(self) -> Dict[str, int]:
+        """reconcilia con results/: añade archivos nuevos y borra los que ya no existen."""
+        en_disco = {f.name: f for f in self.results_dir.glob("*.json")}
+        with self._lock:
+            conocidos = {r["name"]: r["mtime_ns"] for r in self._conn.execute("SELECT name, mtime_ns FROM results")}
+        nuevos = 0
+        for name, f in en_disco.items():
+            if name not in conocidos or conocidos[name] != f.stat().st_mtime_ns:
+                self.record(f)
+                nuevos += 1
+        borrados = [n for n in conocidos if n not in en_disco]
+        with self._lock, self._conn:
+            for tabla in ("results", "cve_occurrences", "cve_indexed_files"):
+                self._conn.executemany(f"DELETE FROM {tabla} WHERE name = ?", [(n,) for n in borrados])
+        self._synced = True
+        return {"added": nuevos, "removed": len(borrados), "total": len(en_disco)}
+
+    def query(self, script: str | None = None, target: str | None = None, status: str | None = None,
+              kind: str | None = None, since: str | None = None, until: str | None = None,
+              sort: str = "created_at", order: str = "desc", limit: int = 100,
+              cursor: str | None = None) -> Tuple[List[Dict[str, Any]], str | None, int]:
+        """devuelve (items, next_cursor, total) con paginación por clave (sort, name)."""
+        if not self._synced:
+            self.sync()
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Invalid sort: {sort}")
+        desc = order.lower() == "desc"
+        where, args = [], []
+        if script:
+            where.append("script = ?"); args.append(script)
+        if target:
+            where.append("target LIKE ?"); args.append(f"%{target}%")
+        if status:
+            where.append("status = ?"); args.append(status)
+        if kind:
+            where.append("kind = ?"); args.append(kind)
+        if since:
+            where.append("created_at >= ?"); args.append(since)
+        if until:
+            where.append("created_at <= ?"); args.append(until)
+
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM results {'WHERE ' + ' AND '.join(where) if where else ''}", args
+            ).fetchone()[0]
+
+        #los NULL se ordenan como '' / -1 para que el cursor sea comparable
+        null_value = "-1" if sort in ("size", "cve_count") else "''"
+        col = f"COALESCE({sort}, {null_value})"
+        if cursor:
+            last_value, last_name = _decode_cursor(cursor)
+            op = "<" if desc else ">"
+            where.append(f"({col}, name) {op} (?, ?)")
+            args.extend([last_value, last_name])
+        direction = "DESC" if desc else "ASC"
+        sql = (f"SELECT *, {col} AS sort_value FROM results "
+               f"{'WHERE ' + ' AND '.join(where) if where else ''} "
+               f"ORDER BY {col} {direction}, name {direction} LIMIT ?")
+        with self._lock:
+            rows = [dict(r) for r in self._conn.execute(sql, args + [limit + 1])]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor([rows[-1]["sort_value"], rows[-1]["name"]])
+        for r in rows:
+            r.pop("sort_value", None)
+        return rows, next_cursor, total
+
+    def get_cves(self, path: str | pathlib.Path, mtime_ns: int, size: int) -> List[str] | None:
+        """conjunto de CVEs guardado para el archivo, solo si no ha cambiado desde entonces."""
+        with self._lock:
+            row = self._conn.execute("SELECT mtime_ns, size, cves FROM file_cves WHERE path = ?",
+                                     (str(path),)).fetchone()
+        if row and row["mtime_ns"] == mtime_ns and row["size"] == size:
+            return json.loads(row["cves"])
+        return None
+
+    def set_cves(self, path: str | pathlib.Path, mtime_ns: int, size: int, cves: List[str]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_cves (path, mtime_ns, size, cves) VALUES (?, ?, ?, ?)",
+                (str(path), mtime_ns, size, json.dumps(cves))
+            )
+            self._conn.execute("UPDATE results SET cve_count = ? WHERE path = ? OR name = ?",
+                               (len(cves), str(path), pathlib.Path(path).name))
+
+    def index_occurrences(self, name: str, occurrences: List[Dict[str, Any]], script: str | None = None,
+                          created_at: str | None = None, mtime_ns: int = 0) -> None:
+        """sustituye las apariciones de CVE de un archivo (índice CVE -> host/puerto/archivo)."""
+        rows = [(o["cve"], o.get("ip"), o.get("port"), o.get("product"), o.get("version"),
+                 script, name, created_at) for o in occurrences]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cve_occurrences WHERE name = ?", (name,))
+            self._conn.executemany(
+                "INSERT INTO cve_occurrences (cve, ip, port, product, version, script, name, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            self._conn.execute("INSERT OR REPLACE INTO cve_indexed_files (name, mtime_ns) VALUES (?, ?)",
+                               (name, mtime_ns))
+
+    def pending_cve_files(self) -> List[Dict[str, Any]]:
+        """resultados del catálogo que aún no están (o ya no están al día) en el índice de CVEs."""
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT r.* FROM results r LEFT JOIN cve_indexed_files i ON i.name = r.name
+                   WHERE r.kind = 'result' AND (i.name IS NULL OR i.mtime_ns != r.mtime_ns)"""
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def cve_occurrences(self, cve: str, limit: int = 100, offset: int = 0) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                """SELECT o.*, r.path FROM cve_occurrences o LEFT JOIN results r ON r.name = o.name
+                   WHERE o.cve = ? ORDER BY o.created_at DESC, o.name, o.ip, o.port LIMIT ? OFFSET ?""",
+                (cve, limit, offset)
+            ).fetchall()
+            totals = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT ip), COUNT(DISTINCT name) FROM cve_occurrences WHERE cve = ?",
+                (cve,)
+            ).fetchone()
+        return [dict(r) for r in rows], {"occurrences": totals[0], "hosts": totals[1], "files": totals[2]}
+
+    def top_cves(self, limit: int = 20, script: str | None = None) -> List[Dict[str, Any]]:
+        where, args = ("WHERE script = ?", [script]) if script else ("", [])
+        with self._lock:
+            rows = self._conn.execute(
+                f"""SELECT cve, COUNT(*) AS occurrences, COUNT(DISTINCT ip) AS hosts,
+                           COUNT(DISTINCT name) AS files, MAX(created_at) AS last_seen
+                    FROM cve_occurrences {where}
+                    GROUP BY cve ORDER BY hosts DESC, occurrences DESC, cve LIMIT ?""",
+                args + [limit]
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def get(self, name: str) -> Dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM results WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
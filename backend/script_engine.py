@@ -0,0 +1,173 @@
+"""script_engine.py
+Ejecución de scripts dentro de intérpretes precalentados: ScriptEngine
+"""
+from __future__ import annotations
+import importlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import pathlib
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict
+
+
+#módulos pesados que el forkserver importa una sola vez; cada worker nace con ellos cargados
+WARM_IMPORTS = ["shodan", "requests", "xml.etree.ElementTree", "shodan_common"]
+
+#caché por proceso worker: {ruta: (mtime_ns, módulo)}
+_MODULOS: Dict[str, tuple] = {}
+
+
+class EngineUnavailable(RuntimeError):
+    """el pool de workers no puede ejecutar el trabajo; usar el subproceso."""
+
+
+def _cargar_modulo(script_path: str):
+    mtime = os.stat(script_path).st_mtime_ns
+    cached = _MODULOS.get(script_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    nombre = f"script_{pathlib.Path(script_path).stem}"
+    spec = importlib.util.spec_from_file_location(nombre, script_path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    _MODULOS[script_path] = (mtime, mod)
+    return mod
+
+
+def _init_worker(script_paths: list) -> None:
+    #precarga los scripts con entrypoint para que la primera ejecución no pague el import
+    for path in script_paths:
+        try:
+            _cargar_modulo(path)
+        except Exception as e:
+            print(f"[WARN] script_engine: no se pudo precargar {path}: {e}", file=sys.stderr)
+
+
+def _noop() -> int:
+    return os.getpid()
+
+
+def _ejecutar_en_worker(script_path: str, entrypoint: str, params: Dict[str, Any],
+                        env: Dict[str, str], log_file: str | None) -> Any:
+    """
+    corre en el proceso worker. Aplica las variables de entorno del trabajo
+    (p.ej. SHODAN_API_KEY) solo durante la llamada y las restaura después.
+    """
+    previas = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+
+    logger = logging.getLogger(f"engine.{pathlib.Path(script_path).stem}")
+    logger.setLevel(logging.INFO)
+    handler = None
+    if log_file:
+        handler = logging.FileHandler(log_file, encoding="utf-8")
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s - %(message)s'))
+        logger.addHandler(handler)
+    try:
+        fn = getattr(_cargar_modulo(script_path), entrypoint)
+        return fn(params, logger)
+    finally:
+        if handler:
+            logger.removeHandler(handler)
+            handler.close()
+        for k, v in previas.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+class ScriptEngine:
+    """
+    pool de procesos creados desde un forkserver con WARM_IMPORTS ya cargados.
+    Los scripts que declaran "entrypoint" en SCRIPT_METADATA se ejecutan
+    llamando a esa función, sin lanzar un intérprete nuevo ni parsear argv.
+    Un trabajo que agota su timeout mata los workers y el pool se recrea,
+    igual que el subproceso mata a su hijo.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._pool: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+        self._script_paths: list = []
+        self.recycles = 0
+
+    def start(self, script_paths: list | None = None) -> ProcessPoolExecutor:
+        with self._lock:
+            if script_paths is not None:
+                self._script_paths = [str(p) for p in script_paths]
+            if self._pool is not None:
+                return self._pool
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(WARM_IMPORTS)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(list(self._script_paths),)
+            )
+            #fuerza el arranque de todos los workers ahora y no en la primera petición
+            for _ in range(self.max_workers):
+                self._pool.submit(_noop)
+            return self._pool
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _recycle(self, pool: ProcessPoolExecutor) -> None:
+        """
+        mata los workers de pool y lo descarta; el siguiente run() arranca uno
+        nuevo. Los trabajos que seguían en ese pool reciben BrokenProcessPool
+        y pasan al subproceso.
+        """
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+                self.recycles += 1
+        #_processes es la única forma de llegar a los procesos de un ProcessPoolExecutor
+        for proc in list((getattr(pool, "_processes", None) or {}).values()):
+            try:
+                proc.kill()
+            except Exception:
+                pass
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, script_path: str, entrypoint: str, params: Dict[str, Any],
+            env: Dict[str, str] | None = None, log_file: str | None = None, timeout: float | None = None) -> Any:
+        """
+        ejecuta entrypoint(params, logger) en un worker y devuelve su resultado.
+        Lanza EngineUnavailable si el pool está roto (el llamador recurre al
+        subproceso); las excepciones del propio script se propagan tal cual.
+        """
+        #se trabaja con una referencia fija: shutdown() puede poner _pool a None a la vez
+        pool = self.start()
+        try:
+            fut = pool.submit(_ejecutar_en_worker, str(script_path), entrypoint,
+                              dict(params), dict(env or {}), log_file)
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._recycle(pool)
+            raise EngineUnavailable(str(e)) from e
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            #el worker seguiría ejecutando el script: se mata y se recrea el pool
+            self._recycle(pool)
+            raise
+        except BrokenProcessPool as e:
+            self._recycle(pool)
+            raise EngineUnavailable(str(e)) from e
+
+    def stats(self) -> Dict[str, Any]:
+        return {"max_workers": self.max_workers, "started": self._pool is not None, "recycles": self.recycles}
+
+
+ENGINE = ScriptEngine(max_workers=int(os.getenv("SCRIPT_ENGINE_WORKERS", "4")))
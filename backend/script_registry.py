@@ -0,0 +1,118 @@
+"""script_registry.py
+Registro de scripts con SCRIPT_METADATA cacheado por mtime/tamaño: ScriptRegistry
+"""
+from __future__ import annotations
+import ast
+import hashlib
+import json
+import pathlib
+import threading
+import time
+from typing import Any, Dict, Tuple
+
+
+def read_script_metadata(script_path: str) -> dict:
+    try:
+        with open(script_path, 'r', encoding='utf-8') as f:
+            source = f.read()
+        tree = ast.parse(source)
+        for node in tree.body:
+            if isinstance(node, ast.Assign):
+                for target in node.targets:
+                    if getattr(target, 'id', None) == "SCRIPT_METADATA":
+                        return ast.literal_eval(node.value)
+    except Exception as e:
+        print(f"[WARN] Cannot read metadata from {script_path}: {e}")
+    return {}
+
+
+class ScriptRegistry:
+    """
+    mantiene {nombre: (ruta, firma, metadata)} para los .py de scripts_dir.
+    Un script solo se vuelve a parsear cuando cambia su (mtime_ns, tamaño).
+    El hilo vigilante recorre el directorio cada poll_interval segundos; sin
+    vigilante, la comprobación se hace al consultar como mucho con esa frecuencia.
+    """
+
+    def __init__(self, scripts_dir: pathlib.Path, poll_interval: float = 2.0):
+        self.scripts_dir = pathlib.Path(scripts_dir)
+        self.poll_interval = poll_interval
+        self._entries: Dict[str, Tuple[pathlib.Path, Tuple[int, int], dict]] = {}
+        self._etag = ""
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: threading.Thread | None = None
+
+    def refresh(self) -> bool:
+        """reescanea el directorio; devuelve True si algo cambió."""
+        with self._lock:
+            changed = False
+            vistos = set()
+            for f in self.scripts_dir.glob("*.py"):
+                try:
+                    st = f.stat()
+                except FileNotFoundError:
+                    continue
+                firma = (st.st_mtime_ns, st.st_size)
+                vistos.add(f.stem)
+                entry = self._entries.get(f.stem)
+                if entry and entry[1] == firma:
+                    continue
+                self._entries[f.stem] = (f.resolve(), firma, read_script_metadata(str(f)))
+                changed = True
+            for name in set(self._entries) - vistos:
+                del self._entries[name]
+                changed = True
+            if changed or not self._etag:
+                self._etag = self._compute_etag()
+            self._checked_at = time.monotonic()
+            return changed
+
+    def _ensure_fresh(self) -> None:
+        if self._watcher is None and time.monotonic() - self._checked_at >= self.poll_interval:
+            self.refresh()
+
+    def _compute_etag(self) -> str:
+        body = json.dumps(self._build_schema(), sort_keys=True, ensure_ascii=False, default=str)
+        return '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+
+    def _build_schema(self) -> Dict[str, Any]:
+        return {
+            name: {"description": meta.get("description", ""), "params": meta.get("params", [])}
+            for name, (_, _, meta) in sorted(self._entries.items())
+        }
+
+    def scripts(self) -> Dict[str, pathlib.Path]:
+        self._ensure_fresh()
+        return {name: path for name, (path, _, _) in self._entries.items()}
+
+    def metadata(self, name: str) -> dict:
+        self._ensure_fresh()
+        entry = self._entries.get(name)
+        return entry[2] if entry else {}
+
+    def schema(self) -> Tuple[Dict[str, Any], str]:
+        self._ensure_fresh()
+        with self._lock:
+            return self._build_schema(), self._etag
+
+    def start_watcher(self) -> None:
+        if self._watcher is not None:
+            return
+        self.refresh()
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="script-registry", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+        self._watcher = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                if self.refresh():
+                    print(f"[DEBUG] script_registry -> cambios detectados en {self.scripts_dir}")
+            except Exception as e:
+                print(f"[WARN] script_registry -> {e}")
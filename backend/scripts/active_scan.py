@@ -1,19 +1,19 @@
 import argparse
 import json
 from datetime import datetime, timezone
-import time
 from pathlib import Path
 import sys
-import traceback
 import os
 
 SCRIPT_METADATA = {
-    "description": "No permitido para el plan Membership !!! Permite iniciar un escaneo activo sobre una IP para detectar puertos, servicios y certificados, consumiendo créditos de la API. Los resultados se esperan con un timeout, se guardan en JSON y luego pueden procesarse en tu dashboard React.",
+    "description": "No permitido para el plan Membership !!! Permite iniciar un escaneo activo sobre una o muchas IPs (lista, CIDR o archivo) para detectar puertos, servicios y certificados, consumiendo un crédito de escaneo por IP. Los objetivos se envían agrupados, los resultados se esperan con un timeout, se guardan en JSON y luego pueden procesarse en tu dashboard React.",
     "params": [
-        {"name": "target", "label": "Target IP (propia o con permiso)", "type": "text", "required": True, "placeholder": "1.2.3.4"},
-        {"name": "wait_interval", "label": "Espera entre checks (segundos)", "type": "number", "required": False, "placeholder": 10},
-        {"name": "timeout", "label": "Timeout máximo (segundos)", "type": "number", "required": False, "placeholder": 600}
-    ]
+        {"name": "target", "label": "Targets: IP, lista, CIDR o archivo (propios o con permiso)", "type": "text", "required": True, "placeholder": "1.2.3.4, 10.0.0.0/28"},
+        {"name": "wait_interval", "label": "Espera inicial entre checks (segundos)", "type": "number", "required": False, "placeholder": 2},
+        {"name": "timeout", "label": "Timeout máximo (segundos)", "type": "number", "required": False, "placeholder": 600},
+        {"name": "max_workers", "label": "Hosts consultados en paralelo", "type": "number", "required": False, "placeholder": 8}
+    ],
+    "credits": {"kind": "scan", "amount": 1, "targets": "target"}
 }
 
 try:
@@ -22,38 +22,15 @@ except ImportError:
     print("Falta la dependencia 'shodan'. Instálala con: pip install shodan", file=sys.stderr)
     raise
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from shodan_common import crear_api
+from batch_scan import escanear_lote, expandir_objetivos
+
 
 def ahoraIso():
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat() + "Z"
 
 
-def escaneoActivo(api: shodan.Shodan, ip: str):
-    try:
-        escaneo = api.scan(ip)
-        scanId = escaneo.get("id")
-        print(f"[INFO] Scan iniciado para {ip}, scanId={scanId}")
-        return scanId
-    except shodan.exception.APIError as e:
-        return {"ip": ip, "error": str(e)}
-    except Exception as e:
-        return {"ip": ip, "error": str(e), "traceback": traceback.format_exc()}
-
-
-def esperarFinalizacion(api: shodan.Shodan, scanId: str, waitInterval: int = 10, timeout: int = 600):
-    tiempoInicio = time.time()
-    while True:
-        try:
-            estado = api.scan_status(scanId)
-        except shodan.exception.APIError as e:
-            return {"status": "ERROR", "error": str(e)}
-        estadoActual = estado.get("status", "").upper()
-        if estadoActual == "DONE":
-            return estado
-        if time.time() - tiempoInicio > timeout:
-            return {"status": "TIMEOUT", "scanId": scanId}
-        time.sleep(waitInterval)
-
-
 def procesarDatos(raw):
     listaResultados = []
 
@@ -98,26 +75,35 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--target", required=True)
     parser.add_argument("--out", required=True)
-    parser.add_argument("--wait_interval", type=int, default=10)
+    parser.add_argument("--wait_interval", type=float, default=2)
     parser.add_argument("--timeout", type=int, default=600)
+    parser.add_argument("--max_workers", type=int, default=8)
     args = parser.parse_args()
 
     claveApi = os.environ.get("SHODAN_API_KEY")
     if not claveApi:
         print("ERROR: SHODAN_API_KEY no definida", file=sys.stderr)
         sys.exit(1)
-    api = shodan.Shodan(claveApi)
-
-    scanId = escaneoActivo(api, args.target)
-    if not isinstance(scanId, str):
-        resultadosTabla = [{"error": scanId}]
-    else:
-        esperarFinalizacion(api, scanId, args.wait_interval, args.timeout)
-        try:
-            infoHost = api.host(args.target, minify=False)
-            resultadosTabla = procesarDatos(infoHost)
-        except Exception as e:
-            resultadosTabla = [{"error": str(e)}]
+    api = crear_api(claveApi)
+
+    try:
+        objetivos = expandir_objetivos(args.target)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    #todos los objetivos en pocos api.scan; los hosts se piden según termina cada scan
+    lote = escanear_lote(api, objetivos, timeout=args.timeout, max_workers=args.max_workers,
+                         poll_min=args.wait_interval)
+    for s in lote["scans"]:
+        print(f"[INFO] Scan {s.get('id')} ({len(s['targets'])} objetivos): {s['status']}")
+
+    resultadosTabla = []
+    for ip, infoHost in lote["hosts"].items():
+        if "error" in infoHost:
+            resultadosTabla.append(infoHost)
+        else:
+            resultadosTabla.extend(procesarDatos(infoHost))
 
     rutaSalida = Path(args.out)
     rutaSalida.parent.mkdir(parents=True, exist_ok=True)
@@ -1,11 +1,9 @@
 from __future__ import annotations
 import argparse
 import json
-import time
 import re
 from pathlib import Path
 from datetime import datetime as dt
-import requests
 import shodan
 import sys
 import os
@@ -13,18 +11,22 @@ import concurrent.futures
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
-from shodan_common import load_api_key, save_json, setup_logger
+from shodan_common import crear_api, save_json, setup_logger
+from nvd_cache import buscar_items_nvd, cvss_de_item, descripcion_de_item
+from batch_scan import escanear_lote, expandir_objetivos
+import http_client
 
 SCRIPT_METADATA = {
     "description": "Escaneo activo con Shodan + correlación de CVEs (NVD) y exploits (Vulners).",
     "params": [
-        {"name": "target", "label": "IP objetivo (propia o con permiso)", "type": "text", "required": True},
-        {"name": "wait_interval", "label": "Intervalo entre checks (s)", "type": "number", "required": False, "placeholder": 5},
+        {"name": "target", "label": "Objetivos: IP, lista, CIDR o archivo (propios o con permiso)", "type": "text", "required": True},
+        {"name": "wait_interval", "label": "Intervalo inicial entre checks (s)", "type": "number", "required": False, "placeholder": 2},
         {"name": "timeout", "label": "Timeout máximo (s)", "type": "number", "required": False, "placeholder": 600},
         {"name": "max_workers", "label": "Hilos para consultas", "type": "number", "required": False, "placeholder": 5},       
         {"name": "nvd_api_key", "label": "API Key de NVD", "type": "password", "required": False},
         {"name": "vulners_api_key", "label": "API Key de Vulners", "type": "password", "required": False}
-    ]
+    ],
+    "credits": {"kind": "scan", "amount": 1, "targets": "target"}
 }
 
 
@@ -41,67 +43,30 @@ def normalizarVersion(raw: str) -> str:
     return m2.group(1) if m2 else raw
 
 
-CACHE_NVD = {}
-
-
 def buscarCvesNvd(product: str, version: str, nvdKey: str = "") -> list:
-    key = f"{product}_{version}"
-    if key in CACHE_NVD:
-        return CACHE_NVD[key]
-
-    queries = []
-    if version:
-        queries.append(f"{product} {version}")
-    queries.append(product)
+    #caché persistente y single-flight compartida con la API y nmap_scan; los
+    #fallos de NVD se propagan para no dar el servicio por limpio
+    items = buscar_items_nvd(product, version, nvdKey)
 
     vulns = []
-
-    for query in queries:
-        try:
-            r = requests.get(
-                "https://services.nvd.nist.gov/rest/json/cves/2.0",
-                params={"keywordSearch": query, "resultsPerPage": 80},
-                headers={"apiKey": nvdKey} if nvdKey else {},
-                timeout=10
-            )
-            if r.status_code != 200:
-                continue
-
-            data = r.json()
-            found = data.get("vulnerabilities", [])
-            if found:
-                for item in found[:10]:
-                    cve_id = item["cve"]["id"]
-                    desc = item["cve"]["descriptions"][0]["value"] if item["cve"]["descriptions"] else ""
-                    metrics = item["cve"].get("metrics", {})
-
-                    cvss = None
-                    if "cvssMetricV31" in metrics:
-                        cvss = metrics["cvssMetricV31"][0]["cvssData"]["baseScore"]
-                    elif "cvssMetricV30" in metrics:
-                        cvss = metrics["cvssMetricV30"][0]["cvssData"]["baseScore"]
-                    elif "cvssMetricV2" in metrics:
-                        cvss = metrics["cvssMetricV2"][0]["cvssData"]["baseScore"]
-
-                    vulns.append({
-                        "cve": cve_id,
-                        "description": desc,
-                        "cvss": cvss or 0,
-                        "raw_item": item
-                    })
-                break
-        except:
-            pass
-
-    CACHE_NVD[key] = vulns
+    for item in items:
+        vulns.append({
+            "cve": item["cve"]["id"],
+            "description": descripcion_de_item(item),
+            "cvss": cvss_de_item(item) or 0,
+            "raw_item": item
+        })
     return vulns
 
 
-def buscarExploitsVulners(cveList: list, vulnersKey: str = "") -> list:
-    if not cveList:
-        return []
+#CVEs por petición a Vulners y peticiones en paralelo
+VULNERS_URL = "https://vulners.com/api/v3/search/id/"
+VULNERS_CHUNK = int(os.getenv("VULNERS_CHUNK", "100"))
+VULNERS_MAX_WORKERS = int(os.getenv("VULNERS_MAX_WORKERS", "4"))
+
 
-    url = "https://vulners.com/api/v3/search/id/"
+def consultarVulners(cveList: list, vulnersKey: str = "") -> list:
+    """exploits de un bloque de CVEs en una sola petición; cvelist lleva todos los CVEs del exploit."""
     headers = {"Content-Type": "application/json"}
     if vulnersKey:
         headers["X-Api-Key"] = vulnersKey
@@ -109,26 +74,48 @@ def buscarExploitsVulners(cveList: list, vulnersKey: str = "") -> list:
     payload = {"id": cveList, "fields": ["*"]}
 
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=20)
+        r = http_client.post(VULNERS_URL, headers=headers, json=payload, timeout=20)
         if r.status_code != 200:
             return []
         docs = r.json().get("data", {}).get("documents", {})
-
-        exploits = []
-        for _, d in docs.items():
-            if d.get("type") == "exploit":
-                exploits.append({
-                    "title": d.get("title"),
-                    "href": d.get("href"),
-                    "type": d.get("type"),
-                    "cve": d.get("cvelist", ["N/A"])[0]
-                })
-
-        return exploits
-
-    except:
+    except Exception:
         return []
 
+    exploits = []
+    for _, d in docs.items():
+        if d.get("type") == "exploit":
+            exploits.append({
+                "title": d.get("title"),
+                "href": d.get("href"),
+                "type": d.get("type"),
+                "cve": d.get("cvelist", ["N/A"])[0],
+                "cvelist": d.get("cvelist") or []
+            })
+    return exploits
+
+
+def exploitsPorCve(cveIds: list, vulnersKey: str = "", chunk: int | None = None,
+                   maxWorkers: int | None = None) -> dict:
+    """
+    todos los CVEs únicos a Vulners en bloques de chunk (en paralelo) y
+    reparto local: CVE -> exploits que lo citan en su cvelist.
+    """
+    chunk = max(1, chunk or VULNERS_CHUNK)
+    maxWorkers = maxWorkers or VULNERS_MAX_WORKERS
+    unicos = list(dict.fromkeys(cveIds))
+    bloques = [unicos[i:i + chunk] for i in range(0, len(unicos), chunk)]
+    porCve = {c: [] for c in unicos}
+    if not bloques:
+        return porCve
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(bloques)))) as ex:
+        for exploits in ex.map(lambda b: consultarVulners(b, vulnersKey), bloques):
+            for e in exploits:
+                salida = {k: v for k, v in e.items() if k != "cvelist"}
+                for c in dict.fromkeys(e["cvelist"] or [e["cve"]]):
+                    if c in porCve:
+                        porCve[c].append({**salida, "cve": c})
+    return porCve
+
 
 def parseBannerVersion(banner: str) -> tuple[str, str]:
     if not banner:
@@ -162,7 +149,8 @@ def parseBannerVersion(banner: str) -> tuple[str, str]:
     return "", ""
 
 
-def analizar(item: dict, nvdKey: str, vulnersKey: str):
+def extraerServicio(item: dict) -> dict:
+    """puerto, producto y versión normalizada de un banner (sin llamadas externas)."""
     port = item.get("port")
     bannerRaw = item.get("data") or item.get("banner") or ""
 
@@ -182,91 +170,110 @@ def analizar(item: dict, nvdKey: str, vulnersKey: str):
     if verNorm in invalidVersions:
         verNorm = ""
 
-    if verNorm:
-        cves = buscarCvesNvd(productRaw, verNorm, nvdKey)
-        cveIds = [c["cve"] for c in cves]
-        exploits = buscarExploitsVulners(cveIds, vulnersKey) if cveIds else []
-    else:
-        cves = []
-        exploits = []
-
-    bannerOut = {
+    return {
         "port": port,
         "product": productRaw,
         "version": verNorm,
         "banner": bannerRaw
     }
 
+
+def severidad(cvssScore: float) -> str:
+    if cvssScore >= 9.0:
+        return "Crítico"
+    if cvssScore >= 7.0:
+        return "Alto"
+    if cvssScore >= 4.0:
+        return "Medio"
+    return "Bajo"
+
+
+def construirVulns(servicio: dict, cves: list, exploits: dict) -> list:
     vulns = []
     for c in cves:
         cvssScore = c.get("cvss", 0)
-
-        if cvssScore >= 9.0:
-            cvssSeverity = "Crítico"
-        elif cvssScore >= 7.0:
-            cvssSeverity = "Alto"
-        elif cvssScore >= 4.0:
-            cvssSeverity = "Medio"
-        else:
-            cvssSeverity = "Bajo"
-
         vulns.append({
             "cve": c["cve"],
             "description": c["description"],
             "cvss": cvssScore,
-            "severity": cvssSeverity,
-            "product": productRaw,
-            "version": verNorm,
-            "service": productRaw,
-            "port": port,
-            "exploits": [e for e in exploits if e.get("cve") == c["cve"]]
+            "severity": severidad(cvssScore),
+            "product": servicio["product"],
+            "version": servicio["version"],
+            "service": servicio["product"],
+            "port": servicio["port"],
+            "exploits": exploits.get(c["cve"], [])
         })
+    return vulns
 
-    return bannerOut, vulns, port
-
-
-def scan(api, target: str, waitInterval: int = 5, timeout: int = 600, maxWorkers: int = 5, nvdKey: str = "", vulnersKey: str = ""):
-    try:
-        scan = api.scan(target)
-        scanId = scan.get("id")
-    except Exception as e:
-        return {"error": f"Scan start error: {e}"}
-
-    start = time.time()
-    while True:
-        try:
-            status = api.scan_status(scanId)
-        except Exception as e:
-            return {"error": f"Scan status error: {e}"}
-
-        if status.get("status") == "DONE":
-            break
 
-        if time.time() - start > timeout:
-            return {"error": "TIMEOUT"}
+def resolverCves(claves: list, maxWorkers: int = 5, nvdKey: str = "") -> tuple:
+    """
+    (producto, versión) únicos -> CVEs de NVD, con maxWorkers consultas a la
+    vez. Devuelve ({clave: CVEs}, {clave: error}) con las que NVD no respondió.
+    """
+    cves, errores = {}, {}
+    if not claves:
+        return cves, errores
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(claves)))) as ex:
+        futuros = {ex.submit(buscarCvesNvd, k[0], k[1], nvdKey): k for k in claves}
+        for fut in concurrent.futures.as_completed(futuros):
+            try:
+                cves[futuros[fut]] = fut.result()
+            except Exception as e:
+                errores[futuros[fut]] = str(e) or type(e).__name__
+    return cves, errores
+
+
+def enriquecerHosts(hosts: dict, maxWorkers: int = 5, nvdKey: str = "", vulnersKey: str = "") -> dict:
+    """
+    enriquecimiento por fases de todos los hosts a la vez: 1) servicios de
+    cada banner, 2) NVD una vez por (producto, versión) único, 3) todos los
+    CVEs a Vulners en bloques, 4) unión local. Las llamadas externas crecen
+    con los productos distintos, no con los banners.
+    """
+    servicios = {ip: [extraerServicio(it) for it in host.get("data", [])] for ip, host in hosts.items()}
+
+    claves = list(dict.fromkeys(
+        (s["product"], s["version"]) for lista in servicios.values() for s in lista if s["version"]
+    ))
+    cvesPorClave, erroresNvd = resolverCves(claves, maxWorkers, nvdKey)
+    for lista in servicios.values():
+        for s in lista:
+            if (s["product"], s["version"]) in erroresNvd:
+                s["nvd_error"] = erroresNvd[(s["product"], s["version"])]
+
+    cveIds = [c["cve"] for cves in cvesPorClave.values() for c in cves]
+    exploits = exploitsPorCve(cveIds, vulnersKey)
+
+    return {
+        ip: resultadoHost(hosts[ip], ip, lista, [
+            v for s in lista
+            for v in construirVulns(s, cvesPorClave.get((s["product"], s["version"]), []), exploits)
+        ])
+        for ip, lista in servicios.items()
+    }
 
-        time.sleep(waitInterval)
 
+def scan(api, target, waitInterval: float = 2, timeout: int = 600, maxWorkers: int = 5, nvdKey: str = "", vulnersKey: str = ""):
+    """
+    escanea uno o muchos objetivos (IP, lista, CIDR o archivo) en lotes y
+    enriquece todos los hosts juntos. Devuelve un resultado por IP.
+    """
     try:
-        host = api.host(target, minify=False)
-    except Exception as e:
-        return {"error": f"Host fetch error: {e}"}
-
-    dataItems = host.get("data", [])
-
-    banners = []
-    allVulns = []
+        objetivos = expandir_objetivos(target)
+    except ValueError as e:
+        return [{"error": str(e)}]
+
+    lote = escanear_lote(api, objetivos, timeout=timeout, max_workers=maxWorkers, poll_min=waitInterval)
+    hosts = {ip: h for ip, h in lote["hosts"].items() if "error" not in h}
+    enriquecidos = enriquecerHosts(hosts, maxWorkers, nvdKey, vulnersKey)
+    return [
+        enriquecidos[ip] if ip in enriquecidos else {"ip": ip, "error": f"Scan/host error: {r['error']}"}
+        for ip, r in lote["hosts"].items()
+    ]
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as ex:
-        futures = [ex.submit(analizar, it, nvdKey, vulnersKey) for it in dataItems]
-        for f in concurrent.futures.as_completed(futures):
-            try:
-                bannerOut, vulns, port = f.result()
-                banners.append(bannerOut)
-                allVulns.extend(vulns)
-            except:
-                pass
 
+def resultadoHost(host: dict, target: str, banners: list, allVulns: list) -> dict:
     vulnsFront = {}
     for v in allVulns:
         vulnsFront[v["cve"]] = {
@@ -291,6 +298,8 @@ def scan(api, target: str, waitInterval: int = 5, timeout: int = 600, maxWorkers
         "ports": ports,
         "banners_count": len(banners),
         "banners": banners,
+        #servicios sin consultar en NVD: sus CVEs son desconocidos, no cero
+        "nvd_errors": sorted({b["nvd_error"] for b in banners if b.get("nvd_error")}),
         "vulns_nvd": allVulns,
         "vulns": vulnsFront,
         "raw": json.dumps(host)[:10000]
@@ -303,7 +312,7 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--target", required=True)
     parser.add_argument("--out", required=True)
-    parser.add_argument("--wait_interval", type=int, default=5)
+    parser.add_argument("--wait_interval", type=float, default=2)
     parser.add_argument("--timeout", type=int, default=600)
     parser.add_argument("--max_workers", type=int, default=5)
     parser.add_argument("--nvd_api_key", required=False)
@@ -313,14 +322,13 @@ def main():
 
     nvdKey = args.nvd_api_key or os.getenv("NVD_API_KEY")
     vulnersKey = args.vulners_api_key or os.getenv("VULNERS_API_KEY")
-    shodanKey = load_api_key() or os.getenv("SHODAN_API_KEY")
-
-    if not shodanKey:
-        print("ERROR: No se ha encontrado API key de Shodan (ni en archivo ni en variable de entorno)", file=sys.stderr)
+    try:
+        #sin clave explícita crear_api reparte entre las de SHODAN_API_KEYS
+        api = crear_api()
+    except RuntimeError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
         sys.exit(1)
 
-    api = shodan.Shodan(shodanKey)
-
     processed = scan(
         api,
         args.target,
@@ -331,7 +339,7 @@ def main():
         vulnersKey
     )
 
-    out = [processed]
+    out = processed
 
     outPath = Path(args.out)
     outPath.parent.mkdir(parents=True, exist_ok=True)
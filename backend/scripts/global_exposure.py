@@ -2,24 +2,38 @@
 from __future__ import annotations
 
 import sys
+import os
+import gzip
+import json
+import hashlib
 from pathlib import Path
 import argparse
+import math
 import shodan
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Tuple
 from datetime import datetime
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
-from shodan_common import load_api_key, save_json, setup_logger
+from shodan_common import crear_api, save_json, setup_logger, es_cierto
+from persistent_cache import PersistentCache
 
 SCRIPT_METADATA = {
     "description": "Realiza búsquedas con filtros en Shodan y paginación automática. Recopila y normaliza los resultados según IP, puerto, organización y ubicación, y exporta un JSON con todos los datos, incluyendo el número de coincidencias y filtrados por país, organización, sistema operativo y puerto.",
     "params": [
         {"name": "query", "label": "Query:", "required": True, "placeholder": "http.title:'Home Assistant' port:8123"},
         {"name": "limit", "label": "Limit:", "required": False, "placeholder": 10},
+        {"name": "output", "label": "Formato:", "required": False, "placeholder": "json",
+         "help": "json: un documento al final; ndjson o ndjson.gz: cada página se añade al archivo según llega y el export se puede reanudar; facets: solo agregados con api.count, sin coincidencias ni créditos"},
+        {"name": "resume", "label": "Reanudar export ndjson interrumpido:", "required": False, "placeholder": "true"},
+        {"name": "facets", "label": "Facetas (campo:profundidad):", "required": False, "placeholder": "country,org,os,port"},
+        {"name": "refresh", "label": "Ignorar caché de facetas:", "required": False, "placeholder": "false"},
     ],
     "timeout": 600,
-    "accepts_log": True
+    "accepts_log": True,
+    "entrypoint": "ejecutar",
+    "credits": {"kind": "query", "param": "limit", "per": 100, "free_when": {"output": "facets"}}
 }
 
 
@@ -39,23 +53,83 @@ def normalizar(match: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
+#resultados por página de api.search
+PAGE_SIZE = 100
+#páginas pedidas por adelantado mientras se procesa la actual (el ritmo lo marca el limitador)
+PREFETCH = int(os.getenv('SHODAN_PREFETCH', '4'))
+
+#directorio de los export ndjson cuando no hay --out (motor en proceso)
+EXPORT_DIR = Path(__file__).resolve().parent.parent / 'results'
+
+FACETAS_DEFECTO = ['country', 'org', 'os', 'port']
+
+#query+facetas -> respuesta de api.count (total y facetas), compartida entre runs
+COUNT_CACHE = PersistentCache('shodan_count', ttl=int(os.getenv('SHODAN_COUNT_TTL', '3600')), max_entries=5000)
+
+
+def parsearFacetas(valor) -> List[str]:
+    #"country:20,org" o ['country:20', 'org'] (argparse) -> ['country:20', 'org']
+    if not valor:
+        return list(FACETAS_DEFECTO)
+    partes = valor if isinstance(valor, list) else [valor]
+    return [f.strip() for p in partes for f in str(p).split(',') if f.strip()]
+
+
+def paginas(api: shodan.Shodan, query: str, facetas: List[str], limite: int,
+            desde: int = 1, recogidas: int = 0, prefetch: int | None = None) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    (número de página, respuesta de api.search) en orden desde la página desde
+    hasta llegar a limite o recibir una página incompleta. Las facetas solo se
+    piden en la primera página: son iguales en todas.
+
+    La primera página se pide sola para conocer el total; después se mantienen
+    hasta prefetch páginas en vuelo, sin pasar de las que faltan para limite
+    ni de las que tiene la búsqueda.
+    """
+    if recogidas >= limite:
+        return
+    prefetch = max(1, PREFETCH if prefetch is None else prefetch)
+    pedir = lambda n: api.search(query, page=n, facets=facetas if n == 1 else None)
+
+    resultados = pedir(desde)
+    matches = resultados.get('matches', [])
+    yield desde, resultados
+    recogidas += len(matches)
+    if recogidas >= limite or len(matches) < PAGE_SIZE:
+        return
+    ultima = desde + math.ceil((limite - recogidas) / PAGE_SIZE)
+    if resultados.get('total'):
+        ultima = min(ultima, math.ceil(resultados['total'] / PAGE_SIZE))
+
+    siguiente = desde + 1
+    pool = ThreadPoolExecutor(max_workers=prefetch)
+    try:
+        enVuelo = {}
+        for pagina in range(desde + 1, ultima + 1):
+            while siguiente <= ultima and len(enVuelo) < prefetch:
+                enVuelo[siguiente] = pool.submit(pedir, siguiente)
+                siguiente += 1
+            resultados = enVuelo.pop(pagina).result()
+            matches = resultados.get('matches', [])
+            yield pagina, resultados
+            recogidas += len(matches)
+            if recogidas >= limite or len(matches) < PAGE_SIZE:
+                break
+    finally:
+        #corte, error o consumidor que deja de iterar: no se piden más páginas
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
 def realizarBusqueda(api: shodan.Shodan, query: str, facetas: List[str], limite: int, logger):
     logger.info('Ejecutando query: %s', query)
     recogidas: List[Dict[str, Any]] = []
     facetasRes = {}
     try:
-        resultados = api.search(query, facets=facetas)
-        facetasRes = resultados.get('facets', {})
-        for m in resultados.get('matches', []):
-            recogidas.append(normalizar(m))
-        pagina = 2
-        while len(recogidas) < limite and resultados.get('matches') and len(resultados.get('matches')) >= 100:
-            resultados = api.search(query, page=pagina, facets=facetas)
-            for m in resultados.get('matches', []):
-                if len(recogidas) >= limite:
-                    break
-                recogidas.append(normalizarCoincidencia(m))
-            pagina += 1
+        for pagina, resultados in paginas(api, query, facetas, limite):
+            if pagina == 1:
+                facetasRes = resultados.get('facets', {})
+            for m in resultados.get('matches', [])[:limite - len(recogidas)]:
+                recogidas.append(normalizar(m))
     except shodan.APIError as e:
         logger.error('APIError: %s', e)
         raise
@@ -70,6 +144,139 @@ def realizarBusqueda(api: shodan.Shodan, query: str, facetas: List[str], limite:
     }
 
 
+def rutaExport(destino: Path, query: str, facetas: List[str], comprimir: bool) -> Path:
+    #ruta estable por query+facetas: un segundo run de la misma búsqueda encuentra el checkpoint
+    clave = hashlib.sha1(json.dumps([query, facetas]).encode('utf-8')).hexdigest()[:12]
+    return destino / f"global_exposure_{clave}.ndjson{'.gz' if comprimir else ''}"
+
+
+def leerCheckpoint(ruta: Path) -> Dict[str, Any] | None:
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def guardarCheckpoint(ruta: Path, estado: Dict[str, Any]) -> None:
+    #escritura atómica: un corte a mitad no deja un checkpoint a medias
+    tmp = ruta.with_name(ruta.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, ensure_ascii=False)
+    os.replace(tmp, ruta)
+
+
+def exportarNdjson(api: shodan.Shodan, query: str, facetas: List[str], limite: int, logger,
+                   destino: Path = EXPORT_DIR, comprimir: bool = False, reanudar: bool = True) -> Dict[str, Any]:
+    """
+    escribe cada coincidencia normalizada como una línea NDJSON (gzip opcional)
+    según llegan las páginas, con memoria constante. Tras cada página guarda un
+    checkpoint con la página y el tamaño del archivo; si el export se corta,
+    el siguiente run de la misma query trunca lo escrito después y sigue.
+    """
+    destino.mkdir(parents=True, exist_ok=True)
+    ruta = rutaExport(destino, query, facetas, comprimir)
+    rutaCp = ruta.with_name(ruta.name + '.checkpoint.json')
+    estado = leerCheckpoint(rutaCp) if reanudar else None
+    if estado and (estado.get('finished') or estado.get('query') != query or not ruta.exists()):
+        estado = None
+
+    if estado:
+        with open(ruta, 'r+b') as f:
+            f.truncate(estado['offset'])
+        logger.info('Reanudando %s desde la página %d (%d escritas)', ruta.name, estado['page'] + 1, estado['written'])
+    else:
+        ruta.unlink(missing_ok=True)
+        estado = {'query': query, 'facets_requested': facetas, 'limit': limite, 'page': 0,
+                  'offset': 0, 'written': 0, 'facets': {}, 'finished': False}
+    reanudadaEn = estado['page'] + 1
+
+    try:
+        for pagina, resultados in paginas(api, query, facetas, limite, desde=estado['page'] + 1,
+                                          recogidas=estado['written']):
+            if pagina == 1:
+                estado['facets'] = resultados.get('facets', {})
+            lote = resultados.get('matches', [])[:limite - estado['written']]
+            #un miembro gzip por página: el archivo es válido en cada checkpoint
+            with (gzip.open(ruta, 'at', encoding='utf-8') if comprimir else open(ruta, 'a', encoding='utf-8')) as f:
+                for m in lote:
+                    f.write(json.dumps(normalizar(m), ensure_ascii=False) + '\n')
+            estado.update(page=pagina, offset=ruta.stat().st_size, written=estado['written'] + len(lote))
+            guardarCheckpoint(rutaCp, estado)
+            logger.info('Página %d: %d coincidencias (%d/%d)', pagina, len(lote), estado['written'], limite)
+    except shodan.APIError as e:
+        logger.error('APIError: %s (checkpoint en la página %d)', e, estado['page'])
+        raise
+
+    estado['finished'] = True
+    guardarCheckpoint(rutaCp, estado)
+    return {
+        'queried_at': datetime.utcnow().isoformat() + 'Z',
+        'query': query,
+        'requested_limit': limite,
+        'collected': estado['written'],
+        'facets': estado['facets'],
+        'format': 'ndjson.gz' if comprimir else 'ndjson',
+        'path': str(ruta),
+        'pages': estado['page'],
+        'resumed_from_page': reanudadaEn if reanudadaEn > 1 else None,
+    }
+
+
+def contarFacetas(api: shodan.Shodan, query: str, facetas: List[str], logger,
+                  refresh: bool = False) -> Dict[str, Any]:
+    """
+    solo agregados: api.count con facetas campo:profundidad (p.ej. port:100).
+    No descarga coincidencias ni gasta query credits; cacheado por query+facetas.
+    """
+    clave = json.dumps([query, facetas])
+    if refresh:
+        COUNT_CACHE.delete(clave)
+    llamadas = []
+
+    def pedir():
+        llamadas.append(clave)
+        logger.info('api.count: %s (facetas %s)', query, ','.join(facetas))
+        r = api.count(query, facets=facetas)
+        return {'total': r.get('total'), 'facets': r.get('facets', {})}
+
+    try:
+        r = COUNT_CACHE.get_or_compute(clave, pedir)
+    except shodan.APIError as e:
+        logger.error('APIError: %s', e)
+        raise
+    return {
+        'queried_at': datetime.utcnow().isoformat() + 'Z',
+        'query': query,
+        'mode': 'facets',
+        'facets_requested': facetas,
+        'total': r['total'],
+        'cached': not llamadas,
+        'facets': r['facets'],
+    }
+
+
+def lanzar(api: shodan.Shodan, query: str, facetas: List[str], limite: int, logger,
+           salida: str = 'json', reanudar: bool = True, destino: Path = EXPORT_DIR,
+           refresh: bool = False) -> Dict[str, Any]:
+    salida = (salida or 'json').lower()
+    if salida == 'facets':
+        return contarFacetas(api, query, facetas, logger, refresh)
+    if salida in ('ndjson', 'ndjson.gz'):
+        return exportarNdjson(api, query, facetas, limite, logger, destino,
+                              comprimir=salida == 'ndjson.gz', reanudar=reanudar)
+    return realizarBusqueda(api, query, facetas, limite, logger)
+
+
+def ejecutar(params, logger):
+    #punto de entrada para el motor en proceso de la API
+    api = crear_api()
+    facetas = parsearFacetas(params.get('facets'))
+    return lanzar(api, params['query'], facetas, int(params.get('limit') or 200), logger,
+                  params.get('output'), es_cierto(params.get('resume', True)),
+                  refresh=es_cierto(params.get('refresh')))
+
+
 def cli():
     parser = argparse.ArgumentParser()
     parser.add_argument('--query', required=True)
@@ -77,11 +284,15 @@ def cli():
     parser.add_argument('--out', required=True)
     parser.add_argument('--log', default='shodan_global.log')
     parser.add_argument('--facets', nargs='*', default=['country','org','os','port'])
+    parser.add_argument('--output', default='json', choices=['json', 'ndjson', 'ndjson.gz', 'facets'])
+    parser.add_argument('--resume', default='true')
+    parser.add_argument('--refresh', default='false')
     args = parser.parse_args()
 
     logger = setup_logger('exposicion_global', log_file=args.log)
-    api = shodan.Shodan(load_api_key())
-    res = realizarBusqueda(api, args.query, args.facets, args.limit, logger)
+    api = crear_api()
+    res = lanzar(api, args.query, parsearFacetas(args.facets), args.limit, logger, args.output,
+                 es_cierto(args.resume), Path(args.out).resolve().parent, es_cierto(args.refresh))
     save_json(args.out, res)
     logger.info('Guardado en %s', args.out)
 
@@ -10,7 +10,8 @@ from datetime import datetime, timezone
 import traceback
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-from shodan_common import load_api_key, save_json, setup_logger
+from shodan_common import load_api_key, crear_api, save_json, setup_logger, es_cierto
+from host_cache import consultar_host
 
 SCRIPT_METADATA = {
     "description": "Consulta información detallada de un host en Shodan usando su IP. Exporta un JSON con datos de banners, puerto, transporte, organización, ISP, sistema operativo, ubicación y otros metadatos relevantes.",
@@ -21,10 +22,18 @@ SCRIPT_METADATA = {
             "required": True,
             "placeholder": "8.8.8.8, propia o con permiso",
             "label": "IP address:"
+        },
+        {
+            "name": "refresh",
+            "type": "string",
+            "required": False,
+            "placeholder": "false",
+            "label": "Forzar consulta a Shodan (ignorar caché):"
         }
     ],
     "accepts_log": True,
-    "timeout": 600
+    "timeout": 600,
+    "entrypoint": "ejecutar"
 }
 
 def horaIso() -> str:
@@ -71,15 +80,21 @@ def procesar(raw, ip: str):
         "results": banners
     }
 
-def escanear(ip: str):
+def escanear(ip: str, refresh: bool = False):
     api_key = os.environ.get("SHODAN_API_KEY")
     if not api_key:
         raise RuntimeError("SHODAN_API_KEY no definida")
-    api = shodan.Shodan(api_key)
+    api = crear_api(api_key)
 
+    cache = None
     try:
-        host_info = api.host(ip, minify=False)
-        host_data = procesar(host_info, ip)
+        entrada = consultar_host(api, ip, refresh)
+        host_data = procesar(entrada["host"], ip)
+        cache = {
+            "cached": entrada["cached"],
+            "fetched_at": datetime.fromtimestamp(entrada["fetched_at"], timezone.utc).replace(microsecond=0).isoformat() + "Z",
+            "last_update": entrada["last_update"],
+        }
     except shodan.exception.APIError as e:
         host_data = {"error": str(e)}
     except Exception as e:
@@ -89,19 +104,25 @@ def escanear(ip: str):
     resultado = {
         "scanned_target": ip,
         "timestamp": horaIso(),
+        "cache": cache,
         "host_data": host_data
     }
     return resultado
 
+def ejecutar(params, logger=None):
+    #punto de entrada para el motor en proceso de la API
+    return escanear(params["ip"], es_cierto(params.get("refresh")))
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--ip", required=True)
     parser.add_argument("--out", required=True)
     parser.add_argument("--log", required=False, help="Ruta para guardar el log")
+    parser.add_argument("--refresh", default="false", help="true para ignorar la caché de hosts")
     args = parser.parse_args()
 
     logger = setup_logger("host_lookup", log_file=args.log) if args.log else None
-    resultado = escanear(args.ip)
+    resultado = escanear(args.ip, es_cierto(args.refresh))
 
     out_path = Path(args.out)
     out_path.parent.mkdir(parents=True, exist_ok=True)
@@ -3,8 +3,11 @@ from pathlib import Path
 from datetime import datetime as dt
 import ipaddress
 import xml.etree.ElementTree as ET
-import re, requests
+import re
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from nvd_cache import buscar_items_nvd, cvss_de_item, descripcion_de_item
+import http_client
 
 
 SCRIPT_METADATA = {
@@ -58,7 +61,9 @@ Nota: La detección de vulnerabilidades se realizará automáticamente si has pr
     }
 
 
-CACHE_NVD = {}
+#claves opcionales; main() las sobrescribe con --nvd_api_key / --vulners_api_key
+NVD_API_KEY = ""
+VULNERS_API_KEY = ""
 
 
 def normalizar_producto(p):
@@ -94,58 +99,19 @@ def normalizar_version(raw):
 
 
 def buscar_cves_nvd(product, version=""):
-    key = f"{product}_{version}"
-    if key in CACHE_NVD:
-        return CACHE_NVD[key]
-
-    queries = []
-    if version:
-        queries.append(f"{product} {version}")
-    queries.append(product)
+    #caché persistente y single-flight compartida con la API y escaneo_activo_cve
+    try:
+        items = buscar_items_nvd(product, version, NVD_API_KEY)
+    except Exception:
+        return []
 
     vulns = []
-
-    for query in queries:
-        url = "https://services.nvd.nist.gov/rest/json/cves/2.0"
-        params = {
-            "keywordSearch": query,
-            "resultsPerPage": 80
-        }
-        headers = {"apiKey": NVD_API_KEY}
-
-        try:
-            r = requests.get(url, params=params, headers=headers, timeout=10)
-            if r.status_code != 200:
-                continue
-
-            data = r.json()
-            found = data.get("vulnerabilities", [])
-            if found:
-                for item in found[:10]: 
-                    cve_id = item["cve"]["id"]
-                    desc = item["cve"]["descriptions"][0]["value"]
-
-                    metrics = item["cve"].get("metrics", {})
-                    cvss = None
-                    if "cvssMetricV31" in metrics:
-                        cvss = metrics["cvssMetricV31"][0]["cvssData"]["baseScore"]
-                    elif "cvssMetricV30" in metrics:
-                        cvss = metrics["cvssMetricV30"][0]["cvssData"]["baseScore"]
-                    elif "cvssMetricV2" in metrics:
-                        cvss = metrics["cvssMetricV2"][0]["cvssData"]["baseScore"]
-
-                    vulns.append({
-                        "cve": cve_id,
-                        "description": desc,
-                        "cvss": cvss or 0,
-                    })
-
-                break
-
-        except:
-            pass
-
-    CACHE_NVD[key] = vulns
+    for item in items:
+        vulns.append({
+            "cve": item["cve"]["id"],
+            "description": descripcion_de_item(item),
+            "cvss": cvss_de_item(item) or 0,
+        })
     return vulns
 
 
@@ -165,7 +131,7 @@ def buscar_exploits_vulners_batch(cve_list):
     }
 
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=20)
+        r = http_client.post(url, headers=headers, json=payload, timeout=20)
         if r.status_code != 200:
             return []
 
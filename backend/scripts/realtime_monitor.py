@@ -1,23 +1,36 @@
 from __future__ import annotations
 import argparse
+import os
+import random
 import time
 import sys
 import json
+from collections import Counter, deque
 from pathlib import Path
 import shodan
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-from shodan_common import load_api_key, save_json, setup_logger
+from shodan_common import crear_api, save_json, setup_logger
+from stream_stats import ALERT_DEDUP_WINDOW, ProcesadorEventos
 from datetime import datetime
 
+#segundos sin datos tras los que se reabre la conexión (también marca cada cuánto se mira el fin)
+STREAM_IDLE = float(os.getenv('SHODAN_STREAM_IDLE', '60'))
+STREAM_BACKOFF_MAX = 60.0
+#eventos recientes que se devuelven en el JSON final; el resto está en el ndjson
+RECENT_EVENTS = 50
+TOP = 20
+
 SCRIPT_METADATA = {
     "description": (
         "Crea una alerta temporal en Shodan, devuelve JSON inicial, "
-        "espera la duración y genera JSON final con eventos recopilados."
+        "escribe cada evento en un NDJSON según llega y al terminar genera "
+        "un JSON final con el resumen de los eventos recopilados."
     ),
     "params": [
         {"name": "network", "label": "Ip o rango de red (CIDR):", "type": "text", "required": True, "placeholder": "8.8.8.0/24"},
         {"name": "name", "label": "Nombre de la alerta:", "type": "text", "required": True, "placeholder": "ShodanMonitor"},
-        {"name": "duration", "label": "Duración (segundos):", "type": "number", "required": False, "placeholder": 300}
+        {"name": "duration", "label": "Duración (segundos):", "type": "number", "required": False, "placeholder": 300},
+        {"name": "dedup_window", "label": "Ventana de repetidos (segundos, 0 = guardar todos):", "type": "number", "required": False, "placeholder": 300}
     ],
     "timeout": 600,
     "accepts_log": True
@@ -28,50 +41,125 @@ def normalizarBanner(banner):
         'timestamp': banner.get('timestamp'),
         'ip_str': banner.get('ip_str'),
         'port': banner.get('port'),
-        'module': banner.get('shodan', {}).get('module'),
+        'module': (banner.get('_shodan') or banner.get('shodan') or {}).get('module'),
         'data': (banner.get('data') or '').splitlines(),
         'opts': banner.get('opts', {})
     }
 
-def alerta(api: shodan.Shodan, alert_id: str, duration: int, logger, final_out_file: str):    
-    events = []
-    start = time.time()
-
-    while time.time() - start < duration:
-        try:            
-            banner_list = api.stream.alert(alert_id, timeout=1)
-            for banner in banner_list:
-                evt = normalizarBanner(banner)
-                events.append(evt)
-                logger.info('Evento detectado: %s:%s', evt.get('ip_str'), evt.get('port'))
-        except Exception:            
-            time.sleep(1)
-            continue
-
-   
-    try:
-        api.delete_alert(alert_id)
-        logger.info('Alerta eliminada %s', alert_id)
-    except Exception:
-        logger.exception('No se pudo eliminar la alerta')
+class ResumenEventos:
+    """
+    contadores del monitor con memoria acotada sea cual sea el número de
+    eventos: los repetidos de la ventana se descartan y las IPs únicas y los
+    agregados por minuto salen de ProcesadorEventos (HyperLogLog, count-min).
+    """
+
+    def __init__(self, dedup_window: float = ALERT_DEDUP_WINDOW):
+        self.procesador = ProcesadorEventos(dedup_window)
+        self.total = 0
+        self.puertos = Counter()
+        self.modulos = Counter()
+        self.recientes = deque(maxlen=RECENT_EVENTS)
+        self.primero = None
+        self.ultimo = None
+
+    def add(self, evt) -> bool:
+        """False si es un repetido de la ventana (no se guarda)."""
+        if not self.procesador.add(evt):
+            return False
+        self.total += 1
+        self.puertos[evt.get('port')] += 1
+        self.modulos[evt.get('module')] += 1
+        self.recientes.append(evt)
+        self.primero = self.primero or evt.get('timestamp')
+        self.ultimo = evt.get('timestamp')
+        return True
+
+    def to_dict(self):
+        agregados = self.procesador.aggregates()
+        return {
+            'unique_ips': agregados['unique_ips'],
+            'duplicates': agregados['duplicates'],
+            'dedup_window': agregados['dedup_window'],
+            'top_ports': [{'port': p, 'count': n} for p, n in self.puertos.most_common(TOP)],
+            'top_modules': [{'module': m, 'count': n} for m, n in self.modulos.most_common(TOP)],
+            'first_event': self.primero,
+            'last_event': self.ultimo,
+            'per_minute': agregados['per_minute'],
+        }
+
+
+def consumirStream(api: shodan.Shodan, alert_id: str, duration: float, logger, on_banner,
+                   sleep=time.sleep) -> int:
+    """
+    mantiene abierta una conexión al stream de la alerta hasta agotar duration
+    y llama on_banner con cada banner. Un corte por inactividad se reabre al
+    momento; los errores se reintentan con backoff exponencial con jitter.
+    Devuelve el número de reconexiones.
+    """
+    fin = time.time() + duration
+    fallos = reconexiones = 0
+    while (restante := fin - time.time()) > 0:
+        try:
+            #sin datos durante el timeout la librería corta con "Stream timed out"
+            for banner in api.stream.alert(alert_id, timeout=max(1, min(STREAM_IDLE, restante))):
+                fallos = 0
+                on_banner(banner)
+                if time.time() >= fin:
+                    return reconexiones
+        except Exception as e:
+            if 'timed out' not in str(e).lower():
+                fallos += 1
+                espera = min(STREAM_BACKOFF_MAX, 2 ** fallos) * (0.5 + random.random() / 2)
+                logger.warning('Stream de la alerta %s cortado (%s); reintento en %.1fs', alert_id, e, espera)
+                sleep(min(espera, max(0, fin - time.time())))
+        reconexiones += 1
+    return reconexiones
+
+
+def alerta(api: shodan.Shodan, alert_id: str, duration: int, logger, final_out_file: str,
+           dedup_window: float = ALERT_DEDUP_WINDOW):
+    events_file = final_out_file.replace('_final.json', '_events.ndjson')
+    resumen = ResumenEventos(dedup_window)
+
+    #cada evento va al ndjson al llegar: si el proceso muere no se pierde nada
+    with open(events_file, 'a', encoding='utf-8') as f:
+        def on_banner(banner):
+            evt = normalizarBanner(banner)
+            if not resumen.add(evt):
+                return
+            f.write(json.dumps(evt, ensure_ascii=False) + '\n')
+            f.flush()
+            logger.info('Evento detectado: %s:%s', evt.get('ip_str'), evt.get('port'))
+
+        try:
+            reconexiones = consumirStream(api, alert_id, duration, logger, on_banner)
+        finally:
+            try:
+                api.delete_alert(alert_id)
+                logger.info('Alerta eliminada %s', alert_id)
+            except Exception:
+                logger.exception('No se pudo eliminar la alerta')
 
-    
     final_json = {
         "status": "finished",
         "data": [
             {
                 "message": "Monitoreo finalizado",
-                "events_collected": len(events),
-                "events": events
+                "events_collected": resumen.total,
+                "events_file": events_file,
+                "reconnects": reconexiones,
+                "summary": resumen.to_dict(),
+                "events": list(resumen.recientes)
             }
         ]
     }
     save_json(final_out_file, final_json)
     print(json.dumps(final_json), flush=True)
-    logger.info("Fin del monitoreo. %d eventos recopilados", len(events))
+    logger.info("Fin del monitoreo. %d eventos recopilados", resumen.total)
 
 
-def configurarAlerta(api: shodan.Shodan, network_range: str, alert_name: str, duration: int, logger, out_file: str):    
+def configurarAlerta(api: shodan.Shodan, network_range: str, alert_name: str, duration: int, logger, out_file: str,
+                     dedup_window: float = ALERT_DEDUP_WINDOW):    
     try:
         alert = api.create_alert(alert_name, network_range)
     except shodan.exception.APIError as e:
@@ -97,9 +185,10 @@ def configurarAlerta(api: shodan.Shodan, network_range: str, alert_name: str, du
         "status": "started",
         "data": [
             {
-                "message": "Alerta creada y monitoreando. Los resultados de las alertas están en el Json final generado.",
+                "message": "Alerta creada y monitoreando. Los eventos se añaden al ndjson según llegan y el resumen estará en el Json final generado.",
                 "alert_id": alert_id,
-                "final_json": final_json_path
+                "final_json": final_json_path,
+                "events_file": final_json_path.replace("_final.json", "_events.ndjson")
             }
         ]
     }
@@ -107,22 +196,24 @@ def configurarAlerta(api: shodan.Shodan, network_range: str, alert_name: str, du
     print(json.dumps(initial_json), flush=True)  
     logger.info('JSON inicial creado y guardado en %s', out_file)
   
-    alerta(api, alert_id, duration, logger, final_json_path)
+    alerta(api, alert_id, duration, logger, final_json_path, dedup_window)
 
 def cli():
     parser = argparse.ArgumentParser()
     parser.add_argument('--network', required=True, help='Rango de red (CIDR)')
     parser.add_argument('--name', default='ShodanMonitor', help='Nombre de la alerta')
     parser.add_argument('--duration', type=int, default=300, help='Duración en segundos')
+    parser.add_argument('--dedup_window', type=float, default=ALERT_DEDUP_WINDOW,
+                        help='Segundos en los que un mismo ip:puerto:módulo no se vuelve a guardar')
     parser.add_argument('--out', required=True, help='Archivo de salida JSON')
     parser.add_argument('--log', default='shodan_realtime.log', help='Archivo de log')
 
     args = parser.parse_args()
 
     logger = setup_logger('realtime_monitor', log_file=args.log)
-    api = shodan.Shodan(load_api_key())
+    api = crear_api()
 
-    configurarAlerta(api, args.network, args.name, args.duration, logger, args.out)
+    configurarAlerta(api, args.network, args.name, args.duration, logger, args.out, args.dedup_window)
 
 if __name__ == '__main__':
     cli()
@@ -6,13 +6,15 @@ import shodan
 import sys
 import time
 import ipaddress
+import concurrent.futures
 from pathlib import Path
 from datetime import datetime
 from collections import Counter
 
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-from shodan_common import load_api_key, save_json, setup_logger
+from shodan_common import crear_api, save_json, setup_logger, es_cierto
+from host_cache import obtener_host
 
 
 SCRIPT_METADATA = {
@@ -34,10 +36,34 @@ SCRIPT_METADATA = {
             "required": False,
             "placeholder": "10",
             "label": "Límite de resultados"
+        },
+        {
+            "name": "details",
+            "type": "string",
+            "required": False,
+            "placeholder": "full",
+            "label": "Detalle por host",
+            "help": "full: api.host una vez por IP única; matches: vista por host con los banners de la búsqueda, sin llamadas extra"
+        },
+        {
+            "name": "max_workers",
+            "type": "number",
+            "required": False,
+            "placeholder": 8,
+            "label": "Consultas de host simultáneas"
+        },
+        {
+            "name": "refresh",
+            "type": "string",
+            "required": False,
+            "placeholder": "false",
+            "label": "Ignorar caché de hosts"
         }
     ],
     "accepts_log": True,
-    "timeout": 600
+    "timeout": 600,
+    "entrypoint": "ejecutar",
+    "credits": {"kind": "query", "param": "limit", "per": 100}
 }
 
 
@@ -69,35 +95,22 @@ def filtrarBanners(banners):
     return filtered
 
 
-def llamadaSeguraShodan(api_call, logger, retries=4, cooldown=3):
-    for i in range(retries):
-        try:
-            return api_call()
-        except shodan.APIError as e:
-            if "429" in str(e):
-                wait = cooldown * (i + 1)
-                logger.warning(f"Rate-limit (429). Reintentando en {wait}s…")
-                time.sleep(wait)
-            else:
-                logger.error(f"Shodan API error: {e}")
-                return None
-        except Exception as e:
-            logger.error(f"Error inesperado: {e}")
-            return None
+def llamadaSeguraShodan(api_call, logger):
+    #el ritmo y los reintentos por 429 los gestiona el limitador compartido (crear_api)
+    try:
+        return api_call()
+    except shodan.APIError as e:
+        logger.error(f"Shodan API error: {e}")
+    except Exception as e:
+        logger.error(f"Error inesperado: {e}")
     return None
 
 
 
-def analizar(api, ip, logger):   
-    logger.info(f"Consultando host {ip}")
-
-    host = llamadaSeguraShodan(lambda: api.host(ip, minify=False), logger)
-
-    if not host:
-        return None
-
+def vistaHost(host, items, ip):
+    #host: dict con org/isp/os/location (api.host o el primer match de la IP)
     banners = []
-    for item in host.get("data", []):
+    for item in items:
         banners.append({
             'ip': host.get('ip_str', ip),
             'port': item.get('port'),
@@ -129,15 +142,51 @@ def analizar(api, ip, logger):
     }
 
 
+def analizar(api, ip, logger, refresh=False):   
+    logger.info(f"Consultando host {ip}")
+
+    host = llamadaSeguraShodan(lambda: obtener_host(api, ip, refresh), logger)
+
+    if not host:
+        return None
+
+    return vistaHost(host, host.get("data", []), ip)
+
+
+def agruparPorIp(matches):
+    #ip_str -> matches de esa IP, en el orden en que aparecen en la búsqueda
+    grupos = {}
+    for m in matches:
+        ip = m.get("ip_str")
+        if ip:
+            grupos.setdefault(ip, []).append(m)
+    return grupos
+
+
+def hostsDesdeMatches(matches):
+    """vista por host construida solo con los banners de la búsqueda."""
+    return [vistaHost(items[0], items, ip) for ip, items in agruparPorIp(matches).items()]
+
+
+def analizarHosts(api, ips, logger, max_workers=8, refresh=False):
+    """api.host una vez por IP única, con concurrencia acotada y el orden de entrada."""
+    if not ips:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ips)))) as ex:
+        infos = list(ex.map(lambda ip: analizar(api, ip, logger, refresh), ips))
+    return [info for info in infos if info]
+
+
 
 def ejecutar(params, logger):
     query = params.get("query")
     limit = int(params.get("limit", 10))
+    refresh = es_cierto(params.get("refresh"))
 
-    api = shodan.Shodan(load_api_key())
+    api = crear_api()
 
     if is_ip(query):
-        host_info = analizar(api, query, logger)
+        host_info = analizar(api, query, logger, refresh)
         return host_info if host_info else {"error": "No se pudo obtener información del host"}
 
     logger.info(f"Ejecutando búsqueda Shodan: {query}")
@@ -147,17 +196,20 @@ def ejecutar(params, logger):
         return {"error": "No hay resultados o fallo en API"}
 
     matches = r.get("matches", [])
-    results = []
+    details = (params.get("details") or "full").lower()
 
-    for m in matches:
-        ip = m.get("ip_str")
-        info = analizar(api, ip, logger)
-        if info:
-            results.append(info)
+    if details == "matches":
+        results = hostsDesdeMatches(matches)
+    else:
+        ips = list(agruparPorIp(matches))
+        logger.info(f"{len(matches)} coincidencias, {len(ips)} IPs únicas")
+        results = analizarHosts(api, ips, logger, int(params.get("max_workers") or 8), refresh)
 
     return {
         "queried_at": horaIso(),
         "query": query,
+        "details": details,
+        "total_matches": len(matches),
         "total_hosts": len(results),
         "results": results
     }
@@ -168,6 +220,9 @@ def cli():
     parser = argparse.ArgumentParser()
     parser.add_argument("--query", required=True)
     parser.add_argument("--limit", default="10")
+    parser.add_argument("--details", default="full", choices=["full", "matches"])
+    parser.add_argument("--max_workers", type=int, default=8)
+    parser.add_argument("--refresh", default="false")
     parser.add_argument("--out", required=True)
     parser.add_argument("--log", default="shodan_enum.log")
 
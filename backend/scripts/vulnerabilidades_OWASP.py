@@ -12,7 +12,8 @@ SCRIPT_METADATA = {
         {"name": "input_file", "label": "Archivo JSON de entrada: escaneo_activo_cve_fecha.json", "required": True,  "placeholder": "ej: results/escaneo_activo_cve_20251128T160232Z.json",}
     ],
     "timeout": 120,
-    "accepts_log": True
+    "accepts_log": True,
+    "entrypoint": "ejecutar"
 }
 
 
@@ -51,27 +52,7 @@ def clasificarOwasp(vuln_info: dict) -> dict:
     return {"category": "Sin categorizar", "matched": []}
 
 
-def main():
-    parser = argparse.ArgumentParser(description=SCRIPT_METADATA["description"])
-    parser.add_argument("--input_file", required=True)
-    parser.add_argument("--out", required=False)
-    parser.add_argument("--log", required=False)
-    args = parser.parse_args()
-
-    input_path = Path(args.input_file)
-    output_path = Path(args.out) if args.out else Path("results") / f"{input_path.stem}_classified.json"
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-
-    def write_log(msg):
-        if args.log:
-            with open(args.log, "a", encoding="utf-8") as lf:
-                lf.write(msg + "\n")
-
-    write_log(f"[{datetime.utcnow().isoformat()}] Inicio del análisis")
-
-    with open(input_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
+def clasificarHosts(data: list) -> list:
     salida = []
     for host in data:
         ip = host.get("ip")
@@ -116,8 +97,41 @@ def main():
                 "owasp_category": owasp_result["category"],
                 "matched_keywords": owasp_result["matched"]
             })
+    return salida
 
 
+def ejecutar(params, logger):
+    #punto de entrada para el motor en proceso de la API
+    logger.info("Inicio del análisis")
+    with open(params["input_file"], "r", encoding="utf-8") as f:
+        data = json.load(f)
+    salida = clasificarHosts(data)
+    logger.info("Clasificadas %d vulnerabilidades", len(salida))
+    return salida
+
+
+def main():
+    parser = argparse.ArgumentParser(description=SCRIPT_METADATA["description"])
+    parser.add_argument("--input_file", required=True)
+    parser.add_argument("--out", required=False)
+    parser.add_argument("--log", required=False)
+    args = parser.parse_args()
+
+    input_path = Path(args.input_file)
+    output_path = Path(args.out) if args.out else Path("results") / f"{input_path.stem}_classified.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    def write_log(msg):
+        if args.log:
+            with open(args.log, "a", encoding="utf-8") as lf:
+                lf.write(msg + "\n")
+
+    write_log(f"[{datetime.utcnow().isoformat()}] Inicio del análisis")
+
+    with open(input_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    salida = clasificarHosts(data)
 
     print(f"[DEBUG] Guardando resultados en: {output_path}")
     with open(output_path, "w", encoding="utf-8") as f:
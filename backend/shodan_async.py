@@ -0,0 +1,203 @@
+"""shodan_async.py
+Cliente asyncio de Shodan sobre el pool de http_client, con el mismo límite
+de peticiones y pool de claves que crear_api: AsyncShodan, hosts_concurrentes
+"""
+from __future__ import annotations
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterator, Dict, Iterable, List
+
+import shodan
+
+import http_client
+from shodan_keys import KeyPool, es_fallo_de_clave, load_api_keys
+from shodan_limiter import LIMITER, SHODAN_PENALTY, SHODAN_RATE_RETRIES, TokenBucket, es_rate_limit, key_id
+
+SHODAN_STREAM_URL = "https://stream.shodan.io"
+
+
+def _facetas(facets) -> str:
+    #igual que shodan.helpers.create_facet_string: "country:10,org"
+    if isinstance(facets, str):
+        return facets
+    return ",".join(f if isinstance(f, str) else f"{f[0]}:{f[1]}" for f in facets)
+
+
+def _flag(value: bool) -> str:
+    return "true" if value else "false"
+
+
+def _error_de_respuesta(r) -> shodan.APIError | None:
+    #mismos mensajes que shodan.Shodan._request para que los llamadores no cambien
+    if r.status_code == 401:
+        try:
+            return shodan.APIError(r.json()["error"])
+        except Exception:
+            return shodan.APIError("Invalid API key")
+    if r.status_code == 403:
+        return shodan.APIError("Access denied (403 Forbidden)")
+    if r.status_code == 429:
+        return shodan.APIError("Rate limit reached (429)")
+    if r.status_code == 502:
+        return shodan.APIError("Bad Gateway (502)")
+    return None
+
+
+class AsyncShodan:
+    """
+    host/search/count/scan/scan_status/alerts y stream_alert como corrutinas.
+    Cada llamada pasa por el cubo de tokens compartido de su clave; con varias
+    claves, host/search/count rotan por el KeyPool igual que PooledShodan.
+    Miles de corrutinas pueden compartir una instancia en un mismo bucle; lo
+    que toca SQLite o api.info() (KeyPool, cubo) va a un hilo con to_thread.
+    """
+
+    def __init__(self, api_key: str | None = None, pool: KeyPool | None = None,
+                 limiter: TokenBucket | None = None, rate_retries: int = SHODAN_RATE_RETRIES):
+        if api_key is None and pool is None:
+            keys = load_api_keys()
+            if len(keys) > 1:
+                pool = KeyPool(keys)
+            elif keys:
+                api_key = keys[0]
+            else:
+                raise RuntimeError("La variable de entorno SHODAN_API_KEY no está definida")
+        self.pool = pool
+        self.api_key = api_key or pool.keys[0]
+        self.limiter = limiter or LIMITER
+        self.rate_retries = rate_retries
+        self.base_url = os.environ.get("SHODAN_API_URL") or "https://api.shodan.io"
+
+    async def _request(self, function: str, params: Dict[str, Any], method: str = "get",
+                       rotate: bool = False) -> Any:
+        intentos = self.rate_retries + (len(self.pool.keys) if self.pool and rotate else 0)
+        for intento in range(intentos + 1):
+            key = await asyncio.to_thread(self.pool.next_key) if self.pool and rotate else self.api_key
+            try:
+                data = await self._send(key, function, params, method)
+            except shodan.APIError as e:
+                if self.pool:
+                    await asyncio.to_thread(self.pool.report, key, e)
+                #un 429 se reintenta; con rotación, un fallo de clave pasa a la siguiente
+                reintentable = es_rate_limit(e) or (self.pool is not None and rotate and es_fallo_de_clave(e))
+                if not reintentable or intento >= intentos:
+                    raise
+                if es_rate_limit(e):
+                    await asyncio.to_thread(self.limiter.penalize, key_id(key),
+                                            SHODAN_PENALTY * (2 ** min(intento, 5)))
+                continue
+            if self.pool:
+                await asyncio.to_thread(self.pool.report, key)
+            return data
+
+    async def _send(self, key: str, function: str, params: Dict[str, Any], method: str) -> Any:
+        await self.limiter.aacquire(key_id(key))
+        try:
+            if method == "post":
+                r = await http_client.async_request("POST", self.base_url + function, retries=0,
+                                                    params={"key": key}, data=params)
+            else:
+                r = await http_client.async_request("GET", self.base_url + function, retries=0,
+                                                    params={**params, "key": key})
+        except Exception:
+            raise shodan.APIError("Unable to connect to Shodan")
+        error = _error_de_respuesta(r)
+        if error:
+            raise error
+        try:
+            data = r.json()
+        except ValueError:
+            raise shodan.APIError("Unable to parse JSON response")
+        if isinstance(data, dict) and "error" in data:
+            raise shodan.APIError(data["error"])
+        return data
+
+    async def host(self, ips: str | Iterable[str], history: bool = False, minify: bool = False) -> Dict[str, Any]:
+        if isinstance(ips, str):
+            ips = [ips]
+        params = {}
+        if history:
+            params["history"] = _flag(history)
+        if minify:
+            params["minify"] = _flag(minify)
+        return await self._request(f"/shodan/host/{','.join(ips)}", params, rotate=True)
+
+    async def search(self, query: str, page: int = 1, limit: int | None = None, offset: int | None = None,
+                     facets=None, minify: bool = True, fields: List[str] | None = None) -> Dict[str, Any]:
+        params: Dict[str, Any] = {"query": query, "minify": _flag(minify)}
+        if limit:
+            params["limit"] = limit
+            if offset:
+                params["offset"] = offset
+        else:
+            params["page"] = page
+        if facets:
+            params["facets"] = _facetas(facets)
+        if fields:
+            params["fields"] = ",".join(fields)
+        return await self._request("/shodan/host/search", params, rotate=True)
+
+    async def count(self, query: str, facets=None) -> Dict[str, Any]:
+        params = {"query": query}
+        if facets:
+            params["facets"] = _facetas(facets)
+        return await self._request("/shodan/host/count", params, rotate=True)
+
+    async def scan(self, ips, force: bool = False) -> Dict[str, Any]:
+        if isinstance(ips, str):
+            ips = [ips]
+        networks = json.dumps(ips) if isinstance(ips, dict) else ",".join(ips)
+        return await self._request("/shodan/scan", {"ips": networks, "force": _flag(force)}, method="post")
+
+    async def scan_status(self, scan_id: str) -> Dict[str, Any]:
+        return await self._request(f"/shodan/scan/{scan_id}", {})
+
+    async def alerts(self, aid: str | None = None, include_expired: bool = True) -> Any:
+        func = f"/shodan/alert/{aid}/info" if aid else "/shodan/alert/info"
+        return await self._request(func, {"include_expired": _flag(include_expired)})
+
+    async def stream_alert(self, aid: str | None = None, timeout: float | None = None) -> AsyncIterator[Dict[str, Any]]:
+        """banners del stream de alertas (todas o una) según llegan; requiere httpx."""
+        client = http_client.get_async_client()
+        if client is None:
+            raise RuntimeError("stream_alert necesita httpx instalado")
+        params: Dict[str, Any] = {"key": self.api_key}
+        if timeout:
+            #con timeout Shodan no manda latidos y el fin del stream marca el final
+            params["heartbeat"] = "false"
+        url = SHODAN_STREAM_URL + (f"/shodan/alert/{aid}" if aid else "/shodan/alert")
+        try:
+            async with client.stream("GET", url, params=params,
+                                     timeout=http_client.httpx.Timeout(10.0, read=timeout)) as r:
+                if r.status_code != 200:
+                    await r.aread()
+                    raise _error_de_respuesta(r) or shodan.APIError(
+                        "Invalid API key or you do not have access to the Streaming API")
+                async for line in r.aiter_lines():
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+        except http_client.httpx.TransportError:
+            raise shodan.APIError("Stream timed out")
+
+
+async def hosts_concurrentes(api: AsyncShodan, ips: Iterable[str], refresh: bool = False,
+                             concurrency: int = 100) -> Dict[str, Dict[str, Any]]:
+    """
+    host de cada IP única pasando por la caché de hosts; los fallos quedan
+    como {"error": ...}. El ritmo real lo marca el limitador de cada clave.
+    """
+    from host_cache import obtener_host_async
+    sem = asyncio.Semaphore(max(1, concurrency))
+    out: Dict[str, Dict[str, Any]] = {}
+
+    async def uno(ip: str) -> None:
+        async with sem:
+            try:
+                out[ip] = await obtener_host_async(api, ip, refresh)
+            except Exception as e:
+                out[ip] = {"error": str(e)}
+
+    await asyncio.gather(*(uno(ip) for ip in dict.fromkeys(ips)))
+    return out
@@ -1,5 +1,5 @@
 """shodan_common.py
-Funciones compartidas: load_api_key, save_json, setup_logger
+Funciones compartidas: load_api_key, crear_api, save_json, setup_logger, es_cierto
 """
 from __future__ import annotations
 import os
@@ -11,11 +11,37 @@ from typing import Any
 
 def load_api_key() -> str:
     api_key = os.getenv('SHODAN_API_KEY')
+    if not api_key:
+        #con solo SHODAN_API_KEYS la principal es la primera de la lista
+        api_key = next((k.strip() for k in os.getenv('SHODAN_API_KEYS', '').split(',') if k.strip()), None)
     if not api_key:
         raise RuntimeError('La variable de entorno SHODAN_API_KEY no está definida')
     return api_key
 
 
+def crear_api(api_key: str | None = None):
+    """
+    cliente Shodan con el límite de peticiones y créditos compartido
+    (shodan_limiter); sin clave explícita y con varias en SHODAN_API_KEYS
+    reparte las llamadas entre ellas (shodan_keys).
+    """
+    from shodan_limiter import LimitedShodan
+    from shodan_keys import KeyPool, PooledShodan, load_api_keys
+    if api_key:
+        return LimitedShodan(api_key)
+    keys = load_api_keys()
+    if len(keys) > 1:
+        return PooledShodan(KeyPool(keys))
+    return LimitedShodan(load_api_key())
+
+
+def es_cierto(value: Any) -> bool:
+    #los parámetros llegan del formulario como texto ("true", "1", "si")
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "si", "sí", "on")
+    return bool(value)
+
+
 def save_json(path: str, data: Any) -> None:
     with open(path, 'w', encoding='utf-8') as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
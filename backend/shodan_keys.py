@@ -0,0 +1,203 @@
+"""shodan_keys.py
+Pool de claves de Shodan (SHODAN_API_KEYS): reparto round-robin ponderado por
+créditos, retirada temporal de claves que fallan y contadores de uso: KeyPool,
+PooledShodan
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+import shodan
+
+from shodan_limiter import (CREDITS, CREDIT_KINDS, CreditBudget, LimitedShodan, TokenBucket, _Db,
+                            es_rate_limit, key_id)
+
+#fallos seguidos (429/401) que retiran una clave y durante cuánto tiempo
+KEY_MAX_FAILURES = int(os.getenv("SHODAN_KEY_MAX_FAILURES", "3"))
+KEY_COOLDOWN = float(os.getenv("SHODAN_KEY_COOLDOWN", "300"))
+
+#llamadas sin estado de cuenta que pueden ir con cualquier clave (host, search, count, dns)
+ROTATING_PREFIXES = ("/shodan/host/", "/dns/")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS key_health (
+    key_id TEXT PRIMARY KEY,
+    failures INTEGER NOT NULL DEFAULT 0,
+    disabled_until REAL NOT NULL DEFAULT 0,
+    requests INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0,
+    rate_limited INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    last_used REAL
+);
+"""
+
+
+def load_api_keys() -> List[str]:
+    """SHODAN_API_KEY (si está) seguida de las de SHODAN_API_KEYS, sin repetir."""
+    keys = []
+    for k in [os.getenv("SHODAN_API_KEY", "")] + os.getenv("SHODAN_API_KEYS", "").split(","):
+        k = k.strip()
+        if k and k not in keys:
+            keys.append(k)
+    return keys
+
+
+def enmascarar(api_key: str) -> str:
+    return f"{api_key[:4]}…{api_key[-4:]}" if len(api_key) > 8 else "…"
+
+
+def es_fallo_de_clave(e: Exception) -> bool:
+    msg = str(e).lower()
+    return es_rate_limit(e) or "401" in msg or "invalid api key" in msg or "access denied" in msg
+
+
+class KeyHealth(_Db):
+    """salud y contadores por clave en la base de límites, compartidos entre procesos."""
+    schema = SCHEMA
+
+    def report(self, api_key: str, error: Exception | None = None) -> None:
+        kid, now = key_id(api_key), time.time()
+
+        def tx(db):
+            db.execute("INSERT OR IGNORE INTO key_health (key_id) VALUES (?)", (kid,))
+            if error is None:
+                db.execute("UPDATE key_health SET failures = 0, requests = requests + 1, last_used = ? "
+                           "WHERE key_id = ?", (now, kid))
+                return
+            fallo = es_fallo_de_clave(error)
+            db.execute(
+                "UPDATE key_health SET requests = requests + 1, errors = errors + 1, "
+                "rate_limited = rate_limited + ?, failures = failures + ?, last_error = ?, last_used = ? "
+                "WHERE key_id = ?",
+                (int(es_rate_limit(error)), int(fallo), str(error)[:200], now, kid)
+            )
+            if fallo:
+                db.execute("UPDATE key_health SET disabled_until = ?, failures = 0 "
+                           "WHERE key_id = ? AND failures >= ?", (now + KEY_COOLDOWN, kid, KEY_MAX_FAILURES))
+        self.transaction(tx)
+
+    def get(self, api_key: str) -> Dict[str, Any]:
+        row = self.transaction(lambda db: db.execute(
+            "SELECT failures, disabled_until, requests, errors, rate_limited, last_error, last_used "
+            "FROM key_health WHERE key_id = ?", (key_id(api_key),)).fetchone())
+        cols = ("failures", "disabled_until", "requests", "errors", "rate_limited", "last_error", "last_used")
+        return dict(zip(cols, row)) if row else dict.fromkeys(cols, 0) | {"last_error": None, "last_used": None}
+
+
+HEALTH = KeyHealth()
+
+
+class KeyPool:
+    """
+    reparte las llamadas entre claves con round-robin ponderado suave (como
+    nginx): el peso es el crédito disponible de cada clave y las retiradas por
+    fallos repetidos no reciben tráfico hasta que acaba su enfriamiento.
+    """
+
+    def __init__(self, keys: List[str], credits: CreditBudget | None = None, health: KeyHealth | None = None,
+                 kind: str = "query"):
+        if not keys:
+            raise RuntimeError("No hay claves de Shodan (SHODAN_API_KEY / SHODAN_API_KEYS)")
+        self.keys = list(keys)
+        self.credits = credits or CREDITS
+        self.health = health or HEALTH
+        self.kind = kind
+        self._current = {k: 0.0 for k in self.keys}
+        self._lock = threading.Lock()
+
+    def _weight(self, api_key: str) -> float:
+        try:
+            return max(1.0, float(self.credits.available(api_key, self.kind)))
+        except Exception:
+            return 1.0
+
+    def healthy(self) -> List[str]:
+        now = time.time()
+        activas = [k for k in self.keys if self.health.get(k)["disabled_until"] <= now]
+        if activas:
+            return activas
+        #todas retiradas: la que antes vuelve, mejor que no hacer nada
+        return [min(self.keys, key=lambda k: self.health.get(k)["disabled_until"])]
+
+    def next_key(self) -> str:
+        activas = self.healthy()
+        if len(activas) == 1:
+            return activas[0]
+        pesos = {k: self._weight(k) for k in activas}
+        total = sum(pesos.values())
+        with self._lock:
+            for k in activas:
+                self._current[k] += pesos[k]
+            elegida = max(activas, key=lambda k: self._current[k])
+            self._current[elegida] -= total
+        return elegida
+
+    def best_for(self, kind: str) -> str:
+        """clave sana con más créditos disponibles de ese tipo (reservas de /run)."""
+        def disponible(k):
+            try:
+                return self.credits.available(k, kind)
+            except Exception:
+                return -1
+        return max(self.healthy(), key=disponible)
+
+    def report(self, api_key: str, error: Exception | None = None) -> None:
+        self.health.report(api_key, error)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        out = []
+        for k in self.keys:
+            h = self.health.get(k)
+            entry = {"key": key_id(k), "masked": enmascarar(k), "healthy": h["disabled_until"] <= now, **h}
+            try:
+                info = self.credits.info(k)
+                entry["plan"] = info.get("plan")
+                for kind in CREDIT_KINDS:
+                    entry[f"{kind}_credits"] = info.get(f"{kind}_credits")
+                    entry[f"{kind}_available"] = self.credits.available(k, kind)
+            except Exception as e:
+                entry["info_error"] = str(e)
+            out.append(entry)
+        return out
+
+
+class PooledShodan(LimitedShodan):
+    """
+    LimitedShodan con varias claves: host/search/count/dns rotan por el pool y,
+    si una clave devuelve 429/401, se reintenta con otra. Escaneos, alertas y
+    demás llamadas ligadas a la cuenta usan siempre la clave principal.
+    """
+
+    def __init__(self, pool: KeyPool, limiter: TokenBucket | None = None):
+        self.pool = pool
+        super().__init__(pool.keys[0], limiter=limiter)
+        self._principal = LimitedShodan(pool.keys[0], limiter=limiter)
+        #en la rotación un 429 pasa a la siguiente clave en vez de esperar a la misma
+        self._clientes = {k: LimitedShodan(k, limiter=limiter, rate_retries=0) for k in pool.keys}
+
+    def _request(self, function, params, service='shodan', method='get', json_data=None):
+        if service != 'shodan' or method.lower() != 'get' or not function.startswith(ROTATING_PREFIXES):
+            return self._llamar(self._principal, function, params, service, method, json_data)
+        ultimo = None
+        for _ in range(len(self.pool.keys)):
+            api = self._clientes[self.pool.next_key()]
+            try:
+                return self._llamar(api, function, dict(params), service, method, json_data)
+            except shodan.APIError as e:
+                if not es_fallo_de_clave(e):
+                    raise
+                ultimo = e
+        raise ultimo
+
+    def _llamar(self, api: LimitedShodan, function, params, service, method, json_data):
+        try:
+            data = LimitedShodan._request(api, function, params, service=service, method=method, json_data=json_data)
+        except shodan.APIError as e:
+            self.pool.report(api.api_key, e)
+            raise
+        self.pool.report(api.api_key)
+        return data
@@ -0,0 +1,312 @@
+"""shodan_limiter.py
+Límite de peticiones y presupuesto de créditos de Shodan compartidos por la
+API y todos los scripts: TokenBucket, CreditBudget, LimitedShodan
+"""
+from __future__ import annotations
+import asyncio
+import hashlib
+import math
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from typing import Any, Dict, Tuple
+
+import shodan
+
+import http_client
+from persistent_cache import CACHE_DIR, PersistentCache
+
+#Shodan admite ~1 petición por segundo y clave
+SHODAN_RATE = float(os.getenv("SHODAN_RATE", "1"))
+SHODAN_BURST = float(os.getenv("SHODAN_BURST", "1"))
+#reintentos de una llamada que recibe rate limit, con el cubo penalizado entre medias
+SHODAN_RATE_RETRIES = int(os.getenv("SHODAN_RATE_RETRIES", "4"))
+SHODAN_PENALTY = float(os.getenv("SHODAN_PENALTY", "2"))
+#cada cuánto se vuelve a leer api.info() como mucho
+SHODAN_INFO_TTL = int(os.getenv("SHODAN_INFO_TTL", "300"))
+
+LIMITS_DB = CACHE_DIR / "shodan_limits.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    id TEXT PRIMARY KEY,
+    key_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reservations_key ON reservations (key_id, kind);
+"""
+
+CREDIT_KINDS = ("query", "scan")
+
+
+class CreditsExhausted(Exception):
+    pass
+
+
+def key_id(api_key: str | None) -> str:
+    """identificador estable de la clave sin guardarla en claro."""
+    return hashlib.sha1((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+class _Db:
+    #conexión perezosa por proceso en modo autocommit para usar BEGIN IMMEDIATE
+    schema = SCHEMA
+
+    def __init__(self, db_path: str | pathlib.Path | None = None):
+        self.db_path = pathlib.Path(db_path or LIMITS_DB)
+        self._conn: sqlite3.Connection | None = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.executescript(self.schema)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def transaction(self, fn):
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                out = fn(db)
+                db.execute("COMMIT")
+                return out
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+
+class TokenBucket(_Db):
+    """
+    cubo de tokens por nombre (una clave de Shodan) guardado en SQLite, de modo
+    que todos los procesos y trabajos que usan la misma clave comparten ritmo.
+    """
+
+    def __init__(self, rate: float = SHODAN_RATE, burst: float = SHODAN_BURST,
+                 db_path: str | pathlib.Path | None = None):
+        super().__init__(db_path)
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.waited = 0.0
+        self.acquired = 0
+        self._async_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Lock]]" = \
+            weakref.WeakKeyDictionary()
+
+    def _take(self, name: str, tokens: float) -> float:
+        #toma tokens si hay; si no, devuelve cuántos segundos faltan
+        def tx(db):
+            now = time.time()
+            row = db.execute("SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)).fetchone()
+            level = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            if level >= tokens:
+                level -= tokens
+                wait = 0.0
+            else:
+                wait = (tokens - level) / self.rate
+            db.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                       (name, level, now))
+            return wait
+        return self.transaction(tx)
+
+    def acquire(self, name: str, tokens: float = 1.0, timeout: float | None = None) -> None:
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = self._take(name, tokens)
+            if wait <= 0:
+                self.acquired += 1
+                return
+            if deadline is not None and time.time() + wait > deadline:
+                raise TimeoutError(f"rate limit: sin tokens para {name} en {timeout}s")
+            self.waited += wait
+            time.sleep(wait)
+
+    async def aacquire(self, name: str, tokens: float = 1.0) -> None:
+        """
+        acquire() sin bloquear el bucle; las corrutinas de una clave esperan en
+        fila. La transacción SQLite (busy_timeout de hasta 30 s) va a un hilo.
+        """
+        locks = self._async_locks.setdefault(asyncio.get_running_loop(), {})
+        async with locks.setdefault(name, asyncio.Lock()):
+            while True:
+                wait = await asyncio.to_thread(self._take, name, tokens)
+                if wait <= 0:
+                    self.acquired += 1
+                    return
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+    def penalize(self, name: str, seconds: float) -> None:
+        """tras un 429 deja el cubo en negativo: todos los procesos esperan."""
+        def tx(db):
+            db.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                       (name, -seconds * self.rate, time.time()))
+        self.transaction(tx)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"rate": self.rate, "burst": self.burst, "acquired": self.acquired,
+                "waited_seconds": round(self.waited, 3)}
+
+
+class CreditBudget(_Db):
+    """
+    créditos de consulta/escaneo por clave: lee api.info() (cacheado
+    SHODAN_INFO_TTL segundos) y descuenta lo reservado por los trabajos en curso.
+    """
+
+    def __init__(self, db_path: str | pathlib.Path | None = None, info_ttl: float = SHODAN_INFO_TTL):
+        super().__init__(db_path)
+        self.info_cache = PersistentCache("shodan_info", ttl=info_ttl, max_entries=100)
+
+    def info(self, api_key: str, refresh: bool = False) -> Dict[str, Any]:
+        kid = key_id(api_key)
+        if refresh:
+            self.info_cache.delete(kid)
+        return self.info_cache.get_or_compute(kid, lambda: LimitedShodan(api_key).info())
+
+    def _reserved(self, db: sqlite3.Connection, kid: str, kind: str) -> int:
+        #las reservas de procesos caídos caducan solas
+        db.execute("DELETE FROM reservations WHERE expires_at < ?", (time.time(),))
+        return db.execute("SELECT COALESCE(SUM(amount), 0) FROM reservations WHERE key_id = ? AND kind = ?",
+                          (kid, kind)).fetchone()[0]
+
+    def available(self, api_key: str, kind: str) -> int:
+        credits = int(self.info(api_key).get(f"{kind}_credits") or 0)
+        return credits - self.transaction(lambda db: self._reserved(db, key_id(api_key), kind))
+
+    def reserve(self, api_key: str, kind: str, amount: int, ttl: float = 3600,
+                reservation_id: str | None = None) -> str | None:
+        """reserva amount créditos; None si no llegan los que quedan."""
+        if kind not in CREDIT_KINDS:
+            raise ValueError(f"tipo de crédito desconocido: {kind}")
+        credits = int(self.info(api_key).get(f"{kind}_credits") or 0)
+        kid = key_id(api_key)
+        rid = reservation_id or uuid.uuid4().hex
+
+        def tx(db):
+            if credits - self._reserved(db, kid, kind) < amount:
+                return None
+            now = time.time()
+            db.execute("INSERT OR REPLACE INTO reservations (id, key_id, kind, amount, created_at, expires_at) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", (rid, kid, kind, amount, now, now + ttl))
+            return rid
+        return self.transaction(tx)
+
+    def wait_reserve(self, api_key: str, kind: str, amount: int, timeout: float,
+                     poll: float = 15, ttl: float = 3600, reservation_id: str | None = None) -> str:
+        """reserve() esperando a que se liberen créditos; CreditsExhausted al agotar timeout."""
+        deadline = time.time() + timeout
+        while True:
+            rid = self.reserve(api_key, kind, amount, ttl=ttl, reservation_id=reservation_id)
+            if rid:
+                return rid
+            if time.time() + poll > deadline:
+                raise CreditsExhausted(f"sin {amount} {kind} credits disponibles tras {int(timeout)}s")
+            time.sleep(poll)
+
+    def release(self, reservation_id: str, api_key: str | None = None) -> None:
+        """libera la reserva; con api_key fuerza a releer api.info() con el consumo real."""
+        self.transaction(lambda db: db.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,)))
+        if api_key:
+            self.info_cache.delete(key_id(api_key))
+
+    def stats(self, api_key: str | None = None) -> Dict[str, Any]:
+        def tx(db):
+            db.execute("DELETE FROM reservations WHERE expires_at < ?", (time.time(),))
+            return db.execute("SELECT key_id, kind, COUNT(*), SUM(amount) FROM reservations "
+                              "GROUP BY key_id, kind").fetchall()
+        out: Dict[str, Any] = {"reservations": [
+            {"key": k, "kind": kind, "jobs": n, "amount": total} for k, kind, n, total in self.transaction(tx)
+        ]}
+        if api_key:
+            info = self.info(api_key)
+            out["key"] = key_id(api_key)
+            out["plan"] = info.get("plan")
+            for kind in CREDIT_KINDS:
+                out[f"{kind}_credits"] = info.get(f"{kind}_credits")
+                out[f"{kind}_available"] = self.available(api_key, kind)
+        return out
+
+
+def estimar_creditos(meta: Dict[str, Any], params: Dict[str, Any]) -> Tuple[str, int] | None:
+    """
+    coste del trabajo según SCRIPT_METADATA["credits"]: {"kind", "amount"} fijo
+    o {"kind", "param", "per"} -> ceil(params[param] / per) créditos.
+    "targets": param con IPs/CIDR/archivo -> un crédito por IP cubierta.
+    "free_when": {param: valor} marca los modos que no gastan créditos.
+    """
+    spec = meta.get("credits")
+    if not spec:
+        return None
+    for name, value in spec.get("free_when", {}).items():
+        if str(params.get(name) or "").lower() == value:
+            return None
+    amount = int(spec.get("amount", 1))
+    if spec.get("param"):
+        try:
+            value = float(params.get(spec["param"]) or 0)
+        except (TypeError, ValueError):
+            value = 0
+        amount = max(amount, math.ceil(value / spec.get("per", 1)))
+    if spec.get("targets"):
+        from batch_scan import contar_ips, expandir_objetivos
+        try:
+            amount = max(amount, contar_ips(expandir_objetivos(params.get(spec["targets"]))))
+        except ValueError:
+            pass
+    return spec["kind"], amount
+
+
+def es_rate_limit(e: Exception) -> bool:
+    msg = str(e).lower()
+    return "429" in msg or "rate limit" in msg
+
+
+LIMITER = TokenBucket()
+CREDITS = CreditBudget()
+
+
+class LimitedShodan(shodan.Shodan):
+    """
+    shodan.Shodan que pasa cada llamada por el cubo de tokens compartido de su
+    clave y reintenta los rate limit penalizando el cubo (sin tormenta de
+    reintentos entre procesos). Usa el pool keep-alive de http_client.
+    """
+
+    def __init__(self, key: str, proxies: Dict[str, str] | None = None, limiter: TokenBucket | None = None,
+                 rate_retries: int = SHODAN_RATE_RETRIES):
+        super().__init__(key, proxies=proxies)
+        self.limiter = limiter or LIMITER
+        self.rate_retries = rate_retries
+        #el ritmo lo marca el cubo compartido, no la espera por instancia de la librería
+        self.api_rate_limit = 0
+        if not proxies:
+            self._session = http_client.get_session()
+
+    def _request(self, function, params, service='shodan', method='get', json_data=None):
+        name = key_id(self.api_key)
+        for intento in range(self.rate_retries + 1):
+            self.limiter.acquire(name)
+            try:
+                return super()._request(function, params, service=service, method=method, json_data=json_data)
+            except shodan.APIError as e:
+                if not es_rate_limit(e) or intento >= self.rate_retries:
+                    raise
+                self.limiter.penalize(name, SHODAN_PENALTY * (2 ** intento))
@@ -0,0 +1,215 @@
+"""stream_stats.py
+Procesado de eventos de alertas en flujo: deduplicación por ventana de tiempo
+y agregados por minuto con memoria acotada (HyperLogLog, count-min):
+HyperLogLog, CountMinSketch, DedupWindow, ProcesadorEventos
+"""
+from __future__ import annotations
+import hashlib
+import math
+import os
+import time
+from collections import Counter, OrderedDict, deque
+from typing import Any, Dict, Iterable
+
+#segundos en los que un mismo (ip, puerto, módulo) cuenta como repetido
+ALERT_DEDUP_WINDOW = float(os.getenv("ALERT_DEDUP_WINDOW", "300"))
+#minutos de agregados que se conservan
+ALERT_AGG_MINUTES = int(os.getenv("ALERT_AGG_MINUTES", "60"))
+TOP = 10
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """cardinalidad aproximada (error ~1.04/sqrt(2^p)) en 2^p bytes."""
+
+    def __init__(self, p: int = 12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value: Any) -> None:
+        h = _hash64(str(value))
+        idx = h >> (64 - self.p)
+        resto = (h << self.p) & ((1 << 64) - 1)
+        rho = min(64 - self.p, 64 - resto.bit_length()) + 1
+        if rho > self.registers[idx]:
+            self.registers[idx] = rho
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def count(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        vacios = self.registers.count(0)
+        #rango pequeño: conteo lineal sobre registros vacíos
+        if estimate <= 2.5 * self.m and vacios:
+            estimate = self.m * math.log(self.m / vacios)
+        return int(round(estimate))
+
+
+class CountMinSketch:
+    """frecuencias aproximadas (nunca por debajo de la real) en depth x width contadores."""
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+
+    def _cols(self, key: Any) -> Iterable[int]:
+        #doble hashing: h1 + i*h2 da depth funciones independientes con un solo hash
+        h = _hash64(str(key))
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return ((h1 + i * h2) % self.width for i in range(self.depth))
+
+    def add(self, key: Any, n: int = 1) -> int:
+        est = None
+        for row, col in zip(self.rows, self._cols(key)):
+            row[col] += n
+            est = row[col] if est is None else min(est, row[col])
+        return est
+
+    def estimate(self, key: Any) -> int:
+        return min(row[col] for row, col in zip(self.rows, self._cols(key)))
+
+
+class DedupWindow:
+    """
+    recuerda cada clave durante window segundos; seen() dice si ya apareció
+    dentro de la ventana. Acotado por los eventos distintos de la ventana y por
+    max_keys (se olvidan primero los más antiguos).
+    """
+
+    def __init__(self, window: float = ALERT_DEDUP_WINDOW, max_keys: int = 100000):
+        self.window = window
+        self.max_keys = max_keys
+        self._seen: "OrderedDict[Any, float]" = OrderedDict()
+
+    def seen(self, key: Any, now: float | None = None) -> bool:
+        if self.window <= 0:
+            return False
+        now = time.time() if now is None else now
+        while self._seen:
+            k, ts = next(iter(self._seen.items()))
+            if now - ts < self.window and len(self._seen) < self.max_keys:
+                break
+            del self._seen[k]
+        if key in self._seen:
+            return True
+        self._seen[key] = now
+        return False
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+class _Minuto:
+    def __init__(self, minuto: int):
+        self.minuto = minuto
+        self.events = 0
+        self.duplicates = 0
+        self.new_services = 0
+        self.puertos: Counter = Counter()
+        self.modulos: Counter = Counter()
+        self.ips = HyperLogLog(p=10)
+        self.por_ip = CountMinSketch(width=1024, depth=4)
+        #candidatos a IP más activa: solo se guardan las TOP*4 con más eventos estimados
+        self.top_ips: Dict[str, int] = {}
+
+    def add(self, ip: str, port: Any, module: Any) -> None:
+        self.puertos[port] += 1
+        self.modulos[module] += 1
+        self.ips.add(ip)
+        est = self.por_ip.add(ip)
+        if ip in self.top_ips or len(self.top_ips) < TOP * 4:
+            self.top_ips[ip] = est
+        else:
+            menor = min(self.top_ips, key=self.top_ips.get)
+            if est > self.top_ips[menor]:
+                del self.top_ips[menor]
+                self.top_ips[ip] = est
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "minute": self.minuto * 60,
+            "events": self.events,
+            "duplicates": self.duplicates,
+            "new_services": self.new_services,
+            "seen_services": self.events - self.duplicates - self.new_services,
+            "unique_ips": self.ips.count(),
+            "top_ports": [{"port": p, "count": n} for p, n in self.puertos.most_common(TOP)],
+            "top_modules": [{"module": m, "count": n} for m, n in self.modulos.most_common(TOP)],
+            "top_ips": [{"ip": ip, "count": n} for ip, n in sorted(self.top_ips.items(), key=lambda x: -x[1])[:TOP]],
+        }
+
+
+class ProcesadorEventos:
+    """
+    etapa entre el stream y los consumidores: add() descarta los repetidos de
+    la ventana y acumula agregados por minuto (eventos, repetidos, servicios
+    nuevos frente a ya vistos, IPs únicas y top puertos/módulos/IPs).
+    """
+
+    def __init__(self, dedup_window: float = ALERT_DEDUP_WINDOW, minutes: int = ALERT_AGG_MINUTES):
+        self.dedup = DedupWindow(dedup_window)
+        self.retencion = max(1, minutes)
+        #solo hay cubo para los minutos con eventos; los de más de retencion minutos se descartan
+        self.minutos: deque = deque(maxlen=self.retencion)
+        #servicios (ip, puerto) vistos alguna vez: count-min no da falsos "nuevo"
+        self.servicios = CountMinSketch(width=1 << 16, depth=4)
+        self.ips_total = HyperLogLog()
+        self.events = 0
+        self.duplicates = 0
+
+    def _minuto(self, now: float) -> _Minuto:
+        minuto = int(now // 60)
+        if not self.minutos or self.minutos[-1].minuto != minuto:
+            self.minutos.append(_Minuto(minuto))
+        while self.minutos[0].minuto <= minuto - self.retencion:
+            self.minutos.popleft()
+        return self.minutos[-1]
+
+    def add(self, event: Dict[str, Any], now: float | None = None) -> bool:
+        """True si el evento es nuevo en la ventana y debe seguir hacia los consumidores."""
+        now = time.time() if now is None else now
+        ip, port, module = event.get("ip_str"), event.get("port"), event.get("module")
+        actual = self._minuto(now)
+        actual.events += 1
+        self.events += 1
+        if self.dedup.seen((ip, port, module), now):
+            actual.duplicates += 1
+            self.duplicates += 1
+            return False
+        if self.servicios.add(f"{ip}:{port}") == 1:
+            actual.new_services += 1
+        actual.add(ip, port, module)
+        self.ips_total.add(ip)
+        return True
+
+    def aggregates(self, minutes: int | None = None, now: float | None = None) -> Dict[str, Any]:
+        """agregados de los últimos minutes minutos de reloj (los vacíos no tienen fila)."""
+        filas = list(self.minutos)
+        if minutes:
+            desde = int((time.time() if now is None else now) // 60) - minutes
+            filas = [f for f in filas if f.minuto > desde]
+        ips = HyperLogLog(p=10)
+        for f in filas:
+            ips.merge(f.ips)
+        return {
+            "events": self.events,
+            "duplicates": self.duplicates,
+            "unique_ips": self.ips_total.count(),
+            "dedup_window": self.dedup.window,
+            "window": {
+                "minutes": minutes or len(filas),
+                "events": sum(f.events for f in filas),
+                "new_services": sum(f.new_services for f in filas),
+                "unique_ips": ips.count() if filas else 0,
+            },
+            "per_minute": [f.to_dict() for f in filas],
+        }
+
@@ -1,9 +1,26 @@
+import os, tempfile
+#las cachés SQLite (también las de los scripts lanzados) van a un directorio temporal
+os.environ['SHODAN_CACHE_DIR'] = tempfile.mkdtemp(prefix='shodan_cache_')
+
 from fastapi.testclient import TestClient
 from app import app
-import tempfile, json
+import json, time
+import pytest
 
 client = TestClient(app)
 
+
+@pytest.fixture(autouse=True)
+def results_dir(tmp_path, monkeypatch):
+    #cada test escribe sus resultados y su catálogo en tmp_path, no en backend/results
+    import app as app_module
+    from results_catalog import ResultsCatalog
+    d = tmp_path / 'results'
+    d.mkdir()
+    monkeypatch.setattr(app_module, 'RESULTS_DIR', d)
+    monkeypatch.setattr(app_module, 'CATALOG', ResultsCatalog(d))
+    return d
+
 def test_upload_and_list():
     data = {'hello':'world'}
     with tempfile.NamedTemporaryFile('w', delete=False, suffix='.json') as tf:
@@ -17,3 +34,897 @@ def test_upload_and_list():
         r2 = client.get('/results')
         assert r2.status_code == 200
         assert any('test' in item['name'] for item in r2.json())
+
+
+@pytest.mark.parametrize('engine', ['inprocess', 'subprocess'])
+def test_run_returns_job_and_finishes(engine):
+    hosts = [{'ip': '1.2.3.4', 'banners': [{'port': 22, 'product': 'OpenSSH'}],
+              'vulns': {'CVE-2020-1234': {'port': 22, 'cvss': 7.5, 'description': 'weak password'}}}]
+    r = client.post('/upload-json', files={'file': ('owasp_input.json', json.dumps(hosts), 'application/json')})
+    path = r.json()['path']
+
+    r = client.post('/run/vulnerabilidades_OWASP', json={'params': {'input_file': path}, 'engine': engine})
+    assert r.status_code == 202
+    job_id = r.json()['job_id']
+
+    for _ in range(100):
+        job = client.get(f'/jobs/{job_id}').json()
+        if job['status'] in ('finished', 'error'):
+            break
+        time.sleep(0.1)
+    assert job['status'] == 'finished', job
+    assert job['out_path'].endswith('.json')
+    assert job['engine'] == engine
+    assert client.get('/results/file', params={'path': job['out_path']}).json()[0]['cve'] == 'CVE-2020-1234'
+    assert any(j['id'] == job_id for j in client.get('/jobs').json()['jobs'])
+
+
+def test_script_engine_kills_worker_on_timeout(tmp_path):
+    import concurrent.futures
+    from script_engine import ScriptEngine
+    script = tmp_path / 'colgado.py'
+    script.write_text('import os, time\n'
+                      'def forever(params, logger):\n'
+                      '    open(params["pid"], "w").write(str(os.getpid()))\n'
+                      '    while True:\n'
+                      '        time.sleep(1)\n'
+                      'def ok(params, logger):\n'
+                      '    return {"ok": True}\n')
+    pid_file = tmp_path / 'pid'
+    engine = ScriptEngine(max_workers=1)
+    try:
+        with pytest.raises(concurrent.futures.TimeoutError):
+            engine.run(script, 'forever', {'pid': str(pid_file)}, timeout=3)
+        pid = int(pid_file.read_text())
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                break
+            time.sleep(0.05)
+        else:
+            pytest.fail('el worker colgado sigue vivo')
+        #el único worker se ha reemplazado: el siguiente trabajo no queda detrás del colgado
+        assert engine.run(script, 'ok', {}, timeout=30) == {'ok': True}
+        assert engine.stats()['recycles'] == 1
+    finally:
+        engine.shutdown()
+
+
+def test_run_unknown_script_is_rejected():
+    r = client.post('/run/no_existe', json={'params': {}})
+    assert r.status_code == 400
+
+
+def test_parse_progress_line():
+    from app import parse_progress_line
+    ev = parse_progress_line('[3/254] nmap -> 10.0.0.3')
+    assert ev['type'] == 'progress' and ev['current'] == 3 and ev['total'] == 254 and ev['target'] == '10.0.0.3'
+    assert parse_progress_line('2024 INFO realtime_monitor - Evento detectado: 1.2.3.4:443')['port'] == 443
+    assert parse_progress_line('otra cosa') is None
+
+
+def test_job_stream_ends_with_status():
+    r = client.post('/run/vulnerabilidades_OWASP', json={'params': {'input_file': 'no_existe.json'}})
+    job_id = r.json()['job_id']
+    with client.stream('GET', f'/jobs/{job_id}/stream') as resp:
+        body = ''.join(resp.iter_text())
+    assert 'event: line' in body
+    assert 'event: end' in body
+    assert '"status": "error"' in body
+
+
+def test_scripts_schema_etag():
+    r = client.get('/scripts/schema')
+    assert r.status_code == 200
+    assert 'host_lookup' in r.json()
+    etag = r.headers['etag']
+    r2 = client.get('/scripts/schema', headers={'If-None-Match': etag})
+    assert r2.status_code == 304
+
+
+def test_script_registry_reparses_only_on_change(tmp_path, monkeypatch):
+    import script_registry
+    from script_registry import ScriptRegistry
+    script = tmp_path / 'demo.py'
+    script.write_text('SCRIPT_METADATA = {"description": "v1", "params": []}\n', encoding='utf-8')
+    calls = []
+    original = script_registry.read_script_metadata
+    monkeypatch.setattr(script_registry, 'read_script_metadata', lambda p: calls.append(p) or original(p))
+
+    reg = ScriptRegistry(tmp_path, poll_interval=0)
+    assert reg.metadata('demo')['description'] == 'v1'
+    _, etag1 = reg.schema()
+    assert len(calls) == 1
+
+    script.write_text('SCRIPT_METADATA = {"description": "v2 changed", "params": []}\n', encoding='utf-8')
+    assert reg.metadata('demo')['description'] == 'v2 changed'
+    assert reg.schema()[1] != etag1
+    assert len(calls) == 2
+
+
+def test_results_pagination_and_filters():
+    for i in range(3):
+        client.post('/upload-json', files={'file': (f'page{i}.json', json.dumps({'cve': f'CVE-2021-000{i}'}), 'application/json')})
+    r = client.get('/results', params={'script': 'upload', 'target': 'page', 'limit': 2})
+    assert r.status_code == 200
+    first = r.json()
+    assert len(first) == 2 and all(item['script'] == 'upload' for item in first)
+    assert int(r.headers['x-total-count']) >= 3
+    r2 = client.get('/results', params={'script': 'upload', 'target': 'page', 'limit': 2,
+                                        'cursor': r.headers['x-next-cursor']})
+    names = {i['name'] for i in first} | {i['name'] for i in r2.json()}
+    assert len(names) == len(first) + len(r2.json())
+    assert all(item['cve_count'] == 1 for item in first)
+    assert client.get('/results', params={'sort': 'bogus'}).status_code == 400
+
+
+def test_result_file_compression_and_etag():
+    payload = {'matches': [{'ip_str': f'10.0.0.{i}', 'port': 80, 'data': 'HTTP/1.1 200 OK'} for i in range(200)]}
+    path = client.post('/upload-json', files={'file': ('big.json', json.dumps(payload), 'application/json')}).json()['path']
+
+    r = client.get('/results/file', params={'path': path}, headers={'Accept-Encoding': 'gzip'})
+    assert r.status_code == 200
+    assert r.headers['content-encoding'] == 'gzip'
+    assert r.headers['etag'].endswith('-gzip"')
+    assert r.json() == payload
+
+    r2 = client.get('/results/file', params={'path': path},
+                    headers={'Accept-Encoding': 'gzip', 'If-None-Match': r.headers['etag']})
+    assert r2.status_code == 304
+
+    #el ETag de la versión gzip no valida la representación sin comprimir
+    r3 = client.get('/results/file', params={'path': path},
+                    headers={'Accept-Encoding': 'identity', 'If-None-Match': r.headers['etag']})
+    assert r3.status_code == 200 and 'content-encoding' not in r3.headers
+    assert r3.headers['etag'] != r.headers['etag']
+    assert r3.json() == payload
+
+
+def test_parsed_cache_reuses_object_until_file_changes(tmp_path):
+    from result_files import ParsedCache
+    f = tmp_path / 'r.json'
+    f.write_text('{"a": 1}', encoding='utf-8')
+    cache = ParsedCache(max_entries=2)
+    first = cache.load(f)
+    assert cache.load(f) is first
+    f.write_text('{"a": 22}', encoding='utf-8')
+    assert cache.load(f) == {'a': 22}
+    assert cache.stats()['hits'] == 1
+
+
+def test_result_rows_projection_sort_and_paging():
+    payload = {'matches': [{'ip_str': f'10.0.0.{i}', 'port': 80 + i, 'location': {'city': f'c{i}'},
+                            'raw_data': 'x' * 100, 'cvss': i % 3} for i in range(10)]}
+    path = client.post('/upload-json', files={'file': ('rows.json', json.dumps(payload), 'application/json')}).json()['path']
+    name = path.split('/')[-1]
+
+    r = client.get(f'/results/{name}/rows', params={'fields': 'ip_str,location.city', 'offset': 2, 'limit': 3})
+    assert r.status_code == 200
+    j = r.json()
+    assert j['collection'] == 'matches' and j['total'] == 10
+    assert j['rows'] == [{'ip_str': f'10.0.0.{i}', 'location.city': f'c{i}'} for i in (2, 3, 4)]
+
+    rows = client.get(f'/results/{name}/rows', params={'sort': '-cvss', 'limit': 4}).json()['rows']
+    assert [row['cvss'] for row in rows] == [2, 2, 2, 1]
+    assert 'raw_data' not in rows[0]
+
+    assert client.get('/results/no_such.json/rows').status_code == 404
+
+
+def test_extract_cves_walks_keys_and_values_and_persists(monkeypatch):
+    from app import extract_cves_from_obj
+    import result_files
+    obj = {'vulns': {'cve-2019-0001': {'description': 'line1\nCVE-2019-0002 and CVE-2019-0002'}},
+           'list': ['x', 3, None, 'see CVE-2020-12345']}
+    assert extract_cves_from_obj(obj) == ['CVE-2019-0001', 'CVE-2019-0002', 'CVE-2020-12345']
+
+    path = client.post('/upload-json', files={'file': ('cves.json', json.dumps(obj), 'application/json')}).json()['path']
+
+    def no_parse(*a, **k):
+        raise AssertionError('should be served from the persisted CVE set')
+    monkeypatch.setattr(result_files.PARSED, 'load', no_parse)
+    r = client.get('/extract-cves', params={'path': path})
+    assert r.status_code == 200
+    assert r.json()['count'] == 3
+
+
+def test_cve_inverted_index():
+    scan = [{'ip': '192.0.2.10', 'ip_str': '192.0.2.10', 'raw': 'mentions CVE-2023-99991',
+             'vulns_nvd': [{'cve': 'CVE-2023-99991', 'port': 22, 'product': 'OpenSSH', 'version': '7.4'}],
+             'vulns': {'CVE-2023-99992': {'port': 80, 'product': 'nginx', 'version': '1.10'}}},
+            {'ip': '192.0.2.11', 'vulns': {'CVE-2023-99991': {'port': 2222, 'product': 'OpenSSH'}}}]
+    client.post('/upload-json', files={'file': ('idx.json', json.dumps(scan), 'application/json')})
+
+    r = client.get('/cves/cve-2023-99991/occurrences')
+    assert r.status_code == 200
+    j = r.json()
+    assert j['hosts'] >= 2
+    found = {(o['ip'], o['port'], o['product']) for o in j['items']}
+    assert ('192.0.2.10', 22, 'OpenSSH') in found and ('192.0.2.11', 2222, 'OpenSSH') in found
+    assert ('192.0.2.10', None, None) not in found
+
+    top = client.get('/cves/top', params={'limit': 50}).json()
+    assert any(t['cve'] == 'CVE-2023-99991' for t in top)
+    assert client.get('/cves/not-a-cve/occurrences').status_code == 400
+
+
+def test_persistent_cache_single_flight_and_bounds(tmp_path):
+    import threading
+    from persistent_cache import PersistentCache
+    cache = PersistentCache('test', ttl=60, max_entries=3, db_path=tmp_path / 'c.sqlite3')
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'v': 1}
+
+    threads = [threading.Thread(target=lambda: cache.get_or_compute('k', slow)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert cache.get('k') == {'v': 1}
+
+    other = PersistentCache('test', ttl=60, max_entries=3, db_path=tmp_path / 'c.sqlite3')
+    assert other.get('k') == {'v': 1}
+
+    for i in range(5):
+        cache.set(f'x{i}', i)
+    assert cache.stats()['entries'] == 3
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute('boom', lambda: (_ for _ in ()).throw(RuntimeError('down')))
+    assert cache.get('boom') is None
+
+
+def test_nvd_batch_uses_cache(monkeypatch):
+    import nvd_cache
+    fetched = []
+
+    def fake_fetch(cve_id, api_key):
+        fetched.append(cve_id)
+        return {'cve': cve_id, 'cvss': 9.8, 'severity': 'Critical', 'description': 'demo', 'found': True}
+
+    async def fake_fetch_async(cve_id, api_key):
+        return fake_fetch(cve_id, api_key)
+
+    monkeypatch.setattr(nvd_cache, '_consultar_cve', fake_fetch)
+    monkeypatch.setattr(nvd_cache, '_consultar_cve_async', fake_fetch_async)
+    ids = [f'CVE-2099-{i:04d}' for i in range(1, 6)]
+    for c in ids:
+        nvd_cache.NVD_CVE_CACHE.delete(c)
+
+    r = client.post('/nvd/cves', json={'cves': ids + [ids[0].lower()]})
+    assert r.status_code == 200
+    assert r.json()['count'] == 5
+    assert r.json()['cves'][ids[0]]['severity'] == 'Critical'
+    assert sorted(fetched) == ids
+
+    path = client.post('/upload-json', files={'file': ('enrich.json', json.dumps({'v': ids[:2]}), 'application/json')}).json()['path']
+    sm = client.get('/extract-cves', params={'path': path, 'enrich': 'true'}).json()['severity_map']
+    assert sm[ids[0]]['cvss'] == 9.8
+    assert len(fetched) == 5
+
+    assert client.post('/nvd/cves', json={'cves': ['nope']}).status_code == 400
+
+
+def test_http_client_retries_and_limits_per_host(monkeypatch):
+    import http_client
+    import threading
+    monkeypatch.setattr(http_client, '_backoff', lambda attempt, retry_after=None: 0)
+    monkeypatch.setitem(http_client.HOST_LIMITS, 'limit.test', 2)
+    http_client._host_sems.pop('limit.test', None)
+    lock = threading.Lock()
+    state = {'calls': 0, 'active': 0, 'peak': 0}
+
+    class FakeResponse:
+        def __init__(self, status):
+            self.status_code = status
+            self.headers = {}
+
+        def close(self):
+            pass
+
+    def fake_request(method, url, **kwargs):
+        with lock:
+            state['calls'] += 1
+            state['active'] += 1
+            state['peak'] = max(state['peak'], state['active'])
+            status = 503 if state['calls'] == 1 else 200
+        time.sleep(0.05)
+        with lock:
+            state['active'] -= 1
+        return FakeResponse(status)
+
+    monkeypatch.setattr(http_client.get_session(), 'request', fake_request)
+    assert http_client.get('https://limit.test/x').status_code == 200
+    assert state['calls'] == 2
+
+    threads = [threading.Thread(target=http_client.get, args=('https://limit.test/y',)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert state['peak'] == 2
+
+
+def test_shodan_token_bucket_is_shared(tmp_path):
+    from shodan_limiter import TokenBucket
+    a = TokenBucket(rate=20, burst=1, db_path=tmp_path / 'limits.sqlite3')
+    b = TokenBucket(rate=20, burst=1, db_path=tmp_path / 'limits.sqlite3')
+    t0 = time.time()
+    for i in range(6):
+        (a if i % 2 else b).acquire('key')
+    assert time.time() - t0 >= 0.2
+
+    b.penalize('key', 0.3)
+    t0 = time.time()
+    a.acquire('key')
+    assert time.time() - t0 >= 0.25
+
+
+def test_async_acquire_keeps_loop_responsive_while_sqlite_is_locked(tmp_path):
+    import asyncio, sqlite3, threading
+    from shodan_limiter import TokenBucket
+    bucket = TokenBucket(rate=100, burst=10, db_path=tmp_path / 'limits.sqlite3')
+    bucket.acquire('key')
+    #otro proceso con el cubo bloqueado en escritura durante 0.5 s
+    otro = sqlite3.connect(str(tmp_path / 'limits.sqlite3'), isolation_level=None, check_same_thread=False)
+    otro.execute('BEGIN IMMEDIATE')
+    threading.Timer(0.5, lambda: otro.execute('COMMIT')).start()
+
+    async def main():
+        ticks = 0
+        tarea = asyncio.create_task(bucket.aacquire('key'))
+        while not tarea.done():
+            ticks += 1
+            await asyncio.sleep(0.02)
+        await tarea
+        return ticks
+
+    assert asyncio.run(main()) >= 10
+    otro.close()
+
+
+def test_shodan_credit_budget_and_run_rejection(tmp_path, monkeypatch):
+    import app as app_module
+    from shodan_limiter import CreditBudget, estimar_creditos
+    budget = CreditBudget(db_path=tmp_path / 'limits.sqlite3')
+    monkeypatch.setattr(budget, 'info', lambda api_key, refresh=False: {'query_credits': 3, 'scan_credits': 0})
+
+    assert estimar_creditos({'credits': {'kind': 'query', 'param': 'limit', 'per': 100}}, {'limit': '250'}) == ('query', 3)
+    first = budget.reserve('k', 'query', 2)
+    assert first and budget.available('k', 'query') == 1
+    assert budget.reserve('k', 'query', 2) is None
+    budget.release(first)
+    assert budget.available('k', 'query') == 3
+
+    monkeypatch.setattr(app_module, 'CREDITS', budget)
+    r = client.post('/run/shodan_tool', json={'params': {'query': 'apache', 'limit': 500, 'api_key': 'k'}})
+    assert r.status_code == 429
+
+
+def test_jobs_waiting_on_gate_do_not_hold_workers():
+    from jobs import JobManager
+    jobs = JobManager(max_workers=1, gate_poll=0.05)
+    abierto = {'v': False}
+    esperando = jobs.submit('s', {}, lambda job: {'status': 'finished'}, gate=lambda job: abierto['v'])
+    caducado = jobs.submit('s', {}, lambda job: {'status': 'finished'}, gate=lambda job: False, gate_timeout=0.1)
+    #el único worker sigue libre para trabajos sin condición
+    libre = jobs.submit('s', {}, lambda job: {'status': 'finished'})
+    deadline = time.time() + 5
+    while libre.status != 'finished' and time.time() < deadline:
+        time.sleep(0.02)
+    assert libre.status == 'finished' and esperando.status == 'queued'
+    assert jobs.stats()['waiting'] >= 1
+
+    abierto['v'] = True
+    jobs.poke()
+    while (esperando.status != 'finished' or caducado.status != 'error') and time.time() < deadline:
+        time.sleep(0.02)
+    assert esperando.status == 'finished'
+    assert caducado.status == 'error' and 'límite de espera' in caducado.error
+
+
+def test_shodan_key_pool_weights_and_health(tmp_path, monkeypatch):
+    import shodan
+    from shodan_keys import KeyHealth, KeyPool, PooledShodan
+    from shodan_limiter import TokenBucket
+
+    class FakeCredits:
+        def available(self, api_key, kind):
+            return {'a': 3, 'b': 1, 'c': 0}[api_key]
+
+    health = KeyHealth(db_path=tmp_path / 'limits.sqlite3')
+    pool = KeyPool(['a', 'b', 'c'], credits=FakeCredits(), health=health)
+    picks = [pool.next_key() for _ in range(50)]
+    assert picks.count('a') == 3 * picks.count('b') > picks.count('c') > 0
+
+    for _ in range(3):
+        pool.report('a', shodan.APIError('Rate limit reached (429)'))
+    assert 'a' not in pool.healthy()
+    assert health.get('a')['rate_limited'] == 3
+
+    monkeypatch.setattr(shodan.Shodan, '_request',
+                        lambda self, function, params, **kw: (_ for _ in ()).throw(shodan.APIError('Invalid API key'))
+                        if self.api_key == 'b' else {'key': self.api_key})
+    api = PooledShodan(pool, limiter=TokenBucket(rate=1000, burst=10, db_path=tmp_path / 'limits.sqlite3'))
+    assert {api._request('/shodan/host/1.2.3.4', {})['key'] for _ in range(6)} == {'c'}
+    assert api._request('/shodan/alert/info', {}, method='get')['key'] == 'a'
+    assert health.get('b')['errors'] >= 1
+
+
+def test_shodan_tool_dedups_host_lookups(tmp_path, monkeypatch):
+    import importlib.util
+    import logging
+    import threading
+    import host_cache
+    from persistent_cache import PersistentCache
+    monkeypatch.setattr(host_cache, 'HOST_CACHE', PersistentCache('host', ttl=60, db_path=tmp_path / 'c.sqlite3'))
+    spec = importlib.util.spec_from_file_location('shodan_tool', 'scripts/shodan_tool.py')
+    tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tool)
+    matches = [{'ip_str': ip, 'port': port, 'transport': 'tcp', 'data': f'banner {port}\nx', 'org': 'Org'}
+               for ip, port in [('1.1.1.1', 80), ('2.2.2.2', 22), ('1.1.1.1', 443), ('3.3.3.3', 80)]]
+    lock = threading.Lock()
+    calls = []
+
+    class FakeApi:
+        def search(self, query, limit):
+            return {'matches': matches}
+
+        def host(self, ip, minify=False):
+            with lock:
+                calls.append(ip)
+            return {'ip_str': ip, 'org': 'Org', 'data': [m for m in matches if m['ip_str'] == ip]}
+
+    monkeypatch.setattr(tool, 'crear_api', lambda: FakeApi())
+    logger = logging.getLogger('test_shodan_tool')
+
+    full = tool.ejecutar({'query': 'apache', 'limit': 10}, logger)
+    assert sorted(calls) == ['1.1.1.1', '2.2.2.2', '3.3.3.3']
+    assert [h['ip'] for h in full['results']] == ['1.1.1.1', '2.2.2.2', '3.3.3.3']
+
+    calls.clear()
+    fast = tool.ejecutar({'query': 'apache', 'limit': 10, 'details': 'matches'}, logger)
+    assert calls == []
+    assert fast['total_matches'] == 4 and fast['total_hosts'] == 3
+    assert fast['results'][0]['summary']['banners_count'] == 2
+    assert fast['results'][0]['results'][1]['first_line'] == 'banner 443'
+
+
+def test_host_cache_ttl_and_refresh(tmp_path, monkeypatch):
+    import host_cache
+    from persistent_cache import PersistentCache
+    monkeypatch.setattr(host_cache, 'HOST_CACHE', PersistentCache('host', ttl=60, db_path=tmp_path / 'c.sqlite3'))
+    calls = []
+
+    class FakeApi:
+        def host(self, ip, minify=False):
+            calls.append((ip, minify))
+            return {'ip_str': ip, 'last_update': '2026-01-01T00:00:00', 'data': []}
+
+    api = FakeApi()
+    first = host_cache.consultar_host(api, '9.9.9.9')
+    second = host_cache.consultar_host(api, '9.9.9.9')
+    assert calls == [('9.9.9.9', False)]
+    assert not first['cached'] and second['cached']
+    assert second['last_update'] == '2026-01-01T00:00:00'
+
+    assert not host_cache.consultar_host(api, '9.9.9.9', refresh=True)['cached']
+    assert len(calls) == 2
+    from shodan_common import es_cierto
+    assert es_cierto('true') and not es_cierto('false')
+
+
+def test_async_shodan_client_and_host_batch(tmp_path, monkeypatch):
+    import asyncio
+    import http_client
+    import host_cache
+    import shodan_async
+    from persistent_cache import PersistentCache
+    from shodan_limiter import TokenBucket
+    monkeypatch.setattr(host_cache, 'HOST_CACHE', PersistentCache('host', ttl=60, db_path=tmp_path / 'c.sqlite3'))
+    monkeypatch.setattr(shodan_async, 'LIMITER', TokenBucket(rate=1000, burst=50, db_path=tmp_path / 'l.sqlite3'))
+    sent = []
+
+    class FakeResponse:
+        def __init__(self, status, data):
+            self.status_code = status
+            self._data = data
+
+        def json(self):
+            return self._data
+
+    async def fake_request(method, url, retries=None, **kwargs):
+        sent.append((method, url, kwargs.get('params')))
+        await asyncio.sleep(0.01)
+        if url.endswith('/shodan/host/search') and sum(1 for s in sent if s[1] == url) == 1:
+            return FakeResponse(429, {})
+        ip = url.rsplit('/', 1)[-1]
+        if ip == '6.6.6.6':
+            return FakeResponse(200, {'error': 'No information available for that IP.'})
+        return FakeResponse(200, {'ip_str': ip, 'data': [], 'matches': []})
+
+    monkeypatch.setattr(http_client, 'async_request', fake_request)
+    monkeypatch.setattr(shodan_async, 'SHODAN_PENALTY', 0.01)
+
+    api = shodan_async.AsyncShodan('k')
+    r = asyncio.run(api.search('apache', facets=[('country', 5), 'org']))
+    assert r['matches'] == []
+    assert sent[-1][2]['facets'] == 'country:5,org' and sent[-1][2]['key'] == 'k'
+
+    ips = [f'10.0.0.{i}' for i in range(200)]
+    t0 = time.time()
+    out = client.post('/shodan/hosts', json={'ips': ips + ['6.6.6.6', ips[0]], 'api_key': 'k'}).json()
+    assert out['count'] == 201
+    assert out['hosts']['10.0.0.7']['ip_str'] == '10.0.0.7'
+    assert 'No information' in out['hosts']['6.6.6.6']['error']
+    assert time.time() - t0 < 5
+    n = len(sent)
+    client.post('/shodan/hosts', json={'ips': ips[:10], 'api_key': 'k'})
+    assert len(sent) == n
+
+
+def _load_script(name):
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(name, f'scripts/{name}.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeSearchApi:
+    """api.search paginada sobre total coincidencias; fail_on corta una página una vez."""
+
+    def __init__(self, total, fail_on=None):
+        self.total = total
+        self.fail_on = fail_on
+        self.pages = []
+
+    def search(self, query, page=1, facets=None, **kwargs):
+        import shodan
+        if page == self.fail_on:
+            self.fail_on = None
+            raise shodan.APIError('Unable to connect to Shodan')
+        self.pages.append(page)
+        start = (page - 1) * 100
+        matches = [{'ip_str': f'10.0.{i // 256}.{i % 256}', 'port': 80, 'data': 'x\ny'}
+                   for i in range(start, min(start + 100, self.total))]
+        return {'matches': matches, 'total': self.total, 'facets': {'port': [{'value': 80, 'count': 1}]} if facets else {}}
+
+
+def test_global_exposure_paging_and_ndjson_resume(tmp_path):
+    import gzip
+    import logging
+    import shodan
+    ge = _load_script('global_exposure')
+    logger = logging.getLogger('test_global_exposure')
+
+    api = FakeSearchApi(350)
+    res = ge.realizarBusqueda(api, 'q', ['port'], 250, logger)
+    assert res['collected'] == 250 and sorted(api.pages) == [1, 2, 3]
+    assert res['facets'] and res['matches'][150]['data'] == 'x y'
+
+    api = FakeSearchApi(350, fail_on=3)
+    with pytest.raises(shodan.APIError):
+        ge.lanzar(api, 'q', ['port'], 1000, logger, 'ndjson.gz', destino=tmp_path)
+    res = ge.lanzar(api, 'q', ['port'], 1000, logger, 'ndjson.gz', destino=tmp_path)
+    #la página 4 pudo pedirse por adelantado antes del fallo; tras reanudar no hay más
+    assert sorted(set(api.pages)) == [1, 2, 3, 4]
+    assert res['resumed_from_page'] == 3 and res['collected'] == 350 and res['facets']
+    with gzip.open(res['path'], 'rt', encoding='utf-8') as f:
+        ips = [json.loads(line)['ip_str'] for line in f]
+    assert len(ips) == len(set(ips)) == 350
+
+
+def test_global_exposure_prefetch_keeps_page_order(monkeypatch):
+    import logging
+    import threading
+    import time
+    ge = _load_script('global_exposure')
+    logger = logging.getLogger('test_global_exposure_prefetch')
+
+    class SlowApi(FakeSearchApi):
+        def __init__(self, total):
+            super().__init__(total)
+            self.inflight = self.peak = 0
+            self.lock = threading.Lock()
+
+        def search(self, query, page=1, facets=None, **kwargs):
+            with self.lock:
+                self.inflight += 1
+                self.peak = max(self.peak, self.inflight)
+            time.sleep(0.05 * (1 + page % 3))
+            try:
+                return super().search(query, page, facets, **kwargs)
+            finally:
+                with self.lock:
+                    self.inflight -= 1
+
+    api = SlowApi(2000)
+    t0 = time.time()
+    res = ge.realizarBusqueda(api, 'q', ['port'], 2000, logger)
+    assert time.time() - t0 < 1.5
+    assert res['collected'] == 2000 and sorted(api.pages) == list(range(1, 21))
+    assert [m['ip_str'] for m in res['matches']] == [f'10.0.{i // 256}.{i % 256}' for i in range(2000)]
+    assert 1 < api.peak <= ge.PREFETCH
+
+    #sin pasar del total de la búsqueda aunque el límite sea mayor
+    api = SlowApi(430)
+    assert ge.realizarBusqueda(api, 'q', ['port'], 2000, logger)['collected'] == 430
+    assert sorted(api.pages) == [1, 2, 3, 4, 5]
+
+
+def test_global_exposure_facets_only_uses_count_cache(tmp_path, monkeypatch):
+    import logging
+    from persistent_cache import PersistentCache
+    from shodan_limiter import estimar_creditos
+    ge = _load_script('global_exposure')
+    monkeypatch.setattr(ge, 'COUNT_CACHE', PersistentCache('count', ttl=60, db_path=tmp_path / 'c.sqlite3'))
+    logger = logging.getLogger('test_global_exposure_facets')
+
+    class CountApi:
+        calls = []
+
+        def count(self, query, facets=None):
+            self.calls.append((query, tuple(facets)))
+            return {'total': 1234, 'facets': {'port': [{'value': 80, 'count': 900}]}}
+
+    api = CountApi()
+    facetas = ge.parsearFacetas('port:100, country:20')
+    assert facetas == ['port:100', 'country:20']
+    res = ge.lanzar(api, 'q', facetas, 500, logger, 'facets')
+    assert res['mode'] == 'facets' and res['total'] == 1234 and not res['cached']
+    assert ge.lanzar(api, 'q', facetas, 500, logger, 'facets')['cached']
+    ge.lanzar(api, 'q', facetas, 500, logger, 'facets', refresh=True)
+    assert len(api.calls) == 2
+    assert estimar_creditos(ge.SCRIPT_METADATA, {'limit': '500', 'output': 'facets'}) is None
+    assert estimar_creditos(ge.SCRIPT_METADATA, {'limit': '500'}) == ('query', 5)
+
+
+def test_realtime_monitor_streams_events_to_ndjson(tmp_path):
+    import logging
+    import shodan
+    rm = _load_script('realtime_monitor')
+    logger = logging.getLogger('test_realtime_monitor')
+
+    class FakeStream:
+        def __init__(self):
+            self.calls = 0
+
+        def alert(self, aid, timeout=None):
+            self.calls += 1
+            if self.calls == 1:
+                raise shodan.APIError('Unable to contact the Shodan Streaming API')
+            if self.calls == 2:
+                for i in range(5):
+                    yield {'ip_str': f'10.0.0.{i % 2}', 'port': 22 if i % 2 else 80, 'timestamp': f't{i}',
+                           'shodan': {'module': 'ssh' if i % 2 else 'http'}, 'data': 'a\nb'}
+                raise shodan.APIError('Stream timed out')
+            time.sleep(0.05)
+            raise shodan.APIError('Stream timed out')
+
+    class FakeApi:
+        stream = FakeStream()
+        deleted = []
+
+        def delete_alert(self, aid):
+            self.deleted.append(aid)
+
+    rm.STREAM_BACKOFF_MAX = 0.01
+    api = FakeApi()
+    final = tmp_path / 'rt_final.json'
+    rm.alerta(api, 'A1', 0.3, logger, str(final))
+
+    #los 5 banners son 2 servicios: los repetidos de la ventana no se guardan
+    lines = (tmp_path / 'rt_events.ndjson').read_text(encoding='utf-8').splitlines()
+    assert len(lines) == 2 and json.loads(lines[0])['data'] == ['a', 'b']
+    assert [json.loads(l)['module'] for l in lines] == ['http', 'ssh']
+    data = json.loads(final.read_text(encoding='utf-8'))['data'][0]
+    assert data['events_collected'] == 2 and data['reconnects'] >= 2
+    assert data['summary']['unique_ips'] == 2 and data['summary']['duplicates'] == 3
+    assert data['summary']['per_minute'][-1]['new_services'] == 2
+    assert api.deleted == ['A1']
+
+
+def test_alert_hub_demultiplexes_one_stream():
+    import asyncio
+    from alert_stream import AlertHub
+
+    conexiones = []
+
+    async def firehose():
+        conexiones.append(1)
+        for i in range(10):
+            yield {'ip_str': f'10.0.0.{i}', 'port': 80, '_shodan': {'module': 'http', 'alert': {'id': 'A' if i % 2 else 'B'}}}
+            await asyncio.sleep(0)
+        await asyncio.sleep(3600)
+
+    async def main():
+        hub = AlertHub('k' * 32, stream_factory=firehose)
+        todos = hub.subscribe()
+        solo_a = hub.subscribe(['A'])
+        lento = hub.subscribe(['B'], maxsize=2)
+        recibidos = [await todos.get(timeout=1) for _ in range(10)]
+        de_a = [await solo_a.get(timeout=1) for _ in range(5)]
+        assert [e['ip_str'] for e in recibidos] == [f'10.0.0.{i}' for i in range(10)]
+        assert {e['alert_id'] for e in de_a} == {'A'} and await solo_a.get(timeout=0.05) is None
+        #el lento se queda con los dos últimos de B y cuenta los descartados
+        assert lento.dropped == 3 and [e['ip_str'] for e in lento.queue] == ['10.0.0.6', '10.0.0.8']
+        stats = hub.stats()
+        assert stats['events'] == 10 and stats['events_by_alert'] == {'A': 5, 'B': 5} and len(conexiones) == 1
+        assert hub.aggregates('A', minutes=5)['A']['window']['unique_ips'] == 5
+        for sub in (todos, solo_a, lento):
+            await hub.unsubscribe(sub)
+        assert hub._task is None and not hub.subscribers
+
+    asyncio.run(main())
+    assert client.get('/alerts/monitor').json() == {'hubs': []}
+
+
+def test_stream_stats_sketches_and_window_dedup():
+    from stream_stats import CountMinSketch, DedupWindow, HyperLogLog, ProcesadorEventos
+
+    hll = HyperLogLog()
+    for i in range(20000):
+        hll.add(f'10.{i // 65536}.{i // 256 % 256}.{i % 256}')
+    assert abs(hll.count() - 20000) < 20000 * 0.05
+
+    cms = CountMinSketch(width=256)
+    for i in range(1000):
+        cms.add(i % 50)
+    assert all(cms.estimate(k) >= 20 for k in range(50)) and cms.estimate(7) < 40
+
+    ventana = DedupWindow(window=60)
+    assert not ventana.seen('a', now=0) and ventana.seen('a', now=59)
+    assert not ventana.seen('a', now=61) and len(ventana) == 1
+
+    proc = ProcesadorEventos(dedup_window=60)
+    evt = lambda ip, port: {'ip_str': ip, 'port': port, 'module': 'http'}
+    assert proc.add(evt('1.1.1.1', 80), now=0) and not proc.add(evt('1.1.1.1', 80), now=10)
+    assert proc.add(evt('1.1.1.2', 80), now=30)
+    #pasada la ventana vuelve a pasar, pero como servicio ya visto
+    assert proc.add(evt('1.1.1.1', 80), now=90)
+    agg = proc.aggregates()
+    assert agg['events'] == 4 and agg['duplicates'] == 1 and agg['unique_ips'] == 2
+    m0, m1 = agg['per_minute']
+    assert (m0['events'], m0['duplicates'], m0['new_services'], m0['unique_ips']) == (3, 1, 2, 2)
+    assert (m1['new_services'], m1['seen_services']) == (0, 1)
+    assert {i['ip'] for i in m0['top_ips']} == {'1.1.1.1', '1.1.1.2'}
+    assert proc.aggregates(minutes=1, now=90)['window']['events'] == 1
+    #la ventana es de minutos de reloj: un evento aislado horas después no arrastra los antiguos
+    assert proc.add(evt('1.1.1.3', 80), now=3 * 3600)
+    assert proc.aggregates(minutes=15, now=3 * 3600)['window']['events'] == 1
+    assert proc.aggregates(minutes=15, now=4 * 3600)['window']['events'] == 0
+    assert len(proc.minutos) == 1
+
+
+def test_batch_scan_groups_targets_and_polls_adaptively(tmp_path, monkeypatch):
+    import shodan
+    import batch_scan
+    import host_cache
+    from persistent_cache import PersistentCache
+    from shodan_limiter import estimar_creditos
+    monkeypatch.setattr(host_cache, 'HOST_CACHE', PersistentCache('host', ttl=60, db_path=tmp_path / 'c.sqlite3'))
+    monkeypatch.setattr(batch_scan, 'TARGET_FILE_DIRS', [tmp_path])
+    lista = tmp_path / 'objetivos.txt'
+    lista.write_text('10.0.0.1  # router\n10.0.0.2\n\n10.0.1.0/30\n', encoding='utf-8')
+
+    objetivos = batch_scan.expandir_objetivos(f'{lista}')
+    assert objetivos == ['10.0.0.1', '10.0.0.2', '10.0.1.0/30']
+    assert batch_scan.expandir_objetivos('objetivos.txt') == objetivos
+    assert batch_scan.expandir_objetivos('10.0.0.1, 10.0.0.1 10.0.0.9/32') == ['10.0.0.1', '10.0.0.9']
+    assert batch_scan.contar_ips(objetivos) == 6
+    with pytest.raises(ValueError):
+        batch_scan.expandir_objetivos('10.0.0.1, example.com')
+    with pytest.raises(ValueError, match='demasiado grande'):
+        batch_scan.expandir_objetivos('10.0.0.0/16')
+    #fuera de los directorios permitidos no se lee, y los errores no repiten el contenido
+    fuera = tmp_path.parent / f'{tmp_path.name}_fuera.txt'
+    fuera.write_text('10.0.0.1\n', encoding='utf-8')
+    with pytest.raises(ValueError):
+        batch_scan.expandir_objetivos(str(fuera))
+    (tmp_path / 'secreto.txt').write_text('10.0.0.1\ntoken-secreto\n', encoding='utf-8')
+    with pytest.raises(ValueError) as err:
+        batch_scan.expandir_objetivos('secreto.txt')
+    assert 'línea 2' in str(err.value) and 'token-secreto' not in str(err.value)
+    meta = _load_script('active_scan').SCRIPT_METADATA
+    assert estimar_creditos(meta, {'target': '10.0.0.0/29, 10.0.1.1'}) == ('scan', 9)
+
+    class ScanApi:
+        def __init__(self):
+            self.submitted, self.polls, self.hosts = [], [], []
+
+        def scan(self, ips):
+            self.submitted.append(ips)
+            return {'id': f'S{len(self.submitted)}', 'count': len(ips), 'credits_left': 100}
+
+        def scan_status(self, sid):
+            self.polls.append(sid)
+            #S1 termina al tercer sondeo, S2 al quinto
+            n = self.polls.count(sid)
+            return {'status': 'DONE' if n >= (3 if sid == 'S1' else 5) else 'PROCESSING'}
+
+        def host(self, ip, **kw):
+            self.hosts.append(ip)
+            if ip.endswith('.2'):
+                raise shodan.APIError('No information available for that IP.')
+            return {'ip_str': ip, 'data': [{'port': 22}]}
+
+    esperas = []
+    api = ScanApi()
+    scans = batch_scan.lanzar_escaneos(api, batch_scan.agrupar(objetivos, 2))
+    assert api.submitted == [['10.0.0.1', '10.0.0.2'], '10.0.1.0/30']
+    hechos = [s['id'] for s in batch_scan.esperar_escaneos(api, scans, poll_min=1, poll_max=3, sleep=esperas.append)]
+    assert hechos == ['S1', 'S2']
+    #vuelve al mínimo cuando algo cambia y crece mientras no
+    assert esperas == [1, 1.5, 1, 1.5]
+
+    monkeypatch.setattr(batch_scan.time, 'sleep', lambda s: None)
+    api = ScanApi()
+    lote = batch_scan.escanear_lote(api, objetivos, batch_size=2, max_workers=4)
+    assert sorted(lote['hosts']) == ['10.0.0.1', '10.0.0.2', '10.0.1.1', '10.0.1.2']
+    assert lote['hosts']['10.0.0.1']['data'] == [{'port': 22}]
+    assert 'No information' in lote['hosts']['10.0.0.2']['error']
+    assert len(api.submitted) == 2 and sorted(api.hosts) == sorted(lote['hosts'])
+
+
+def test_escaneo_cve_enrichment_is_deduplicated_and_batched(monkeypatch):
+    cve = _load_script('escaneo_activo_cve')
+    nvd, vulners = [], []
+
+    def fake_nvd(product, version, key=''):
+        nvd.append((product, version))
+        return [{'cve': {'id': f'CVE-2024-{product[:3]}{i}'}, 'cvss': 9.8, 'description': 'x'} for i in range(3)]
+
+    class Resp:
+        status_code = 200
+
+        def __init__(self, ids):
+            self.ids = ids
+
+        def json(self):
+            return {'data': {'documents': {
+                f'EDB-{c}': {'type': 'exploit', 'title': c, 'href': 'h', 'cvelist': [c, 'CVE-OTRO']} for c in self.ids
+            }}}
+
+    def fake_post(url, json=None, **kw):
+        vulners.append(list(json['id']))
+        return Resp(json['id'])
+
+    monkeypatch.setattr(cve, 'buscar_items_nvd', lambda p, v, k='': [
+        {'cve': {'id': c['cve']['id']}} for c in fake_nvd(p, v)])
+    monkeypatch.setattr(cve, 'cvss_de_item', lambda item: 9.8)
+    monkeypatch.setattr(cve, 'descripcion_de_item', lambda item: 'x')
+    monkeypatch.setattr(cve.http_client, 'post', fake_post)
+    monkeypatch.setattr(cve, 'VULNERS_CHUNK', 4)
+
+    banners = [{'port': 80, 'product': 'nginx', 'version': '1.18.0'},
+               {'port': 8080, 'product': 'nginx', 'version': '1.18.0'},
+               {'port': 22, 'data': 'SSH-2.0-OpenSSH_8.2p1'},
+               {'port': 3306, 'product': 'mysql', 'version': '1'}]
+    hosts = {f'10.0.0.{i}': {'ip_str': f'10.0.0.{i}', 'data': banners} for i in range(3)}
+    res = cve.enriquecerHosts(hosts, maxWorkers=4)
+
+    #2 productos con versión válida -> 2 consultas NVD; 6 CVEs -> 2 bloques de Vulners
+    assert sorted(nvd) == [('OpenSSH', '8.2'), ('nginx', '1.18.0')]
+    assert sorted(len(b) for b in vulners) == [2, 4]
+    r = res['10.0.0.1']
+    assert r['ports'] == [22, 80, 3306, 8080] and r['banners_count'] == 4
+    assert len(r['vulns_nvd']) == 9
+    v = r['vulns']['CVE-2024-ngi0']
+    assert v['exploits'] == [{'title': 'CVE-2024-ngi0', 'href': 'h', 'type': 'exploit', 'cve': 'CVE-2024-ngi0'}]
+    assert r['nvd_errors'] == []
+
+    #una caída de NVD no deja el servicio como limpio: queda marcado
+    def nvd_caido(p, v, k=''):
+        raise RuntimeError('NVD 503')
+    monkeypatch.setattr(cve, 'buscar_items_nvd', nvd_caido)
+    r = cve.enriquecerHosts({'10.0.0.9': {'ip_str': '10.0.0.9', 'data': banners[:1]}})['10.0.0.9']
+    assert r['vulns_nvd'] == [] and r['nvd_errors'] == ['NVD 503']
+    assert r['banners'][0]['nvd_error'] == 'NVD 503'
@@ -7,14 +7,16 @@ import ChartsPanel from './components/ChartsPanel';
 import VulnerabilitiesPanel from './components/VulnerabilitiesPanel';
 import ReportExport from './components/ReportExport';
 import './index.css'; 
-import API_BASE, { listResults, getResultFile, normalizeData } from './utils';
+import API_BASE, { listResults, getResultRows, normalizeData } from './utils';
+
+// filas por petición a /results/{name}/rows; la tabla pide más bajo demanda
+const ROWS_PAGE = 200;
 
 
 
 export default function App() {
-  const [selected, setSelected] = useState({ name: '', data: null, path: '' });
+  const [selected, setSelected] = useState({ name: '', data: null, path: '', total: 0 });
   const [lastRun, setLastRun] = useState(null);
-  const [results, setResults] = useState([]);
   const [loading, setLoading] = useState(false);
   const [runStatus, setRunStatus] = useState(null);
   const [apiKey, setApiKey] = useState('');
@@ -59,26 +61,13 @@ export default function App() {
     console.log("[App] Cargando resultados iniciales...");
     setLoading(true);
     try {
-      const resList = await listResults();
-      console.log("[App] listResults =>", resList);
-
-      setResults(resList);
+      // el listado va por páginas: se pide explícitamente el resultado más reciente
+      const [latest] = await listResults({ kind: 'result', sort: 'created_at', order: 'desc', limit: 1 });
+      console.log("[App] último resultado =>", latest);
 
-      if (resList.length > 0) {
-        const latest = resList[resList.length - 1];
+      if (latest) {
         console.log("[App] Cargando el último archivo:", latest);
-
-        const data = await getResultFile(latest.path || latest);
-        console.log("[App] Contenido del archivo cargado:", data);
-
-        const norm = normalizeData(data);
-        console.log("[App] normalizado:", norm);
-
-        setSelected({
-          name: latest.name || latest.path?.split('/').pop(),
-          data: norm,
-          path: latest.path || latest,
-        });
+        await loadResult(latest.name, latest.path);
       }
     } catch (e) {
       console.error('Error al cargar los resultados iniciales:', e);
@@ -90,20 +79,23 @@ export default function App() {
 }, []);
 
 
-  useEffect(() => {
-    if (!lastRun) return;
-    (async () => {
-      try {
-        const res = await listResults();
-        setResults(res);
-      } catch (e) {
-        console.error('Error al obtener los resultados:', e);
-      }
-    })();
-  }, [lastRun]);
-  
 
 
+  // primera página de filas ya recortadas en el servidor, sin descargar el archivo entero
+  async function loadResult(name, path) {
+    const page = await getResultRows(name, { limit: ROWS_PAGE });
+    setSelected({ name, path, data: { raw: page, items: page.rows || [] }, total: page.total ?? 0 });
+  }
+
+  async function loadMoreRows() {
+    const offset = selected.data?.items.length || 0;
+    const page = await getResultRows(selected.name, { offset, limit: ROWS_PAGE });
+    setSelected(prev => ({
+      ...prev,
+      data: { ...prev.data, items: [...prev.data.items, ...(page.rows || [])] },
+    }));
+  }
+
   async function handleRunFinished(res) {
 		console.log("[App] handleRunFinished recibido:", res);
 
@@ -139,10 +131,12 @@ export default function App() {
 
 		else if (res.out_path) {
 		  try {
-			rawData = await getResultFile(res.out_path);
+			await loadResult(res.out_path.split(/[\\/]/).pop(), res.out_path);
+			setRunStatus("Finished");
 		  } catch (e) {
 			console.error("[App] Error al obtener el archivo de resultados:", e);
 		  }
+		  return;
 		}
 
 
@@ -163,9 +157,10 @@ export default function App() {
 		console.log("[App] normalized (final):", norm);
 
 		setSelected({
-		  name: res.filename || res.out_path || "last_run",
+		  name: res.filename || "last_run",
 		  data: norm,
-		  path: res.out_path || "",
+		  path: "",
+		  total: norm.items.length,
 		});
 
 		setRunStatus("Finished");		
@@ -192,15 +187,12 @@ export default function App() {
 			  <JsonManager
 			    apiKey={apiKey}
 				setApiKey={setApiKey}
-				onSelect={(n, d, p) =>
-				  setSelected({ name: n, data: normalizeData(d), path: p })
-				}
+				onSelect={(n, p) => loadResult(n, p)}
 				normalizeData={normalizeData}
 				lastRun={lastRun}
 				vulnerabilitiesPath={selected.path}
 				reportData={selected.data?.items}
 				reportName={selected.name || 'report'}
-				results={results}
 			  />
 			</div>
 		  </div>
@@ -216,7 +208,11 @@ export default function App() {
 			  
 				<SummaryPanel data={selected.data.raw} />
 				<ChartsPanel data={selected.data.items} />
-				<TableView data={selected.data.items} />
+				<TableView
+				  data={selected.data.items}
+				  total={selected.total}
+				  onLoadMore={selected.path ? loadMoreRows : undefined}
+				/>
 			  </>
 			) : (
 			  <div className="no-data">
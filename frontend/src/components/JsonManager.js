@@ -1,13 +1,15 @@
 import React, { useEffect, useState } from 'react';
 import VulnerabilitiesPanel from './VulnerabilitiesPanel';
 import ReportExport from './ReportExport';
-import { listResults, getResultFile, uploadJSON } from '../utils';
+import { listResults, uploadJSON } from '../utils';
 import { JsonView } from 'react-json-view-lite';
 import 'react-json-view-lite/dist/index.css';
 
 
 export default function JsonManager({ onSelect, lastRun, vulnerabilitiesPath, reportData, reportName, apiKey }) {
   const [files, setFiles] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [totalFiles, setTotalFiles] = useState(0);
   const [credits, setCredits] = useState(null);
   const [fetchingCredits, setFetchingCredits] = useState(false);
   const [publicIp, setPublicIp] = useState('');
@@ -15,16 +17,27 @@ export default function JsonManager({ onSelect, lastRun, vulnerabilitiesPath, re
   const [apiInfo, setApiInfo] = useState(null);
 
 
-  useEffect(() => refresh(), []);
+  useEffect(() => { refresh(); }, [lastRun]);
 
+  // /results va por páginas (más recientes primero); el resto se pide con el cursor
   async function refresh() {
     const r = await listResults();
-    setFiles(r);
+    setFiles([...r]);
+    setNextCursor(r.nextCursor);
+    setTotalFiles(r.total);
   }
 
-  async function handleSelect(p, n) {
-    const d = await getResultFile(p);
-    onSelect(n, d, p);
+  async function loadMore() {
+    if (!nextCursor) return;
+    const r = await listResults({ cursor: nextCursor });
+    setFiles(prev => [...prev, ...r]);
+    setNextCursor(r.nextCursor);
+    setTotalFiles(r.total);
+  }
+
+  // App pide las filas paginadas del archivo; aquí no se descarga entero
+  function handleSelect(p, n) {
+    onSelect(n, p);
   }
 
   async function handleUpload(e) {
@@ -32,8 +45,7 @@ export default function JsonManager({ onSelect, lastRun, vulnerabilitiesPath, re
     if (!f) return;
     const r = await uploadJSON(f);
     await refresh();
-    const d = await getResultFile(r.path);
-    onSelect(f.name, d, r.path);
+    onSelect(r.path.split(/[\\/]/).pop(), r.path);
   }
   
   
@@ -201,6 +213,11 @@ export default function JsonManager({ onSelect, lastRun, vulnerabilitiesPath, re
 		  ))}
 		</select>
 	  )}
+	  {nextCursor && (
+		<button onClick={loadMore} style={{ alignSelf: 'flex-start' }}>
+		  Cargar más archivos ({files.length} de {totalFiles})
+		</button>
+	  )}
 	</div>	
 	
 	{vulnerabilitiesPath && (
@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { runScript, getResultFile } from '../utils';
+import { runScript, streamJob } from '../utils';
 import ShodanAlertsPanel from './ShodanAlertsPanel';
 
 export default function RunPanel({ onStarted, apiKey, setApiKey }) {
@@ -10,6 +10,7 @@ export default function RunPanel({ onStarted, apiKey, setApiKey }) {
   const [scriptsMeta, setScriptsMeta] = useState({});
   const [delay, setDelay] = useState(1.0);
   const [maxIps, setMaxIps] = useState(0);
+  const [liveLines, setLiveLines] = useState([]);
  
  
   useEffect(() => {
@@ -65,7 +66,14 @@ export default function RunPanel({ onStarted, apiKey, setApiKey }) {
       if (apiKey?.trim()) payload.api_key = apiKey.trim();
 
       setStatus('Requesting backend...');
-      const res = await runScript(script, payload);
+      setLiveLines([]);
+      const res = await runScript(script, payload, {
+        onProgress: job => setStatus(`Job ${job.status}...`),
+        onStarted: jobId => streamJob(jobId, {
+          onLine: l => setLiveLines(prev => [...prev.slice(-199), l.line]),
+          onProgress: p => setStatus(`${p.current}/${p.total} ${p.target}`)
+        })
+      });
 
       if (res?.error) {
         setStatus(`Error: ${res.error}`);
@@ -74,16 +82,21 @@ export default function RunPanel({ onStarted, apiKey, setApiKey }) {
       }
 
       if (res.status !== 'finished') {
-        setStatus(res.status || 'Unknown');
+        setStatus(res.status === 'error' ? `Error: ${res.error_file || res.error || 'job failed'}` : res.status || 'Unknown');
         onStarted?.(null);
         return;
       }
 
       setStatus('Finished');
 
+      // con out_path App pide las filas paginadas al servidor en vez del archivo entero
+      if (!res.data && res.out_path) {
+        onStarted?.({ out_path: res.out_path });
+        return;
+      }
+
       let data = null;
       if (res.data) data = res.data;
-      else if (res.out_path) data = await getResultFile(res.out_path);
       else if (looksLikeDataObject(res)) data = res;
 
       if (!data) {
@@ -214,6 +227,12 @@ export default function RunPanel({ onStarted, apiKey, setApiKey }) {
         </span>
       </div>
 		
+      {liveLines.length > 0 && (
+        <pre style={{ maxHeight: 200, overflow: 'auto', fontSize: 11, background: '#f7f7f7', padding: 6 }}>
+          {liveLines.join('\n')}
+        </pre>
+      )}
+		
 	<ShodanAlertsPanel apiKey={apiKey} />
 	  
     </div>
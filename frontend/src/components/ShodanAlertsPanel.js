@@ -1,9 +1,29 @@
-import React, { useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
+import { streamAlerts } from '../utils';
+
+// eventos en vivo que se muestran por alerta
+const MAX_LIVE = 50;
 
 export default function ShodanAlertsPanel({ apiKey }) {
   const [alerts, setAlerts] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  const [liveId, setLiveId] = useState(null);
+  const [live, setLive] = useState([]);
+  const [dropped, setDropped] = useState(0);
+  const esRef = useRef(null);
+
+  // una suscripción SSE a la vez; se cierra al cambiar de alerta o desmontar
+  useEffect(() => {
+    if (!liveId || !apiKey) return undefined;
+    setLive([]);
+    setDropped(0);
+    esRef.current = streamAlerts(apiKey, [liveId], {
+      onEvent: evt => setLive(prev => [evt, ...prev].slice(0, MAX_LIVE)),
+      onDropped: d => setDropped(d.dropped),
+    });
+    return () => esRef.current?.close();
+  }, [liveId, apiKey]);
 
   const fetchAlerts = async () => {
     if (!apiKey) {
@@ -71,10 +91,30 @@ export default function ShodanAlertsPanel({ apiKey }) {
               >
                 Eliminar
               </button>
+              <button
+                onClick={() => setLiveId(liveId === a.id ? null : a.id)}
+                style={{ marginLeft: 6, borderRadius: 6, padding: "4px 8px" }}
+              >
+                {liveId === a.id ? "Detener" : "En vivo"}
+              </button>
             </li>
           ))}
         </ul>
       )}
+
+      {liveId && (
+        <div style={{ marginTop: 10 }}>
+          <strong>Eventos en vivo ({live.length})</strong>
+          {dropped > 0 && <span style={{ color: "#b45309", marginLeft: 8 }}>{dropped} descartados</span>}
+          <ul style={{ maxHeight: 240, overflowY: "auto", fontFamily: "monospace", fontSize: 12 }}>
+            {live.map((e, i) => (
+              <li key={`${e.ip_str}:${e.port}:${e.timestamp}:${i}`}>
+                {e.timestamp} {e.ip_str}:{e.port} {e.module || ""}
+              </li>
+            ))}
+          </ul>
+        </div>
+      )}
     </div>
   );
 }
@@ -1,6 +1,7 @@
 import React from "react";
 
-export default function TableView({ data }) {
+// total/onLoadMore: filas paginadas en el servidor; el botón pide la siguiente página
+export default function TableView({ data, total, onLoadMore }) {
   if (!data || !Array.isArray(data) || data.length === 0) {
     return <p style={{ textAlign: "center" }}>No data to display.</p>;
   }
@@ -178,6 +179,12 @@ export default function TableView({ data }) {
           </tbody>
         </table>
       </div>
+      {total > data.length && (
+        <div style={{ marginTop: 6, display: "flex", alignItems: "center", gap: 8 }}>
+          <span style={{ fontSize: 12 }}>Mostrando {data.length} de {total} filas</span>
+          {onLoadMore && <button onClick={onLoadMore}>Cargar más filas</button>}
+        </div>
+      )}
     </div>
   );
 }
@@ -3,9 +3,14 @@ const API_BASE = process.env.REACT_APP_API_BASE || 'http://localhost:8000'
 console.log('[DEBUG] Using API base:', API_BASE);
 
 
-export async function listResults() {
-  const r = await fetch(`${API_BASE}/results`);
-  return r.json();
+// filtros opcionales: script, target, status, kind, since, until, sort, order, limit, cursor
+export async function listResults(filters = {}) {
+  const qs = new URLSearchParams(Object.entries(filters).filter(([, v]) => v != null && v !== ''));
+  const r = await fetch(`${API_BASE}/results${qs.toString() ? `?${qs}` : ''}`);
+  const items = await r.json();
+  items.nextCursor = r.headers.get('X-Next-Cursor');
+  items.total = Number(r.headers.get('X-Total-Count') || items.length);
+  return items;
 }
 
 export async function getResultFile(path) {
@@ -13,6 +18,16 @@ export async function getResultFile(path) {
   return r.json();
 }
 
+// filas recortadas en el servidor: { fields: ['ip_str', 'port'], offset, limit, sort: '-cvss' }
+export async function getResultRows(name, { fields, offset = 0, limit = 100, sort, collection } = {}) {
+  const qs = new URLSearchParams({ offset, limit });
+  if (fields?.length) qs.set('fields', fields.join(','));
+  if (sort) qs.set('sort', sort);
+  if (collection) qs.set('collection', collection);
+  const r = await fetch(`${API_BASE}/results/${encodeURIComponent(name)}/rows?${qs}`);
+  return r.json();
+}
+
 export async function uploadJSON(file) {
   const fd = new FormData();
   fd.append('file', file);
@@ -20,20 +35,64 @@ export async function uploadJSON(file) {
   return r.json();
 }
 
-export async function extractCVEs(path) {
-  const r = await fetch(`${API_BASE}/extract-cves?path=${encodeURIComponent(path)}`);
+export async function extractCVEs(path, { enrich = false } = {}) {
+  const r = await fetch(`${API_BASE}/extract-cves?path=${encodeURIComponent(path)}${enrich ? '&enrich=true' : ''}`);
+  return r.json();
+}
+
+// CVSS, severidad y descripción de muchos CVEs en una sola petición
+export async function enrichCVEs(cves) {
+  const r = await fetch(`${API_BASE}/nvd/cves`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ cves })
+  });
+  return r.json();
+}
+
+export async function getJob(jobId) {
+  const r = await fetch(`${API_BASE}/jobs/${jobId}`);
   return r.json();
 }
 
-export async function runScript(name, params) {
+// salida en vivo del trabajo (Server-Sent Events); devuelve el EventSource para cerrarlo
+export function streamJob(jobId, { onLine, onProgress, onEnd } = {}) {
+  const es = new EventSource(`${API_BASE}/jobs/${jobId}/stream`);
+  es.addEventListener('line', e => onLine?.(JSON.parse(e.data)));
+  es.addEventListener('progress', e => onProgress?.(JSON.parse(e.data)));
+  es.addEventListener('end', e => { es.close(); onEnd?.(JSON.parse(e.data)); });
+  return es;
+}
+
+// banners de alertas en vivo por la conexión compartida del backend; devuelve el EventSource
+export function streamAlerts(apiKey, alertIds = [], { onEvent, onDropped } = {}) {
+  const qs = new URLSearchParams({ api_key: apiKey });
+  if (alertIds.length) qs.set('alert_id', alertIds.join(','));
+  const es = new EventSource(`${API_BASE}/alerts/stream?${qs}`);
+  es.addEventListener('alert', e => onEvent?.(JSON.parse(e.data)));
+  es.addEventListener('dropped', e => onDropped?.(JSON.parse(e.data)));
+  return es;
+}
+
+// /run devuelve un job_id al instante; se consulta /jobs/{id} hasta que termina
+export async function runScript(name, params, { pollMs = 2000, onProgress, onStarted } = {}) {
   const res = await fetch(`${API_BASE}/run/${name}`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
     body: JSON.stringify({ params })
   });
 
+  const started = await res.json();
+  if (!res.ok || !started.job_id) return started;
+  onStarted?.(started.job_id);
 
-  return res.json(); 
+  let job = started.job;
+  while (job.status !== 'finished' && job.status !== 'error') {
+    await new Promise(resolve => setTimeout(resolve, pollMs));
+    job = await getJob(started.job_id);
+    onProgress?.(job);
+  }
+  return { ...job, job_id: started.job_id };
 }
 
 